@@ -0,0 +1,120 @@
+import argparse
+import time
+from benchmarks.clean_data_frame import make_dirty_frame
+from src.excel.batch_builder import build_batch_records, location_params, metric_params
+from src.utils.helpers import clean_data_frame
+
+
+def legacy_prepare_batch(batch_df):
+    # Per-row preparation that build_batch_records replaced: iterrows plus try/except coercion per field
+    prepared = []
+    for _, row in batch_df.iterrows():
+        google_id = row.get('google_id')
+        has_google_id = bool(google_id and str(google_id).strip() not in ('', 'nan', 'None'))
+
+        try:
+            rating = float(row.get('rating', 0.0))
+        except:
+            rating = 0.0
+
+        try:
+            reviews = int(row.get('reviews', 0))
+        except:
+            reviews = 0
+
+        try:
+            reviews_per_score = [int(row.get(f'reviews_per_score_{score}', 0)) for score in range(1, 6)]
+        except:
+            reviews_per_score = [0] * 5
+
+        try:
+            photos_count = int(row.get('photos_count', 0))
+        except:
+            photos_count = 0
+
+        try:
+            latitude = float(row.get('latitude', 0.0))
+            longitude = float(row.get('longitude', 0.0))
+        except:
+            latitude = longitude = 0.0
+
+        postal_code = str(row.get('postal_code', ''))
+        if postal_code.lower() in ['nan', 'none']:
+            postal_code = ''
+
+        location = {
+            'PlaceId': str(row.get('place_id', '')),
+            'Name': str(row.get('name', '')),
+            'Type': str(row.get('type', '')),
+            'Phone': str(row.get('phone', '')),
+            'FullAddress': str(row.get('full_address', '')),
+            'PostalCode': postal_code,
+            'State': str(row.get('state', '')),
+            'LocationLink': str(row.get('location_link', '')),
+            'Country': str(row.get('country', '')),
+            'CountryCode': str(row.get('country_code', '')),
+            'Timezone': str(row.get('time_zone', '')),
+            'Latitude': latitude,
+            'Longitude': longitude,
+            'Verified': bool(row.get('verified', False)),
+        }
+        metric = {
+            'Rating': rating,
+            'Reviews': reviews,
+            'ReviewsPerScore1': reviews_per_score[0],
+            'ReviewsPerScore2': reviews_per_score[1],
+            'ReviewsPerScore3': reviews_per_score[2],
+            'ReviewsPerScore4': reviews_per_score[3],
+            'ReviewsPerScore5': reviews_per_score[4],
+            'PhotosCount': photos_count,
+        }
+        prepared.append((google_id, has_google_id, location, metric))
+    return prepared
+
+
+def legacy_prepare(frame, batch_size):
+    batches = [frame.iloc[start:start + batch_size] for start in range(0, len(frame), batch_size)]
+    return [legacy_prepare_batch(batch) for batch in batches]
+
+
+def columnar_prepare(frame, batch_size):
+    # Records are built once per cleaned frame and batches are plain list slices
+    records = build_batch_records(frame)
+    return [records[start:start + batch_size] for start in range(0, len(records), batch_size)]
+
+
+def as_parameters(batches):
+    return [[(record.GoogleId, record.HasGoogleId, location_params(record), metric_params(record))
+             for record in batch] for batch in batches]
+
+
+def time_prepare(prepare_function, frame, batch_size):
+    start = time.perf_counter()
+    batches = prepare_function(frame, batch_size)
+    return time.perf_counter() - start, batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch preparation before and after the columnar builder.")
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    frame = clean_data_frame(make_dirty_frame(args.rows))
+
+    legacy_time, legacy_batches = time_prepare(legacy_prepare, frame, args.batch_size)
+    columnar_time, columnar_batches = time_prepare(columnar_prepare, frame, args.batch_size)
+
+    if legacy_batches != as_parameters(columnar_batches):
+        raise AssertionError("Columnar batch preparation does not match the per-row reference")
+
+    batches = columnar_batches
+    per_batch = lambda elapsed: elapsed / len(batches) * 1000
+    print(f"Rows: {args.rows}, batch size: {args.batch_size}, batches: {len(batches)}")
+    print(f"iterrows:  {legacy_time:.3f}s ({per_batch(legacy_time):.3f} ms/batch, {args.rows / legacy_time:,.0f} rows/sec)")
+    print(f"columnar:  {columnar_time:.3f}s ({per_batch(columnar_time):.3f} ms/batch, {args.rows / columnar_time:,.0f} rows/sec)")
+    print(f"Speedup:   {legacy_time / columnar_time:.1f}x, parameters identical")
+
+
+if __name__ == '__main__':
+    main()
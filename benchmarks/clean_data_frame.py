@@ -0,0 +1,131 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from src.configurations.config import TARGET_COLUMNS
+from src.utils.helpers import clean_data_frame
+
+
+def legacy_clean_data_frame(df):
+    # Row-wise implementation that clean_data_frame replaced, kept as the reference output
+    string_columns = ['name', 'type', 'phone', 'full_address', 'state',
+                      'location_link', 'place_id', 'google_id', 'country', 'country_code', 'time_zone']
+    for col in string_columns:
+        if col in df.columns:
+            df[col] = df[col].fillna('')
+            df[col] = df[col].astype(str)
+            df[col] = df[col].replace(r'\.0$', '', regex=True)
+            df[col] = df[col].replace({'nan': '', 'None': '', 'NaN': ''})
+
+    float_columns = ['latitude', 'longitude', 'rating']
+    for col in float_columns:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+            df[col] = df[col].fillna(0.0)
+            df[col] = df[col].apply(
+                lambda x: 0.0 if not isinstance(x, (int, float)) or pd.isna(x) else float(x))
+            df[col] = df[col].astype(float)
+
+    int_columns = ['reviews', 'reviews_per_score_1', 'reviews_per_score_2',
+                   'reviews_per_score_3', 'reviews_per_score_4',
+                   'reviews_per_score_5', 'photos_count', 'cid']
+    for col in int_columns:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+            df[col] = df[col].fillna(0)
+            df[col] = df[col].apply(lambda x: 0 if not isinstance(x, (int, float)) or pd.isna(x) else int(x))
+            df[col] = df[col].astype(int)
+
+    if 'verified' in df.columns:
+        df['verified'] = pd.to_numeric(df['verified'], errors='coerce')
+        df['verified'] = df['verified'].fillna(0)
+        df['verified'] = df['verified'].apply(lambda x: bool(x) if isinstance(x, (int, float)) else False)
+
+    if 'postal_code' in df.columns:
+        df['postal_code'] = df['postal_code'].fillna('')
+        df['postal_code'] = df['postal_code'].astype(str)
+        df['postal_code'] = df['postal_code'].replace(r'\.0$', '', regex=True)
+        df['postal_code'] = df['postal_code'].replace({'nan': '', 'None': '', 'NaN': ''})
+        df['postal_code'] = df['postal_code'].str[:25]
+
+    return df
+
+
+def make_dirty_frame(rows, seed=42):
+    rng = np.random.default_rng(seed)
+
+    def dirty(values, null_share=0.05, junk=('nan', 'None', 'NaN')):
+        values = pd.Series(values, dtype=object)
+        mask = rng.random(rows) < null_share
+        values[mask] = rng.choice(list(junk) + [None, np.nan], size=mask.sum())
+        return values
+
+    types = np.array([f"Type {i}" for i in range(300)], dtype=object)
+    states = np.array([f"State {i}" for i in range(60)], dtype=object)
+    numbers = rng.integers(0, 5000, size=rows)
+
+    data = {
+        'name': dirty([f"Place {i}" for i in range(rows)]),
+        'type': dirty(types[rng.integers(0, len(types), size=rows)]),
+        'phone': dirty([f"+1 555-{n:04d}" for n in numbers]),
+        'full_address': dirty([f"{n} Main St, City {n % 97}" for n in numbers]),
+        'postal_code': dirty(rng.integers(10000, 99999, size=rows).astype(float)),
+        'state': dirty(states[rng.integers(0, len(states), size=rows)]),
+        'latitude': dirty(rng.uniform(-90, 90, size=rows), junk=('n/a', '')),
+        'longitude': dirty(rng.uniform(-180, 180, size=rows), junk=('n/a', '')),
+        'rating': dirty(np.round(rng.uniform(1, 5, size=rows), 1), junk=('n/a', '')),
+        'reviews': dirty(numbers.astype(float), junk=('n/a', '12', '3.7')),
+        'photos_count': dirty(rng.integers(0, 900, size=rows).astype(float), junk=('n/a',)),
+        'verified': dirty(rng.integers(0, 2, size=rows).astype(bool), junk=('yes', 'n/a')),
+        'location_link': dirty([f"https://maps.google.com/?cid={n}" for n in numbers]),
+        'place_id': dirty([f"ChIJ{n:010d}" for n in numbers]),
+        'google_id': dirty([f"0x{n:x}:0x{n * 7:x}" for n in numbers]),
+        'cid': dirty(rng.integers(0, 2 ** 62, size=rows).astype(float), junk=('n/a',)),
+        'country': dirty(rng.choice(['United States', 'Canada', 'Mexico'], size=rows)),
+        'country_code': dirty(rng.choice(['US', 'CA', 'MX'], size=rows)),
+        'time_zone': dirty(rng.choice(['America/New_York', 'America/Chicago', 'America/Denver'], size=rows)),
+    }
+    for score in range(1, 6):
+        data[f'reviews_per_score_{score}'] = dirty(rng.integers(0, 1000, size=rows).astype(float), junk=('n/a',))
+
+    return pd.DataFrame(data)[[col for col in TARGET_COLUMNS if col in data]]
+
+
+def time_clean(clean_function, frame, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        df = frame.copy()
+        start = time.perf_counter()
+        result = clean_function(df)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark clean_data_frame against the row-wise reference.")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    frame = make_dirty_frame(args.rows)
+
+    legacy_time, legacy_result = time_clean(legacy_clean_data_frame, frame, args.repeat)
+    vectorized_time, vectorized_result = time_clean(clean_data_frame, frame, args.repeat)
+    compact_time, compact_result = time_clean(lambda df: clean_data_frame(df, compact=True), frame, args.repeat)
+
+    # Golden check: the vectorized path must produce exactly the reference output
+    pd.testing.assert_frame_equal(vectorized_result, legacy_result)
+    # Compact dtypes hold the same values
+    pd.testing.assert_frame_equal(compact_result.astype(legacy_result.dtypes.to_dict()), legacy_result)
+
+    print(f"Rows: {args.rows}")
+    print(f"Legacy:     {legacy_time:.3f}s ({args.rows / legacy_time:,.0f} rows/sec)")
+    print(f"Vectorized: {vectorized_time:.3f}s ({args.rows / vectorized_time:,.0f} rows/sec)")
+    print(f"Compact:    {compact_time:.3f}s ({args.rows / compact_time:,.0f} rows/sec)")
+    print(f"Speedup:    {legacy_time / vectorized_time:.1f}x, output identical")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import pandas as pd
+import sqlalchemy
+from benchmarks.generator import generate_outscraper_frame, write_input_file
+from src.configurations.config import EXCEL_CONFIG
+from src.database.models import OutscraperLocation, OutscraperLocationMetric
+from src.database.sqlite_standin import get_sqlite_session_factory, get_async_sqlite_session_factory
+from src.database.type_cache import LocationTypeCache
+from src.excel.processor import ExcelProcessor
+from src.monitoring.stage_metrics import stage_metrics
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# name: (duplicate google_id share, dirty value share, re-ingest the same places into a populated database)
+SCENARIOS = {
+    'fresh': (0.05, 0.02, False),
+    'update': (0.05, 0.02, True),
+    'duplicates': (0.5, 0.02, False),
+    'dirty': (0.05, 0.3, False),
+}
+
+
+def current_rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, AttributeError, ValueError):
+        return 0
+
+
+def peak_rss():
+    if resource is None:
+        return current_rss()
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scenario(name, args, work_dir):
+    duplicate_share, dirty_share, reingest = SCENARIOS[name]
+    scenario_dir = os.path.join(work_dir, name)
+    os.makedirs(scenario_dir)
+    EXCEL_CONFIG['archive_folder'] = os.path.join(scenario_dir, 'archive')
+
+    database_path = os.path.join(scenario_dir, 'standin.db')
+    session_factory = (get_async_sqlite_session_factory if args.async_mode else get_sqlite_session_factory)(database_path)
+    processor = ExcelProcessor(write_mode=args.write_mode, batch_size=args.batch_size, max_workers=args.workers,
+                               session_factory=session_factory, type_cache=LocationTypeCache(),
+                               streaming=args.streaming, chunk_size=args.chunk_size, autotune=args.autotune,
+                               async_mode=args.async_mode)
+
+    df = generate_outscraper_frame(args.rows, duplicate_share, dirty_share, seed=args.seed)
+    if reingest:
+        # Load the places first, then time a second export of the same places with new metric values
+        processor.process_file(write_input_file(df, os.path.join(scenario_dir, f"initial.{args.format}")))
+        df = generate_outscraper_frame(args.rows, duplicate_share, dirty_share, seed=args.seed + 1)
+
+    file_path = write_input_file(df, os.path.join(scenario_dir, f"{name}.{args.format}"))
+    file_size = os.path.getsize(file_path)
+    del df
+
+    stage_metrics.reset()
+    start_time = time.perf_counter()
+    succeeded = processor.process_file(file_path)
+    elapsed = time.perf_counter() - start_time
+    processor.close()
+
+    # Async sessions only work inside the processor's batch loop
+    session = get_sqlite_session_factory(database_path)()
+    try:
+        locations = session.query(OutscraperLocation).count()
+        metrics = session.query(OutscraperLocationMetric).count()
+    finally:
+        session.close()
+
+    return {
+        'succeeded': succeeded,
+        'rows': args.rows,
+        'duplicate_share': duplicate_share,
+        'dirty_share': dirty_share,
+        'file_bytes': file_size,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(args.rows / elapsed, 1),
+        'peak_rss_mb': round(peak_rss() / 1024 / 1024, 1),
+        'locations': locations,
+        'metrics': metrics,
+        'stages': stage_metrics.snapshot(),
+        'tuned': processor.tuner.settings() if processor.tuner is not None else None,
+    }
+
+
+def print_results(results, baseline=None):
+    for name, result in results['scenarios'].items():
+        line = f"{name:>10}: {result['rows_per_sec']:>9,.0f} rows/sec, peak RSS {result['peak_rss_mb']:,.0f} MB"
+        base = (baseline or {}).get('scenarios', {}).get(name)
+        if base:
+            change = (result['rows_per_sec'] / base['rows_per_sec'] - 1) * 100 if base['rows_per_sec'] else 0.0
+            line += f" ({change:+.1f}% vs baseline)"
+        print(line)
+        for stage, stats in result['stages'].items():
+            print(f"{'':>12}{stage:>7}: {stats['rows_per_sec']:>11,.0f} rows/sec, {stats['seconds']:>8.3f}s, "
+                  f"RSS {stats['peak_rss_mb']:,.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ExcelProcessor benchmark on the SQLite stand-in.")
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv', 'csv.gz', 'parquet'])
+    parser.add_argument('--write-mode', default='core', choices=list(ExcelProcessor.WRITE_MODES))
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--autotune', action='store_true', help="Let the batch size and writer count adjust")
+    parser.add_argument('--async-mode', action='store_true', help="Run batches as coroutines over aiosqlite, "
+                                                                  "--workers is then the number of batch coroutines")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Results file, defaults to benchmarks/results/<timestamp>.json")
+    parser.add_argument('--baseline', help="Earlier results file to compare rows/sec against")
+    args = parser.parse_args()
+
+    # Configured before ExcelProcessor sets up its INFO logging, which then leaves it alone
+    logging.basicConfig(level=logging.WARNING)
+    stage_metrics.rss_probe = current_rss
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'sqlalchemy': sqlalchemy.__version__,
+        'host': platform.node(),
+        'settings': vars(args),
+        'scenarios': {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.scenarios:
+            results['scenarios'][name] = run_scenario(name, args, work_dir)
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f"Rows: {args.rows}, format: {args.format}, write mode: {args.write_mode}, workers: {args.workers}")
+    print_results(results, baseline)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
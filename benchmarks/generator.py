@@ -0,0 +1,151 @@
+import argparse
+import numpy as np
+import pandas as pd
+from src.configurations.config import TARGET_COLUMNS
+
+PLACE_TYPES = ['Restaurant', 'Coffee shop', 'Pizza restaurant', 'Bar', 'Bakery', 'Dentist', 'Hair salon',
+               'Gas station', 'Supermarket', 'Pharmacy', 'Gym', 'Hotel', 'Car repair and maintenance service',
+               'Real estate agency', 'Insurance agency', 'Bank', 'Clothing store', 'Hardware store', 'Veterinarian',
+               'Dry cleaner', 'Florist', 'Book store', 'Fast food restaurant', 'Mexican restaurant',
+               'Italian restaurant', 'Chinese restaurant', 'Nail salon', 'Laundromat', 'Auto parts store',
+               'Convenience store']
+NAME_WORDS = ['Golden', 'Main Street', 'Blue', 'Corner', 'Family', 'City', 'Sunrise', 'Green', 'Royal', 'Lucky',
+              'Harbor', 'Maple', 'Summit', 'Pioneer', 'Union', 'Liberty']
+STREETS = ['Main', 'Oak', 'Pine', 'Maple', 'Cedar', 'Elm', 'Washington', 'Lake', 'Hill', 'Park', 'Broadway', 'Market']
+
+# city, state, state code, latitude, longitude, time zone, area code, first postal code
+CITIES = [
+    ('New York', 'New York', 'NY', 40.7128, -74.0060, 'America/New_York', '212', 10001),
+    ('Boston', 'Massachusetts', 'MA', 42.3601, -71.0589, 'America/New_York', '617', 2108),
+    ('Chicago', 'Illinois', 'IL', 41.8781, -87.6298, 'America/Chicago', '312', 60601),
+    ('Houston', 'Texas', 'TX', 29.7604, -95.3698, 'America/Chicago', '713', 77002),
+    ('Denver', 'Colorado', 'CO', 39.7392, -104.9903, 'America/Denver', '303', 80202),
+    ('Phoenix', 'Arizona', 'AZ', 33.4484, -112.0740, 'America/Phoenix', '602', 85003),
+    ('Los Angeles', 'California', 'CA', 34.0522, -118.2437, 'America/Los_Angeles', '213', 90012),
+    ('Seattle', 'Washington', 'WA', 47.6062, -122.3321, 'America/Los_Angeles', '206', 98101),
+    ('Miami', 'Florida', 'FL', 25.7617, -80.1918, 'America/New_York', '305', 33128),
+    ('Newark', 'New Jersey', 'NJ', 40.7357, -74.1724, 'America/New_York', '973', 7102),
+]
+
+STRING_JUNK = ['', 'nan', 'None', 'NaN', None]
+NUMBER_JUNK = ['n/a', '', None, '-']
+
+
+def _place_attributes(places):
+    # Everything that describes the place itself depends only on its number, so duplicates agree
+    spread = (places * 2654435761) % (2 ** 32)
+    city = np.array(CITIES, dtype=object)[spread % len(CITIES)]
+    street_numbers = spread % 9000 + 100
+    postal_codes = [f"{first + offset:05d}" for first, offset in zip(city[:, 7], spread % 40)]
+
+    return {
+        'name': [f"{NAME_WORDS[s % len(NAME_WORDS)]} {PLACE_TYPES[p % len(PLACE_TYPES)]} {p}"
+                 for s, p in zip(spread, places)],
+        'type': [PLACE_TYPES[p % len(PLACE_TYPES)] for p in places],
+        'phone': [f"+1 {area}-{s % 900 + 100:03d}-{s % 10000:04d}" for area, s in zip(city[:, 6], spread)],
+        'full_address': [f"{number} {STREETS[s % len(STREETS)]} St, {name}, {code} {postal}"
+                         for number, s, name, code, postal in
+                         zip(street_numbers, spread, city[:, 0], city[:, 2], postal_codes)],
+        'postal_code': postal_codes,
+        'state': city[:, 1],
+        'latitude': city[:, 3].astype(float) + (spread % 2000 - 1000) / 10000,
+        'longitude': city[:, 4].astype(float) + (spread // 2000 % 2000 - 1000) / 10000,
+        'verified': spread % 3 != 0,
+        'location_link': [f"https://www.google.com/maps/place/?q=place_id:ChIJ{p:012x}" for p in places],
+        'place_id': [f"ChIJ{p:012x}" for p in places],
+        'google_id': [f"0x89c259{p:08x}:0x{s:x}" for p, s in zip(places, spread)],
+        'cid': (places * 2654435761 + 12345678901) % (2 ** 62),
+        'country': ['United States'] * len(places),
+        'country_code': ['US'] * len(places),
+        'time_zone': city[:, 5],
+    }
+
+
+def _metrics(rng, rows):
+    reviews = np.floor(rng.lognormal(4, 1.5, size=rows)).astype(np.int64)
+    shares = rng.dirichlet([1, 1, 2, 4, 8], size=rows)
+    per_score = np.floor(shares * reviews[:, None]).astype(np.int64)
+    metrics = {
+        'rating': np.round(np.clip(rng.normal(4.2, 0.5, size=rows), 1, 5), 1),
+        'reviews': reviews,
+        'photos_count': np.floor(reviews * rng.uniform(0.1, 1.5, size=rows)).astype(np.int64),
+    }
+    for score in range(1, 6):
+        metrics[f'reviews_per_score_{score}'] = per_score[:, score - 1]
+    return metrics
+
+
+def _dirty(rng, values, share, junk):
+    values = pd.Series(values, dtype=object)
+    mask = rng.random(len(values)) < share
+    if mask.any():
+        values[mask] = rng.choice(np.array(junk, dtype=object), size=mask.sum())
+    return values
+
+
+def generate_outscraper_frame(rows, duplicate_share=0.1, dirty_share=0.05, seed=42, first_place=0, places=None):
+    rng = np.random.default_rng(seed)
+
+    if places is None:
+        unique_places = max(int(round(rows * (1 - duplicate_share))), 1)
+        places = np.arange(first_place, first_place + unique_places, dtype=np.int64)
+        # Duplicates repeat random places with their own metric values, as Outscraper does for overlapping queries
+        repeats = rng.choice(places, size=rows - unique_places)
+        places = rng.permutation(np.concatenate([places, repeats]))
+    places = np.asarray(places, dtype=np.int64)
+
+    data = _place_attributes(places)
+    data.update(_metrics(rng, len(places)))
+
+    if dirty_share > 0:
+        for col in ['name', 'type', 'phone', 'full_address', 'state', 'location_link', 'place_id', 'google_id',
+                    'country', 'country_code', 'time_zone']:
+            data[col] = _dirty(rng, data[col], dirty_share, STRING_JUNK)
+        for col in ['latitude', 'longitude', 'rating', 'reviews', 'photos_count', 'cid',
+                    'reviews_per_score_1', 'reviews_per_score_2', 'reviews_per_score_3', 'reviews_per_score_4',
+                    'reviews_per_score_5']:
+            data[col] = _dirty(rng, data[col], dirty_share, NUMBER_JUNK)
+        # Spreadsheets turn postal codes into numbers and drop the leading zero
+        postal_codes = pd.Series(data['postal_code'], dtype=object)
+        as_number = rng.random(len(places)) < dirty_share
+        postal_codes[as_number] = postal_codes[as_number].astype(float)
+        data['postal_code'] = _dirty(rng, postal_codes, dirty_share, STRING_JUNK)
+        data['verified'] = _dirty(rng, data['verified'], dirty_share, ['', None, 'n/a'])
+
+    return pd.DataFrame(data)[[col for col in TARGET_COLUMNS if col in data]]
+
+
+def write_input_file(df, path):
+    lower_path = path.lower()
+    if lower_path.endswith('.xlsx'):
+        df.to_excel(path, index=False, engine='openpyxl')
+    elif lower_path.endswith(('.csv', '.csv.gz')):
+        df.to_csv(path, index=False)
+    elif lower_path.endswith('.parquet'):
+        # Parquet columns are typed, dirty values are stored as text like a typed export would
+        typed = df.copy()
+        for col in typed.columns:
+            if typed[col].dtype == object:
+                typed[col] = typed[col].map(lambda value: None if value is None or value != value else str(value))
+        typed.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unsupported benchmark file: {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate an Outscraper-shaped input file.")
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--duplicate-share', type=float, default=0.1)
+    parser.add_argument('--dirty-share', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    df = generate_outscraper_frame(args.rows, args.duplicate_share, args.dirty_share, args.seed)
+    write_input_file(df, args.path)
+    print(f"Wrote {len(df)} rows to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import os
+import tempfile
+import pandas as pd
+from benchmarks.generator import generate_outscraper_frame, write_input_file
+from src.configurations.config import TARGET_COLUMNS
+from src.excel.readers import read_input_file
+from src.utils.helpers import clean_data_frame
+
+
+def bytes_per_row(df):
+    # deep=True counts the Python string objects behind object columns, not only the pointers
+    return df.memory_usage(index=False, deep=True) / max(len(df), 1)
+
+
+def as_objects(df):
+    # The representation before pandas 3: every text column a Python str per row
+    return df.astype({col: object for col in df.columns if df[col].dtype.kind not in 'biuf'})
+
+
+def memory_report(file_path):
+    df = read_input_file(file_path)
+    df = df[[col for col in TARGET_COLUMNS if col in df.columns]]
+    legacy = clean_data_frame(df.copy())
+    compact = clean_data_frame(df.copy(), compact=True)
+
+    report = pd.DataFrame({
+        'read': bytes_per_row(df),
+        'object': bytes_per_row(as_objects(legacy)),
+        'cleaned': bytes_per_row(legacy),
+        'compact': bytes_per_row(compact),
+        'dtype': compact.dtypes.astype(str),
+    })
+    return report, len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per row of a cleaned frame before and after compact dtypes.")
+    parser.add_argument('file', nargs='?', help="Input file, a generated export when omitted")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--format', default='csv', choices=['xlsx', 'csv', 'csv.gz', 'parquet'])
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_path = args.file or write_input_file(generate_outscraper_frame(args.rows, 0.05, 0.02, seed=args.seed),
+                                                  os.path.join(work_dir, f"memory.{args.format}"))
+        report, rows = memory_report(file_path)
+
+    totals = report.drop(columns='dtype').sum()
+    print(f"Rows: {rows}, pandas {pd.__version__}, bytes per row by column:")
+    print(report.round(1).to_string())
+    print(f"Total: read {totals['read']:,.0f}, object {totals['object']:,.0f}, cleaned {totals['cleaned']:,.0f}, "
+          f"compact {totals['compact']:,.0f} bytes per row "
+          f"({(1 - totals['compact'] / totals['object']) * 100:.0f}% less than object strings)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+from benchmarks.clean_data_frame import make_dirty_frame
+from src.database.sqlite_standin import get_sqlite_session_factory
+from src.database.type_cache import LocationTypeCache
+from src.excel.batch_builder import build_batch_records
+from src.excel.processor import ExcelProcessor
+from src.utils.helpers import clean_data_frame
+
+
+def run_write_mode(write_mode, batches, work_dir):
+    session_factory = get_sqlite_session_factory(os.path.join(work_dir, f"{write_mode}.db"))
+    processor = ExcelProcessor(write_mode=write_mode, session_factory=session_factory,
+                               type_cache=LocationTypeCache(), max_workers=1)
+
+    timings = []
+    # The first pass inserts every location, the second one updates them
+    for _ in range(2):
+        start = time.perf_counter()
+        for batch in batches:
+            processor._process_batch(batch)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ORM, Core and merge write throughput on the SQLite stand-in.")
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--modes', nargs='+', default=list(ExcelProcessor.WRITE_MODES))
+    args = parser.parse_args()
+
+    # Configured before ExcelProcessor sets up its INFO logging, which then leaves it alone
+    logging.basicConfig(level=logging.WARNING)
+
+    records = build_batch_records(clean_data_frame(make_dirty_frame(args.rows)))
+    batches = [records[start:start + args.batch_size] for start in range(0, len(records), args.batch_size)]
+
+    print(f"Rows: {args.rows}, batch size: {args.batch_size}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for write_mode in args.modes:
+            insert_time, update_time = run_write_mode(write_mode, batches, work_dir)
+            print(f"{write_mode:>6}: insert pass {args.rows / insert_time:>9,.0f} rows/sec, "
+                  f"update pass {args.rows / update_time:>9,.0f} rows/sec")
+
+
+if __name__ == '__main__':
+    main()
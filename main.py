@@ -1,12 +1,19 @@
 import logging
 import sys
-import time
 import os
 import signal
+import threading
 from src.excel.processor import ExcelProcessor
+from src.excel.fanout import FanOutProcessor
 from src.monitoring.file_watcher import start_file_monitoring
-from src.configurations.config import EXCEL_CONFIG
+from src.monitoring.prometheus_exporter import start_metrics_exporter
+from src.monitoring.file_leases import FileLeases
+from src.configurations.config import (EXCEL_CONFIG, LOCATION_INDEX_CONFIG, WATCHER_CONFIG, DELTA_CONFIG, AUTOTUNE_CONFIG,
+                                       BACKLOG_CONFIG, FANOUT_CONFIG, LEASE_CONFIG)
+from src.database.location_index import get_location_index
+from src.database.ingestion_ledger import get_ingestion_ledger
 from src.database.test_mssql_connection import test_mssql_connection
+from src.database.database import warm_up_pool, dispose_engine
 
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
 os.makedirs(log_dir, exist_ok=True)
@@ -20,38 +27,95 @@ logging.basicConfig(
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-running = True
+stop_requested = threading.Event()
+processor = None
 
 def signal_handler(sig, frame):
-    global running
-    logging.info("Received stop signal. Shutting down...")
-    running = False
+    logging.info(f"Received {signal.Signals(sig).name}. Shutting down...")
+    stop_requested.set()
+    # Files in progress stop at the next batch, their committed batches are picked up again on the next start
+    if processor is not None:
+        processor.request_stop()
 
 if __name__ == '__main__':
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
     try:
-        processor = ExcelProcessor()
+        metrics_exporter = start_metrics_exporter()
+        # In async mode each file runs async_batches batch coroutines instead of writer_workers threads
+        batch_workers = EXCEL_CONFIG['async_batches'] if EXCEL_CONFIG['async_mode'] else EXCEL_CONFIG['writer_workers']
+        writer_budget = EXCEL_CONFIG['writer_budget'] or batch_workers * max(WATCHER_CONFIG['file_workers'],
+                                                                             BACKLOG_CONFIG['file_workers'])
+        watch_folder = EXCEL_CONFIG['watch_folder']
+        # Nodes sharing the watch folder claim each file before processing it
+        leases = FileLeases(watch_folder).start() if LEASE_CONFIG['enabled'] else None
+        ledger = None
+        if FANOUT_CONFIG['targets']:
+            # Every target gets its own engine, location index and ledger
+            processor = FanOutProcessor(targets=FANOUT_CONFIG['targets'],
+                                        location_index=LOCATION_INDEX_CONFIG['enabled'],
+                                        ledger=EXCEL_CONFIG['ledger_enabled'],
+                                        max_workers=batch_workers,
+                                        streaming=EXCEL_CONFIG['streaming'],
+                                        chunk_size=EXCEL_CONFIG['chunk_size'],
+                                        delta=DELTA_CONFIG['enabled'],
+                                        autotune=AUTOTUNE_CONFIG['enabled'],
+                                        writer_budget=writer_budget,
+                                        async_mode=EXCEL_CONFIG['async_mode'],
+                                        leases=leases)
+        else:
+            location_index = get_location_index() if LOCATION_INDEX_CONFIG['enabled'] else None
+            ledger = get_ingestion_ledger() if EXCEL_CONFIG['ledger_enabled'] else None
+            if ledger is not None:
+                logging.info(f"Ingestion run started: {ledger.start_run()}")
+            processor = ExcelProcessor(max_workers=batch_workers,
+                                       location_index=location_index,
+                                       streaming=EXCEL_CONFIG['streaming'],
+                                       chunk_size=EXCEL_CONFIG['chunk_size'],
+                                       parse_workers=EXCEL_CONFIG['parse_workers'],
+                                       parse_queue_size=EXCEL_CONFIG['parse_queue_size'],
+                                       ledger=ledger,
+                                       delta=DELTA_CONFIG['enabled'],
+                                       autotune=AUTOTUNE_CONFIG['enabled'],
+                                       writer_budget=writer_budget,
+                                       async_mode=EXCEL_CONFIG['async_mode'],
+                                       leases=leases)
         logging.info("Starting Program")
+
+        if not EXCEL_CONFIG['async_mode'] and not FANOUT_CONFIG['targets']:
+            warm_up_pool()
+        processor.warm_up()
         
-        watch_folder = EXCEL_CONFIG['watch_folder']
         logging.info(f"Starting to monitor folder: {watch_folder}")
         
         processed_count = processor.watch_folder()
-        
-        if processed_count > 0:
+
+        if stop_requested.is_set():
+            logging.info("Stopped while draining the backlog, remaining files stay in the watch folder.")
+        elif processed_count > 0:
             logging.info(f"Initial processing completed. {processed_count} Excel files processed.")
         else:
             logging.info("No Excel files found. Monitoring for new files...")
         
-        observer = start_file_monitoring(watch_folder, processor.process_file)
-        
-        while running:
-            time.sleep(1)
-            
+        observer, file_handler = start_file_monitoring(watch_folder, processor.process_file,
+                                                       file_workers=WATCHER_CONFIG['file_workers'])
+
+        # The timeout keeps the main thread responsive to signals on Windows
+        while not stop_requested.wait(1):
+            pass
+
         observer.stop()
         observer.join()
+        file_handler.stop()
+        processor.close()
+        if leases is not None:
+            leases.stop()
+        if ledger is not None:
+            ledger.close()
+        dispose_engine()
+        if metrics_exporter is not None:
+            metrics_exporter.stop()
         logging.info("Program completed.")
         
     except Exception as e:
@@ -62,5 +126,15 @@ if __name__ == '__main__':
         if 'observer' in locals():
             observer.stop()
             observer.join()
-            
+            file_handler.stop()
+
+        if processor is not None:
+            processor.close()
+        if locals().get('leases') is not None:
+            leases.stop()
+        if locals().get('ledger') is not None:
+            ledger.close()
+        dispose_engine()
+        if locals().get('metrics_exporter') is not None:
+            metrics_exporter.stop()
         sys.exit(1)
\ No newline at end of file
@@ -56,9 +56,94 @@ DB_CONFIGS = {
 
 DB_CONFIG = DB_CONFIGS['secondary']
 
+DB_POOL_CONFIG = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),   # Overridden by ExcelProcessor.max_workers
+    'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', '4')),
+    'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '30')),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '300')),
+    'fast_executemany': os.getenv('DB_FAST_EXECUTEMANY', 'true').lower() == 'true',
+}
+
+FANOUT_CONFIG = {
+    # DB_CONFIGS names, e.g. primary,secondary. Each file is parsed once and written to every target
+    'targets': [t.strip() for t in os.getenv('DB_FANOUT_TARGETS', '').split(',') if t.strip()],
+}
+
+DEADLOCK_CONFIG = {
+    'max_replays': int(os.getenv('DEADLOCK_MAX_REPLAYS', '5')),   # Times a deadlocked batch is written again
+    'backoff_base': float(os.getenv('DEADLOCK_BACKOFF_BASE', '0.1')),   # Seconds, doubled after every deadlock
+    'backoff_max': float(os.getenv('DEADLOCK_BACKOFF_MAX', '5.0')),
+}
+
 EXCEL_CONFIG = {
     'watch_folder': os.getenv('EXCEL_WATCH_FOLDER'),
     'archive_folder': os.getenv('EXCEL_ARCHIVE_FOLDER'),
+    'streaming': os.getenv('EXCEL_STREAMING', 'false').lower() == 'true',
+    'chunk_size': int(os.getenv('EXCEL_CHUNK_SIZE', '5000')),
+    'writer_workers': int(os.getenv('EXCEL_WRITER_WORKERS', '4')),
+    'writer_budget': int(os.getenv('EXCEL_WRITER_BUDGET', '0')),   # Writer threads shared by all files, 0 is writer_workers per file worker
+    'parse_workers': int(os.getenv('EXCEL_PARSE_WORKERS', '0')),   # 0 parses in the writer process
+    'async_mode': os.getenv('EXCEL_ASYNC', 'false').lower() == 'true',   # Batches as coroutines over an async driver
+    'async_batches': int(os.getenv('EXCEL_ASYNC_BATCHES', '32')),   # Batch coroutines per file in async mode
+    'parse_queue_size': int(os.getenv('EXCEL_PARSE_QUEUE_SIZE', '0')) or None,   # Messages of chunk_size rows
+    'coalesce_duplicates': os.getenv('EXCEL_COALESCE_DUPLICATES', 'true').lower() == 'true',   # One record per google_id
+    'validate_rows': os.getenv('EXCEL_VALIDATE_ROWS', 'true').lower() == 'true',   # Quarantine rows the database would reject
+    'quarantine_folder': os.getenv('EXCEL_QUARANTINE_FOLDER'),   # Defaults to a quarantine folder in the archive folder, or next to the input file
+    'ledger_enabled': os.getenv('EXCEL_LEDGER_ENABLED', 'true').lower() == 'true',
+    'ledger_path': os.getenv('EXCEL_LEDGER_PATH'),   # Defaults to ingestion_ledger.db in the archive folder
+}
+
+WATCHER_CONFIG = {
+    'file_workers': int(os.getenv('WATCHER_FILE_WORKERS', '2')),
+    'stability_interval': float(os.getenv('WATCHER_STABILITY_INTERVAL', '1.0')),   # Seconds between size/mtime checks
+    'stability_checks': int(os.getenv('WATCHER_STABILITY_CHECKS', '1')),   # Unchanged checks before a file is complete
+    'retry_delay': float(os.getenv('WATCHER_RETRY_DELAY', '5.0')),   # Seconds before a locked file is tried again
+    'max_retries': int(os.getenv('WATCHER_MAX_RETRIES', '12')),
+}
+
+LEASE_CONFIG = {
+    'enabled': os.getenv('LEASE_ENABLED', 'false').lower() == 'true',   # Claim files so several nodes share the watch folder
+    'node_id': os.getenv('LEASE_NODE_ID'),   # Defaults to <hostname>-<pid>
+    'folder': os.getenv('LEASE_FOLDER'),   # Defaults to .leases in the watch folder, must be on the same volume
+    'heartbeat_interval': float(os.getenv('LEASE_HEARTBEAT_INTERVAL', '10')),
+    'timeout': float(os.getenv('LEASE_TIMEOUT', '60')),   # Seconds without a heartbeat before a node's files are reclaimed
+}
+
+BACKLOG_CONFIG = {
+    'policy': os.getenv('BACKLOG_POLICY', 'oldest'),   # oldest, smallest, priority or name
+    'priority_patterns': [p.strip() for p in os.getenv('BACKLOG_PRIORITY_PATTERNS', '').split(',') if p.strip()],
+    'file_workers': int(os.getenv('BACKLOG_FILE_WORKERS', '2')),   # Backlog files processed at the same time
+}
+
+AUTOTUNE_CONFIG = {
+    'enabled': os.getenv('EXCEL_AUTOTUNE', 'false').lower() == 'true',   # Adjust batch size and writers per file
+    'min_batch_size': int(os.getenv('AUTOTUNE_MIN_BATCH_SIZE', '10')),
+    'max_batch_size': int(os.getenv('AUTOTUNE_MAX_BATCH_SIZE', '2000')),
+    'max_workers': int(os.getenv('AUTOTUNE_MAX_WORKERS', '0')),   # Ceiling of the writer count, 0 for twice max_workers
+    'target_latency': float(os.getenv('AUTOTUNE_TARGET_LATENCY', '2.0')),   # Seconds to write and commit one batch
+    'window': int(os.getenv('AUTOTUNE_WINDOW', '8')),   # Batches measured before each adjustment
+    'probe_windows': 20,   # Settled windows before growing is tried again
+}
+
+LOCATION_INDEX_CONFIG = {
+    'enabled': os.getenv('LOCATION_INDEX_ENABLED', 'true').lower() == 'true',
+    'memory_budget_mb': int(os.getenv('LOCATION_INDEX_MEMORY_MB', '256')),
+    'bloom_capacity': int(os.getenv('LOCATION_INDEX_BLOOM_CAPACITY', '5000000')),
+    'bloom_error_rate': float(os.getenv('LOCATION_INDEX_BLOOM_ERROR_RATE', '0.01')),
+    'warm_up_chunk_size': 10000,
+}
+
+DELTA_CONFIG = {
+    'enabled': os.getenv('DELTA_MODE', 'false').lower() == 'true',   # Skip metric rows whose values did not change
+    'memory_budget_mb': int(os.getenv('DELTA_MEMORY_MB', '128')),
+    'warm_up_chunk_size': 10000,
+}
+
+METRICS_CONFIG = {
+    'port': int(os.getenv('METRICS_PORT', '0')),   # 0 disables the /metrics endpoint
+    'host': os.getenv('METRICS_HOST', '127.0.0.1'),
+    'textfile_path': os.getenv('METRICS_TEXTFILE'),   # .prom file for node_exporter's textfile collector
+    'textfile_interval': float(os.getenv('METRICS_TEXTFILE_INTERVAL', '15')),
 }
 
 LOG_CONFIG = {
@@ -0,0 +1,155 @@
+import time
+import uuid
+from datetime import datetime, timezone
+from functools import lru_cache
+from sqlalchemy import select, insert, update, bindparam, func
+from .models import OutscraperLocation, get_models, LOOKUP_HINTS
+from .location_index import LocationIndex
+from ..excel.batch_builder import location_params, metric_params
+from ..monitoring.stage_metrics import stage_metrics
+
+# SQL Server accepts at most 2100 parameters per statement
+LOOKUP_CHUNK_SIZE = 1000
+
+UPDATE_TEXT_COLUMNS = ['Name', 'Type', 'Phone', 'FullAddress', 'PostalCode', 'State',
+                       'LocationLink', 'Country', 'CountryCode', 'Timezone']
+UPDATE_NUMERIC_COLUMNS = ['Latitude', 'Longitude']
+
+
+@lru_cache(maxsize=None)
+def _build_statements(main):
+    # Empty values are sent as NULL so COALESCE keeps the stored value, like the ORM path's non-empty checks
+    values = {col: func.coalesce(bindparam(f'b_{col}', type_=main.c[col].type), main.c[col])
+              for col in UPDATE_TEXT_COLUMNS + UPDATE_NUMERIC_COLUMNS}
+    values['Verified'] = bindparam('b_Verified', type_=main.c.Verified.type)
+    # Rows whose metric did not change are sent without one and keep the current MetricId
+    values['MetricId'] = func.coalesce(bindparam('b_MetricId', type_=main.c.MetricId.type), main.c.MetricId)
+    update_location = update(main).where(main.c.Id == bindparam('b_Id', type_=main.c.Id.type)).values(**values)
+
+    repoint_location = (
+        update(main)
+        .where(main.c.Id == bindparam('b_Id', type_=main.c.Id.type))
+        .values(MetricId=bindparam('b_MetricId', type_=main.c.MetricId.type))
+    )
+    return update_location, repoint_location
+
+
+UPDATE_LOCATION, REPOINT_LOCATION = _build_statements(OutscraperLocation.__table__)
+
+
+def find_location_ids(session, google_ids, location_index=None, main=None, locking=False):
+    main = main if main is not None else OutscraperLocation.__table__
+    found = {}
+    unknown = []
+
+    for google_id in google_ids:
+        cached = location_index.lookup(google_id) if location_index is not None else None
+        if cached is LocationIndex.ABSENT:
+            continue
+        if cached is not None:
+            found[google_id] = cached[0]
+        else:
+            unknown.append(google_id)
+
+    for start in range(0, len(unknown), LOOKUP_CHUNK_SIZE):
+        chunk = unknown[start:start + LOOKUP_CHUNK_SIZE]
+        rows = session.execute(
+            select(main.c.GoogleId, main.c.Id)
+            .where(main.c.GoogleId.in_(chunk))
+            .with_hint(main, LOOKUP_HINTS[locking], 'mssql')
+        ).all()
+        for google_id, location_id in rows:
+            found.setdefault(google_id, location_id)
+
+    return found
+
+
+def core_write_batch(session, records, location_index=None, index_entries=None, metric_writes=None, models=None,
+                     locking=False):
+    results = {
+        'locations_added': 0,
+        'locations_updated': 0,
+        'metrics_added': 0,
+        'metrics_skipped': 0,
+    }
+    if not records:
+        return results
+
+    models = models or get_models()
+    main = models.OutscraperLocation.__table__
+    update_location, repoint_location = _build_statements(main)
+
+    start_time = time.perf_counter()
+    google_ids = list(dict.fromkeys(record.GoogleId for record in records if record.HasGoogleId))
+    location_ids = find_location_ids(session, google_ids, location_index, main, locking)
+    stage_metrics.record('lookup', time.perf_counter() - start_time, len(records))
+
+    start_time = time.perf_counter()
+    current_date = datetime.now().replace(tzinfo=timezone.utc)
+
+    new_locations = []
+    new_location_metrics = {}
+    location_updates = []
+    metrics = []
+    latest = {}
+
+    for row_num, record in enumerate(records):
+        metric_id = uuid.uuid4()
+        write_metric = metric_writes is None or metric_writes[row_num]
+        location_id = location_ids.get(record.GoogleId) if record.HasGoogleId else None
+
+        if location_id is None:
+            write_metric = True
+            location_id = uuid.uuid4()
+            location = location_params(record)
+            location.update(Id=location_id, GoogleId=record.GoogleId, MetricId=None)
+            new_locations.append(location)
+            new_location_metrics[location_id] = metric_id
+            if record.HasGoogleId:
+                # Later rows for the same place in this batch update the location created here
+                location_ids[record.GoogleId] = location_id
+            results['locations_added'] += 1
+        else:
+            update_params = {f'b_{col}': getattr(record, col) if getattr(record, col).strip() else None
+                             for col in UPDATE_TEXT_COLUMNS}
+            update_params.update({f'b_{col}': getattr(record, col) if getattr(record, col) != 0.0 else None
+                                  for col in UPDATE_NUMERIC_COLUMNS})
+            update_params.update(b_Id=location_id, b_MetricId=metric_id if write_metric else None,
+                                 b_Verified=record.Verified)
+            location_updates.append(update_params)
+            if write_metric:
+                new_location_metrics.pop(location_id, None)
+            results['locations_updated'] += 1
+
+        if not write_metric:
+            results['metrics_skipped'] += 1
+            continue
+
+        metric = metric_params(record)
+        metric.update(Id=metric_id, LocationId=location_id, CreateDate=current_date,
+                      Year=current_date.year, Month=current_date.month)
+        metrics.append(metric)
+        results['metrics_added'] += 1
+
+        if record.HasGoogleId:
+            latest[record.GoogleId] = (location_id, metric_id)
+
+    # Locations go in without MetricId so neither foreign key of the location/metric pair is violated
+    if new_locations:
+        session.execute(insert(main), new_locations)
+    if metrics:
+        session.execute(insert(models.OutscraperLocationMetric.__table__), metrics)
+    if new_location_metrics:
+        session.execute(repoint_location, [{'b_Id': location_id, 'b_MetricId': metric_id}
+                                           for location_id, metric_id in new_location_metrics.items()])
+    if location_updates:
+        # Existing rows are locked in key order, so two writers touching the same places wait for each other
+        # instead of deadlocking. The sort is stable: repeated updates of one place keep their row order
+        location_updates.sort(key=lambda params: str(params['b_Id']))
+        session.execute(update_location, location_updates)
+
+    if index_entries is not None:
+        index_entries.extend((google_id, location_id, metric_id) for google_id, (location_id, metric_id) in latest.items())
+
+    stage_metrics.record('write', time.perf_counter() - start_time, len(records))
+    return results
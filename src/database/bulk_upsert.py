@@ -0,0 +1,263 @@
+import time
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import Table, Column, MetaData, Integer, select, insert, update, delete, case, func, and_, or_, event, text
+from sqlalchemy.dialects.mssql import UNIQUEIDENTIFIER, NVARCHAR, BIT, DATETIMEOFFSET, DECIMAL
+from .models import get_models, LOOKUP_HINTS
+from ..excel.batch_builder import location_params, metric_params
+from ..monitoring.stage_metrics import stage_metrics
+
+STAGING_TABLE_NAMES = {
+    'mssql': '#OutscraperLocationStaging',
+}
+
+TEXT_COLUMNS = ['Name', 'Type', 'Phone', 'FullAddress', 'PostalCode', 'State',
+                'LocationLink', 'Country', 'CountryCode', 'Timezone']
+
+_staging_tables = {}
+# Set in the connection info once the staging table exists on that connection
+STAGING_CREATED = 'outscraper_staging_created'
+
+
+def get_staging_table(dialect_name):
+    if dialect_name not in _staging_tables:
+        metadata = MetaData()
+        name = STAGING_TABLE_NAMES.get(dialect_name, 'OutscraperLocationStaging')
+        prefixes = [] if dialect_name == 'mssql' else ['TEMPORARY']
+        _staging_tables[dialect_name] = Table(
+            name, metadata,
+            Column('RowNum', Integer, nullable=False),
+            Column('MetricId', UNIQUEIDENTIFIER, nullable=False),
+            Column('NewLocationId', UNIQUEIDENTIFIER, nullable=False),
+            Column('LocationId', UNIQUEIDENTIFIER, nullable=True),
+            Column('IsNew', BIT, nullable=False, default=False),
+            Column('IsRepresentative', BIT, nullable=False),
+            Column('WriteMetric', BIT, nullable=False),
+            Column('LatestMetricId', UNIQUEIDENTIFIER, nullable=True),
+            Column('GoogleId', NVARCHAR(255), nullable=True),
+            Column('PlaceId', NVARCHAR(255), nullable=True),
+            Column('Name', NVARCHAR(1000), nullable=True),
+            Column('Type', NVARCHAR(255), nullable=True),
+            Column('Phone', NVARCHAR(255), nullable=True),
+            Column('FullAddress', NVARCHAR(4000), nullable=True),
+            Column('PostalCode', NVARCHAR(10), nullable=True),
+            Column('State', NVARCHAR(255), nullable=True),
+            Column('Latitude', DECIMAL(19, 4), nullable=True),
+            Column('Longitude', DECIMAL(19, 4), nullable=True),
+            Column('Verified', BIT, nullable=True),
+            Column('LocationLink', NVARCHAR(None), nullable=True),
+            Column('Country', NVARCHAR(255), nullable=True),
+            Column('CountryCode', NVARCHAR(10), nullable=True),
+            Column('Timezone', NVARCHAR(255), nullable=True),
+            Column('Rating', DECIMAL(19, 4), nullable=True),
+            Column('Reviews', Integer, nullable=True),
+            Column('ReviewsPerScore1', Integer, nullable=True),
+            Column('ReviewsPerScore2', Integer, nullable=True),
+            Column('ReviewsPerScore3', Integer, nullable=True),
+            Column('ReviewsPerScore4', Integer, nullable=True),
+            Column('ReviewsPerScore5', Integer, nullable=True),
+            Column('PhotosCount', Integer, nullable=True),
+            Column('CreateDate', DATETIMEOFFSET(7), nullable=True),
+            Column('Year', Integer, nullable=True),
+            Column('Month', Integer, nullable=True),
+            prefixes=prefixes,
+        )
+    return _staging_tables[dialect_name]
+
+
+def _forget_staging(connection):
+    # A rollback undoes the CREATE when it ran in the rolled back transaction, the next batch checks again
+    connection.info.pop(STAGING_CREATED, None)
+
+
+def _prepare_staging(connection, staging):
+    if connection.info.get(STAGING_CREATED):
+        return
+    if not event.contains(connection.engine, 'rollback', _forget_staging):
+        event.listen(connection.engine, 'rollback', _forget_staging)
+    staging.create(connection, checkfirst=True)
+    connection.info[STAGING_CREATED] = True
+
+
+def _clear_staging(session, staging):
+    connection = session.connection()
+    if connection.dialect.name == 'mssql':
+        session.execute(text(f"TRUNCATE TABLE {connection.dialect.identifier_preparer.format_table(staging)}"))
+    else:
+        session.execute(delete(staging))
+
+
+def build_staging_rows(records, current_date=None, metric_writes=None):
+    if current_date is None:
+        current_date = datetime.now().replace(tzinfo=timezone.utc)
+
+    # The last row for a google_id is the one whose values end up on the location, like sequential updates
+    last_row_for_google_id = {}
+    new_location_ids = {}
+    for row_num, record in enumerate(records):
+        if record.HasGoogleId:
+            last_row_for_google_id[record.GoogleId] = row_num
+            new_location_ids.setdefault(record.GoogleId, uuid.uuid4())
+
+    rows = []
+    for row_num, record in enumerate(records):
+        google_id = record.GoogleId
+        row = {
+            'RowNum': row_num,
+            'MetricId': uuid.uuid4(),
+            'NewLocationId': new_location_ids[google_id] if record.HasGoogleId else uuid.uuid4(),
+            'LocationId': None,
+            'IsNew': False,
+            'IsRepresentative': last_row_for_google_id[google_id] == row_num if record.HasGoogleId else True,
+            'WriteMetric': metric_writes is None or metric_writes[row_num],
+            'LatestMetricId': None,
+            'GoogleId': google_id,
+            'CreateDate': current_date,
+            'Year': current_date.year,
+            'Month': current_date.month,
+        }
+        row.update(location_params(record))
+        row.update(metric_params(record))
+        rows.append(row)
+
+    # The location points at the last metric written for it in this batch, or keeps its current one
+    latest_metric_ids = {}
+    for row in rows:
+        if row['WriteMetric']:
+            latest_metric_ids[row['GoogleId']] = row['MetricId']
+    for row in rows:
+        if not row['IsRepresentative']:
+            continue
+        if row['GoogleId'] in last_row_for_google_id:
+            row['LatestMetricId'] = latest_metric_ids.get(row['GoogleId'])
+        else:
+            row['LatestMetricId'] = row['MetricId']
+
+    # Fold duplicate google_ids into their representative row with the same non-empty rules used for updates
+    folded = {}
+    for row in rows:
+        google_id = row['GoogleId']
+        if google_id not in last_row_for_google_id:
+            continue
+        if google_id not in folded:
+            folded[google_id] = dict(row)
+            continue
+        merged = folded[google_id]
+        for col in TEXT_COLUMNS:
+            if row[col].strip():
+                merged[col] = row[col]
+        for col in ('Latitude', 'Longitude'):
+            if row[col] != 0.0:
+                merged[col] = row[col]
+        merged['Verified'] = row['Verified']
+        merged['PlaceId'] = row['PlaceId']
+
+    for row in rows:
+        if row['IsRepresentative'] and row['GoogleId'] in folded:
+            merged = folded[row['GoogleId']]
+            for col in TEXT_COLUMNS + ['Latitude', 'Longitude', 'PlaceId']:
+                row[col] = merged[col]
+    return rows
+
+
+def _non_empty_text(staged, current):
+    return case((func.ltrim(func.rtrim(staged)) != '', staged), else_=current)
+
+
+def _non_zero(staged, current):
+    return case((staged != 0, staged), else_=current)
+
+
+def merge_batch(session, records, index_entries=None, metric_writes=None, models=None, locking=False):
+    results = {
+        'locations_added': 0,
+        'locations_updated': 0,
+        'metrics_added': 0,
+        'metrics_skipped': 0,
+    }
+
+    rows = build_staging_rows(records, metric_writes=metric_writes)
+    if not rows:
+        return results
+
+    start_time = time.perf_counter()
+    connection = session.connection()
+    staging = get_staging_table(connection.dialect.name)
+    models = models or get_models()
+    main = models.OutscraperLocation.__table__
+    metric = models.OutscraperLocationMetric.__table__
+
+    # The staging table lives as long as the connection, so it is created once and emptied after every batch
+    _prepare_staging(connection, staging)
+    session.execute(insert(staging), rows)
+
+    lookup_start = time.perf_counter()
+    lookup = main.alias('lookup')
+    existing_id = (
+        select(lookup.c.Id)
+        .where(lookup.c.GoogleId == staging.c.GoogleId)
+        .with_hint(lookup, LOOKUP_HINTS[locking], 'mssql')
+        .limit(1)
+        .scalar_subquery()
+    )
+    session.execute(
+        update(staging)
+        .where(func.ltrim(func.rtrim(staging.c.GoogleId)).notin_(['', 'nan', 'None']))
+        .values(LocationId=existing_id)
+    )
+    session.execute(
+        update(staging)
+        .where(staging.c.LocationId.is_(None))
+        .values(LocationId=staging.c.NewLocationId, IsNew=True)
+    )
+    lookup_seconds = time.perf_counter() - lookup_start
+    stage_metrics.record('lookup', lookup_seconds, len(rows))
+
+    location_columns = ['PlaceId', 'GoogleId', 'Name', 'Type', 'Phone', 'FullAddress', 'PostalCode', 'State',
+                        'Latitude', 'Longitude', 'Verified', 'LocationLink', 'Country', 'CountryCode', 'Timezone']
+    new_locations = session.execute(
+        insert(main).from_select(
+            ['Id'] + location_columns,
+            select(staging.c.LocationId, *[staging.c[col] for col in location_columns])
+            .where(and_(staging.c.IsNew == True, staging.c.IsRepresentative == True))
+        )
+    )
+
+    metric_columns = ['Rating', 'Reviews', 'ReviewsPerScore1', 'ReviewsPerScore2', 'ReviewsPerScore3',
+                      'ReviewsPerScore4', 'ReviewsPerScore5', 'PhotosCount', 'CreateDate', 'Year', 'Month']
+    new_metrics = session.execute(
+        insert(metric).from_select(
+            ['Id', 'LocationId'] + metric_columns,
+            select(staging.c.MetricId, staging.c.LocationId, *[staging.c[col] for col in metric_columns])
+            .where(or_(staging.c.WriteMetric == True, staging.c.IsNew == True))
+        )
+    )
+
+    # New locations were inserted with the same values, so the non-empty rules leave them untouched
+    values = {col: _non_empty_text(staging.c[col], main.c[col]) for col in TEXT_COLUMNS}
+    values['Latitude'] = _non_zero(staging.c.Latitude, main.c.Latitude)
+    values['Longitude'] = _non_zero(staging.c.Longitude, main.c.Longitude)
+    values['Verified'] = staging.c.Verified
+    values['MetricId'] = case((staging.c.IsNew == True, staging.c.MetricId),
+                              else_=func.coalesce(staging.c.LatestMetricId, main.c.MetricId))
+    session.execute(
+        update(main)
+        .where(and_(main.c.Id == staging.c.LocationId, staging.c.IsRepresentative == True))
+        .values(**values)
+    )
+
+    if index_entries is not None:
+        index_entries.extend(session.execute(
+            select(staging.c.GoogleId, staging.c.LocationId, main.c.MetricId)
+            .where(and_(main.c.Id == staging.c.LocationId, staging.c.IsRepresentative == True,
+                        staging.c.GoogleId != ''))
+        ).all())
+
+    _clear_staging(session, staging)
+    stage_metrics.record('write', time.perf_counter() - start_time - lookup_seconds, len(rows))
+
+    results['metrics_added'] = new_metrics.rowcount if new_metrics.rowcount >= 0 else len(rows)
+    results['metrics_skipped'] = len(rows) - results['metrics_added']
+    results['locations_added'] = new_locations.rowcount if new_locations.rowcount >= 0 else 0
+    results['locations_updated'] = len(rows) - results['locations_added']
+    return results
@@ -1,13 +1,20 @@
 import pyodbc
+import asyncio
 import logging
+import random
+import threading
 import time
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import OperationalError
-from ..configurations.config import DB_CONFIG
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from ..configurations.config import DB_CONFIG, DB_CONFIGS, DB_POOL_CONFIG, DEADLOCK_CONFIG
+from ..monitoring.stage_metrics import stage_metrics
 
-def get_connection_string():
-    return f"DRIVER={{{DB_CONFIG['driver']}}};SERVER={DB_CONFIG['server']};DATABASE={DB_CONFIG['database']};UID={DB_CONFIG['username']};PWD={DB_CONFIG['password']};"
+def get_connection_string(db_config=None):
+    db_config = db_config or DB_CONFIG
+    return f"DRIVER={{{db_config['driver']}}};SERVER={db_config['server']};DATABASE={db_config['database']};UID={db_config['username']};PWD={db_config['password']};"
     
 
 def create_connection():
@@ -19,42 +26,232 @@ def create_connection():
         logging.error(f"Connection Error: {e}")
         return None
 
-def get_engine():
-    conn_str = get_connection_string()
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.connections_invalidated = 0
+
+    def record_checkout(self, wait_time):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += wait_time
+            self.checkout_wait_max = max(self.checkout_wait_max, wait_time)
+
+    def record_event(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkout_wait_avg_ms': round(self.checkout_wait_total / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                'checkout_wait_max_ms': round(self.checkout_wait_max * 1000, 2),
+                'connections_opened': self.connections_opened,
+                'connections_closed': self.connections_closed,
+                'connections_invalidated': self.connections_invalidated,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record_checkout(time.perf_counter() - start_time)
+
+
+_engine = None
+_session_factory = None
+_async_engine = None
+_async_session_factory = None
+# Engines of the fan-out targets by (target, async), created next to the engine of DB_CONFIG
+_target_engines = {}
+_pool_size = DB_POOL_CONFIG['pool_size']
+_engine_lock = threading.Lock()
+
+
+def configure_pool(pool_size):
+    global _pool_size
+    with _engine_lock:
+        if _engine is not None and pool_size != _pool_size:
+            logging.warning(f"Database engine already created with pool size {_pool_size}, ignoring pool size {pool_size}.")
+            return
+        _pool_size = pool_size
+
+
+def _create_engine(db_config=None, pool_size=None):
+    conn_str = get_connection_string(db_config)
+    pool_size = pool_size or _pool_size
     connection_url = f"mssql+pyodbc:///?odbc_connect={conn_str}"
 
-    return create_engine(
+    engine = create_engine(
         connection_url,
         echo = False,    # True, for logging SQL Commands
+        poolclass=TimedQueuePool,
         pool_pre_ping = True,
-        pool_recycle=300,
-        pool_size=10,      
-        max_overflow=20,   
+        pool_recycle=DB_POOL_CONFIG['pool_recycle'],
+        pool_size=pool_size,
+        max_overflow=DB_POOL_CONFIG['max_overflow'],
+        pool_timeout=DB_POOL_CONFIG['pool_timeout'],
+        fast_executemany=DB_POOL_CONFIG['fast_executemany'],   # Bulk inserts are sent as one parameter array
         use_setinputsizes=False #OleDB Error (pyodbc.Error) ('HY104', '[HY104] [Microsoft][ODBC SQL Server Driver]Invalid precision value (0) (SQLBindParameter)')
     )
 
+    event.listen(engine.pool, 'connect', lambda *args: pool_stats.record_event('connections_opened'))
+    event.listen(engine.pool, 'close', lambda *args: pool_stats.record_event('connections_closed'))
+    event.listen(engine.pool, 'invalidate', lambda *args: pool_stats.record_event('connections_invalidated'))
+
+    logging.info(f"Database engine created with pool size {pool_size} and max overflow {DB_POOL_CONFIG['max_overflow']}.")
+    return engine
+
+
+def _create_async_engine(db_config=None, pool_size=None):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    conn_str = get_connection_string(db_config)
+    pool_size = pool_size or _pool_size
+    # aioodbc runs the ODBC calls in its own executor, queries and commits are awaited by the batch coroutines
+    engine = create_async_engine(
+        f"mssql+aioodbc:///?odbc_connect={conn_str}",
+        echo=False,
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_CONFIG['pool_recycle'],
+        pool_size=pool_size,
+        max_overflow=DB_POOL_CONFIG['max_overflow'],
+        pool_timeout=DB_POOL_CONFIG['pool_timeout'],
+        use_setinputsizes=False
+    )
+
+    event.listen(engine.sync_engine.pool, 'connect', lambda *args: pool_stats.record_event('connections_opened'))
+    event.listen(engine.sync_engine.pool, 'close', lambda *args: pool_stats.record_event('connections_closed'))
+    event.listen(engine.sync_engine.pool, 'invalidate', lambda *args: pool_stats.record_event('connections_invalidated'))
+
+    logging.info(f"Async database engine created with pool size {pool_size} and max overflow {DB_POOL_CONFIG['max_overflow']}.")
+    return engine
+
+
+def get_async_session_factory():
+    # Sessions of this factory only work inside AsyncBatchRunner batches, where their I/O is awaited
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                _async_engine = _create_async_engine()
+                _async_session_factory = sessionmaker(bind=_async_engine.sync_engine)
+    return _async_session_factory
+
+
+def get_target_session_factory(target, pool_size=None, async_mode=False):
+    # Each fan-out target has its own engine and pool, so a slow database never holds the connections of another
+    with _engine_lock:
+        if (target, async_mode) not in _target_engines:
+            db_config = DB_CONFIGS[target]
+            if async_mode:
+                engine = _create_async_engine(db_config, pool_size).sync_engine
+            else:
+                engine = _create_engine(db_config, pool_size)
+            logging.info(f"Engine for target {target} connects to {db_config['server']}/{db_config['database']}.")
+            _target_engines[(target, async_mode)] = (engine, sessionmaker(bind=engine))
+        return _target_engines[(target, async_mode)][1]
+
+
+def get_engine():
+    global _engine, _session_factory
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _create_engine()
+                _session_factory = sessionmaker(bind = _engine)
+    return _engine
+
+
+def warm_up_pool(connections=None):
+    engine = get_engine()
+    connections = connections or _pool_size
+    opened = []
+    start_time = time.time()
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    except Exception as e:
+        logging.error(f"Error warming up connection pool: {e}")
+    finally:
+        for connection in opened:
+            connection.close()
+    logging.info(f"Connection pool warmed with {len(opened)} connections in {time.time() - start_time:.2f}s.")
+    return len(opened)
+
+
+def log_pool_stats():
+    if _engine is not None:
+        logging.info(f"Connection pool stats: {pool_stats.snapshot()}, status: {_engine.pool.status()}")
+
+
+def dispose_engine():
+    global _engine, _session_factory, _async_engine, _async_session_factory
+    with _engine_lock:
+        # The async engine's connections are closed on its event loop by ExcelProcessor.close()
+        _async_engine = None
+        _async_session_factory = None
+        for (target, async_mode), (engine, _) in _target_engines.items():
+            if not async_mode:
+                logging.info(f"Disposing database engine of target {target}.")
+                engine.dispose()
+        _target_engines.clear()
+        if _engine is None:
+            return
+        logging.info(f"Disposing database engine. Connection pool stats: {pool_stats.snapshot()}")
+        _engine.dispose()
+        _engine = None
+        _session_factory = None
+
+def is_deadlock(error):
+    # SQL Server error 1205: the transaction was chosen as deadlock victim and is already rolled back
+    message = str(getattr(error, 'orig', error)).lower()
+    return isinstance(error, DBAPIError) and ('deadlock' in message or '(1205)' in message)
+
+
+def deadlock_backoff(attempt):
+    # Full jitter: writers that deadlocked together wait different times and do not collide again
+    return random.uniform(0, min(DEADLOCK_CONFIG['backoff_base'] * 2 ** attempt, DEADLOCK_CONFIG['backoff_max']))
+
+
+def backoff_sleep(seconds):
+    with stage_metrics.time('deadlock_retry'):
+        if in_greenlet():
+            # Inside an async batch, only this batch waits
+            await_only(asyncio.sleep(seconds))
+        else:
+            time.sleep(seconds)
+
+
 def retry_on_deadlock(func):
+    # The decorated function must be a whole unit of work with its own session: after a deadlock the
+    # transaction is gone, so everything it did is done again
     def wrapper(*args, **kwargs):
-        max_retries = 3
-        delay = 2  # seconds
-        for attempt in range(max_retries):
+        max_retries = DEADLOCK_CONFIG['max_replays']
+        for attempt in range(max_retries + 1):
             try:
                 return func(*args, **kwargs)
-            except OperationalError as e:
-                if "deadlock" in str(e).lower():
-                    logging.warning(f"Deadlock detected. Retrying {attempt + 1}/{max_retries}...")
-                    time.sleep(delay)
-                else:
+            except DBAPIError as e:
+                if not is_deadlock(e) or attempt == max_retries:
                     raise
-        logging.error("Max retries reached. Operation failed due to deadlock.")
-        raise
+                delay = deadlock_backoff(attempt)
+                stage_metrics.increment('deadlock_retries')
+                logging.warning(f"Deadlock in {func.__name__}, retrying {attempt + 1}/{max_retries} in {delay:.2f}s")
+                backoff_sleep(delay)
     return wrapper
 
-@retry_on_deadlock
-def execute_with_retry(session, operation):
-    return operation(session)
-
 def get_session():
-    engine = get_engine()
-    Session = sessionmaker(bind = engine)
-    return Session()
\ No newline at end of file
+    get_engine()
+    return _session_factory()
\ No newline at end of file
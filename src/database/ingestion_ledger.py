@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from ..configurations.config import EXCEL_CONFIG
+from ..utils.helpers import ensure_directory_exists
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS IngestionRun (
+    RunId TEXT PRIMARY KEY,
+    Host TEXT NOT NULL,
+    ProcessId INTEGER NOT NULL,
+    StartedAt TEXT NOT NULL,
+    FinishedAt TEXT
+);
+CREATE TABLE IF NOT EXISTS IngestedFile (
+    Id INTEGER PRIMARY KEY AUTOINCREMENT,
+    RunId TEXT NOT NULL REFERENCES IngestionRun (RunId),
+    FileName TEXT NOT NULL,
+    ArchivedPath TEXT,
+    ContentHash TEXT NOT NULL,
+    SizeBytes INTEGER NOT NULL,
+    RowCount INTEGER,
+    Status TEXT NOT NULL,
+    IngestedAt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS IX_IngestedFile_ContentHash ON IngestedFile (ContentHash);
+CREATE INDEX IF NOT EXISTS IX_IngestedFile_RunId ON IngestedFile (RunId);
+CREATE TABLE IF NOT EXISTS CommittedBatch (
+    Id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ContentHash TEXT NOT NULL,
+    StartRow INTEGER NOT NULL,
+    EndRow INTEGER NOT NULL,
+    RunId TEXT,
+    CommittedAt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS IX_CommittedBatch_ContentHash ON CommittedBatch (ContentHash);
+"""
+
+FILE_COLUMNS = ['Id', 'RunId', 'FileName', 'ArchivedPath', 'ContentHash', 'SizeBytes', 'RowCount', 'Status', 'IngestedAt']
+RUN_COLUMNS = ['RunId', 'Host', 'ProcessId', 'StartedAt', 'FinishedAt']
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def uncommitted_ranges(start, end, committed):
+    # Parts of the row range [start, end) not covered by the merged committed ranges
+    remaining = []
+    for committed_start, committed_end in committed:
+        if committed_end <= start:
+            continue
+        if committed_start >= end:
+            break
+        if committed_start > start:
+            remaining.append((start, committed_start))
+        start = max(start, committed_end)
+        if start >= end:
+            return remaining
+    remaining.append((start, end))
+    return remaining
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class IngestionLedger:
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, path=None):
+        self.path = path or EXCEL_CONFIG['ledger_path'] or os.path.join(EXCEL_CONFIG['archive_folder'],
+                                                                         'ingestion_ledger.db')
+        ensure_directory_exists(os.path.dirname(os.path.abspath(self.path)))
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # A checkpoint is written after every committed batch: WAL with NORMAL sync survives a process crash
+        # without an fsync per batch
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+        # Hashes of every successfully ingested file, so the duplicate check never touches the database
+        self._ingested = {row[0] for row in self._connection.execute(
+            "SELECT DISTINCT ContentHash FROM IngestedFile WHERE Status = ?", (self.SUCCEEDED,))}
+        self._claimed = set()
+        self.run_id = None
+        logging.info(f"Ingestion ledger opened: {self.path}, {len(self._ingested)} ingested files known.")
+
+    def _insert_run(self):
+        self.run_id = uuid.uuid4().hex
+        self._connection.execute("INSERT INTO IngestionRun (RunId, Host, ProcessId, StartedAt) VALUES (?, ?, ?, ?)",
+                                 (self.run_id, socket.gethostname(), os.getpid(), _now()))
+
+    def start_run(self):
+        with self._lock:
+            self._insert_run()
+            return self.run_id
+
+    def finish_run(self):
+        with self._lock:
+            if self.run_id is not None:
+                self._connection.execute("UPDATE IngestionRun SET FinishedAt = ? WHERE RunId = ?",
+                                         (_now(), self.run_id))
+
+    def claim(self, content_hash):
+        # False when the same bytes were already ingested or are being ingested right now
+        with self._lock:
+            if content_hash in self._ingested or content_hash in self._claimed:
+                return False
+            self._claimed.add(content_hash)
+            return True
+
+    def record(self, file_path, content_hash, status, row_count=None, archived_path=None):
+        stored_path = archived_path or file_path
+        size_bytes = os.path.getsize(stored_path) if os.path.exists(stored_path) else 0
+        with self._lock:
+            if self.run_id is None:
+                self._insert_run()
+            self._connection.execute(
+                "INSERT INTO IngestedFile (RunId, FileName, ArchivedPath, ContentHash, SizeBytes, RowCount, Status, "
+                "IngestedAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.run_id, os.path.basename(file_path), archived_path, content_hash, size_bytes, row_count, status,
+                 _now()))
+            if status != self.SKIPPED:
+                self._claimed.discard(content_hash)
+            if status == self.SUCCEEDED:
+                self._ingested.add(content_hash)
+                # The file is complete, its batch checkpoints are only needed while it can still be resumed
+                self._connection.execute("DELETE FROM CommittedBatch WHERE ContentHash = ?", (content_hash,))
+
+    def checkpoint(self, content_hash, start_row, end_row):
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO CommittedBatch (ContentHash, StartRow, EndRow, RunId, CommittedAt) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, start_row, end_row, self.run_id, _now()))
+
+    def committed_ranges(self, content_hash):
+        # Row ranges of the cleaned file whose batches were committed by an earlier, unfinished attempt
+        with self._lock:
+            rows = self._connection.execute("SELECT StartRow, EndRow FROM CommittedBatch WHERE ContentHash = ?",
+                                            (content_hash,)).fetchall()
+        return merge_ranges(rows)
+
+    def is_ingested(self, content_hash):
+        with self._lock:
+            return content_hash in self._ingested
+
+    def _query(self, sql, params, columns):
+        with self._lock:
+            return [dict(zip(columns, row)) for row in self._connection.execute(sql, params)]
+
+    def runs(self, limit=50):
+        return self._query(f"SELECT {', '.join(RUN_COLUMNS)} FROM IngestionRun ORDER BY StartedAt DESC LIMIT ?",
+                           (limit,), RUN_COLUMNS)
+
+    def files_for_run(self, run_id):
+        return self._query(f"SELECT {', '.join(FILE_COLUMNS)} FROM IngestedFile WHERE RunId = ? ORDER BY Id",
+                           (run_id,), FILE_COLUMNS)
+
+    def files_for_hash(self, content_hash):
+        return self._query(f"SELECT {', '.join(FILE_COLUMNS)} FROM IngestedFile WHERE ContentHash = ? ORDER BY Id",
+                           (content_hash,), FILE_COLUMNS)
+
+    def files_by_name(self, file_name):
+        return self._query(f"SELECT {', '.join(FILE_COLUMNS)} FROM IngestedFile WHERE FileName = ? ORDER BY Id",
+                           (file_name,), FILE_COLUMNS)
+
+    def close(self):
+        self.finish_run()
+        with self._lock:
+            self._connection.close()
+
+
+_ingestion_ledger = None
+_ingestion_ledger_lock = threading.Lock()
+
+
+def get_ingestion_ledger():
+    global _ingestion_ledger
+    with _ingestion_ledger_lock:
+        if _ingestion_ledger is None:
+            _ingestion_ledger = IngestionLedger()
+        return _ingestion_ledger
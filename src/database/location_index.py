@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select, func
+from sqlalchemy.orm import make_transient_to_detached
+from .models import OutscraperLocation, get_models
+from ..configurations.config import LOCATION_INDEX_CONFIG
+from ..utils.bloom import BloomFilter
+
+
+class LocationIndex:
+    # Rough cost of one entry: the GoogleId string, two UUIDs, the value tuple and the OrderedDict node
+    ENTRY_SIZE_BYTES = 400
+    ABSENT = object()
+
+    def __init__(self, memory_budget_mb=None, bloom_capacity=None, bloom_error_rate=None, models=None,
+                 trust_absent=True):
+        memory_budget_mb = memory_budget_mb or LOCATION_INDEX_CONFIG['memory_budget_mb']
+        self.max_entries = max(int(memory_budget_mb * 1024 * 1024 // self.ENTRY_SIZE_BYTES), 1)
+        self.bloom_capacity = bloom_capacity or LOCATION_INDEX_CONFIG['bloom_capacity']
+        self.bloom_error_rate = bloom_error_rate or LOCATION_INDEX_CONFIG['bloom_error_rate']
+        # Location ids belong to one target database, each target has its own index
+        self.models = models or get_models()
+        self._entries = OrderedDict()
+        self._bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        self._lock = threading.Lock()
+        # The Bloom filter only knows the locations this process loaded or wrote. When other nodes write to the
+        # same database, a place missing from it may exist anyway and is looked up in the database instead.
+        self.trust_absent = trust_absent
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.definitely_new = 0
+
+    def warm_up(self, session, chunk_size=None):
+        chunk_size = chunk_size or LOCATION_INDEX_CONFIG['warm_up_chunk_size']
+        table = self.models.OutscraperLocation.__table__
+        start_time = time.time()
+
+        row_count = session.execute(select(func.count()).select_from(table)).scalar() or 0
+        with self._lock:
+            if row_count * 2 > self.bloom_capacity:
+                self.bloom_capacity = row_count * 2
+            self._entries.clear()
+            self._bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+            self.warmed = False
+
+        statement = (
+            select(table.c.GoogleId, table.c.Id, table.c.MetricId)
+            .where(table.c.GoogleId.isnot(None))
+            .with_hint(table, 'WITH (NOLOCK)', 'mssql')
+            .execution_options(yield_per=chunk_size)
+        )
+        loaded = 0
+        for partition in session.execute(statement).partitions(chunk_size):
+            self.put_many(partition)
+            loaded += len(partition)
+
+        with self._lock:
+            self.warmed = True
+        logging.info(f"Location index warmed with {loaded} locations in {time.time() - start_time:.2f}s "
+                     f"({len(self._entries)} cached, bloom filter {self._bloom.size_bytes // 1024} KB)")
+        return loaded
+
+    def lookup(self, google_id):
+        with self._lock:
+            entry = self._entries.get(google_id)
+            if entry is not None:
+                self._entries.move_to_end(google_id)
+                self.hits += 1
+                return entry
+
+            if self.warmed and self.trust_absent and google_id not in self._bloom:
+                self.definitely_new += 1
+                return self.ABSENT
+
+            self.misses += 1
+            return None
+
+    def put(self, google_id, location_id, metric_id):
+        self.put_many([(google_id, location_id, metric_id)])
+
+    def put_many(self, entries):
+        with self._lock:
+            for google_id, location_id, metric_id in entries:
+                if not google_id:
+                    continue
+                if google_id in self._entries:
+                    self._entries.move_to_end(google_id)
+                else:
+                    self._bloom.add(google_id)
+                self._entries[google_id] = (location_id, metric_id)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.definitely_new
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'definitely_new': self.definitely_new,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.definitely_new) / lookups, 4) if lookups else 0.0,
+                'bloom_bytes': self._bloom.size_bytes,
+                'bloom_saturated': self._bloom.is_saturated,
+            }
+
+
+class InFlightPlaces:
+    # GoogleIds of the batches being written. Files processed at the same time can hold the same new place,
+    # both batches would miss it in the index and the database and insert it twice. A batch claims all of its
+    # places at once, so batches of different files holding a place take turns and the later one finds it.
+    def __init__(self):
+        self._held = set()
+        self._condition = threading.Condition()
+
+    def try_claim(self, google_ids):
+        with self._condition:
+            if not self._held.isdisjoint(google_ids):
+                return False
+            self._held.update(google_ids)
+            return True
+
+    def claim(self, google_ids):
+        # True when the batch had to wait for another one
+        with self._condition:
+            waited = not self._held.isdisjoint(google_ids)
+            if waited:
+                self._condition.wait_for(lambda: self._held.isdisjoint(google_ids))
+            self._held.update(google_ids)
+            return waited
+
+    def release(self, google_ids):
+        with self._condition:
+            self._held.difference_update(google_ids)
+            self._condition.notify_all()
+
+
+def attach_location(session, location_id, model=OutscraperLocation):
+    # Builds a persistent instance from a known primary key so updates are flushed without a SELECT
+    identity_key = session.identity_key(model, location_id)
+    location = session.identity_map.get(identity_key)
+    if location is None:
+        location = model(Id=location_id)
+        make_transient_to_detached(location)
+        session.add(location)
+    return location
+
+
+_location_index = None
+_location_index_lock = threading.Lock()
+
+
+def get_location_index():
+    global _location_index
+    with _location_index_lock:
+        if _location_index is None:
+            _location_index = LocationIndex()
+        return _location_index
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+from .models import get_models, METRIC_COLUMNS
+from ..configurations.config import DELTA_CONFIG
+
+RATING_PRECISION = 4
+
+
+def metric_fingerprint(values):
+    # values follow METRIC_COLUMNS: the rating is stored as DECIMAL(19,4), the rest are integers
+    rating = values[0]
+    normalized = (None if rating is None else round(float(rating), RATING_PRECISION),)
+    normalized += tuple(None if value is None else int(value) for value in values[1:])
+    # A stable 128-bit digest, a collision would skip a changed metric without any trace
+    return hashlib.blake2b(repr(normalized).encode('utf-8'), digest_size=16).digest()
+
+
+def record_fingerprint(record):
+    return metric_fingerprint([getattr(record, col) for col in METRIC_COLUMNS])
+
+
+class MetricFingerprintCache:
+    # Rough cost of one entry: the GoogleId string, the fingerprint digest and the OrderedDict node
+    ENTRY_SIZE_BYTES = 200
+
+    def __init__(self, memory_budget_mb=None, models=None):
+        memory_budget_mb = memory_budget_mb or DELTA_CONFIG['memory_budget_mb']
+        self.max_entries = max(int(memory_budget_mb * 1024 * 1024 // self.ENTRY_SIZE_BYTES), 1)
+        self.models = models or get_models()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def warm_up(self, session, chunk_size=None):
+        chunk_size = chunk_size or DELTA_CONFIG['warm_up_chunk_size']
+        main = self.models.OutscraperLocation.__table__
+        metric = self.models.OutscraperLocationMetric.__table__
+        start_time = time.time()
+
+        statement = (
+            select(main.c.GoogleId, *[metric.c[col] for col in METRIC_COLUMNS])
+            .join(metric, main.c.MetricId == metric.c.Id)
+            .where(main.c.GoogleId.isnot(None))
+            .with_hint(main, 'WITH (NOLOCK)', 'mssql')
+            .with_hint(metric, 'WITH (NOLOCK)', 'mssql')
+            .execution_options(yield_per=chunk_size)
+        )
+        loaded = 0
+        for partition in session.execute(statement).partitions(chunk_size):
+            self.put_many((row[0], metric_fingerprint(row[1:])) for row in partition)
+            loaded += len(partition)
+
+        logging.info(f"Metric fingerprints warmed with {loaded} locations in {time.time() - start_time:.2f}s "
+                     f"({len(self._entries)} cached)")
+        return loaded
+
+    def get(self, google_id):
+        with self._lock:
+            fingerprint = self._entries.get(google_id)
+            if fingerprint is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(google_id)
+            self.hits += 1
+            return fingerprint
+
+    def put_many(self, entries):
+        with self._lock:
+            for google_id, fingerprint in entries:
+                if not google_id:
+                    continue
+                self._entries[google_id] = fingerprint
+                self._entries.move_to_end(google_id)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def plan_metric_writes(records, fingerprints):
+    # A row's metric is written when it differs from the latest one seen for its place, earlier rows of the
+    # batch included. New locations always get their metric, the writers enforce that once they know.
+    writes = []
+    changed = {}
+    for record in records:
+        if not record.HasGoogleId:
+            writes.append(True)
+            continue
+
+        fingerprint = record_fingerprint(record)
+        previous = changed[record.GoogleId] if record.GoogleId in changed else fingerprints.get(record.GoogleId)
+        writes.append(previous != fingerprint)
+        changed[record.GoogleId] = fingerprint
+    return writes, changed
+
+
+_metric_fingerprints = None
+_metric_fingerprints_lock = threading.Lock()
+
+
+def get_metric_fingerprints():
+    global _metric_fingerprints
+    with _metric_fingerprints_lock:
+        if _metric_fingerprints is None:
+            _metric_fingerprints = MetricFingerprintCache()
+        return _metric_fingerprints
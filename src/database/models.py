@@ -1,4 +1,6 @@
+import threading
 import uuid
+from collections import namedtuple
 from sqlalchemy import Column, ForeignKey
 from sqlalchemy.dialects.mssql import UNIQUEIDENTIFIER, NVARCHAR, NTEXT, BIT, DATETIMEOFFSET, INTEGER, DECIMAL
 from sqlalchemy.ext.declarative import declarative_base
@@ -8,85 +10,119 @@ from datetime import datetime, timezone
 
 from ..configurations.config import DB_CONFIG
 
-Base = declarative_base()
-
-main_table = DB_CONFIG['main_table']
-metric_table = DB_CONFIG['metric_table']
-type_table = DB_CONFIG['type_table']
-
-class OutscraperLocation(Base):
-    __tablename__ = main_table
-
-    Id = Column(UNIQUEIDENTIFIER, primary_key=True, default=uuid.uuid4)
-    MetricId = Column(UNIQUEIDENTIFIER, ForeignKey(f"{metric_table}.Id"), nullable=True)
-    PlaceId = Column(NVARCHAR(255), nullable=True)
-    GoogleId = Column(NVARCHAR(255), nullable=True)
-    Name = Column(NVARCHAR(1000), nullable=True)
-    Type = Column(NVARCHAR(255), nullable=True)
-    Phone = Column(NVARCHAR(255), nullable=True)
-    FullAddress = Column(NVARCHAR(4000), nullable=True)
-    PostalCode = Column(NVARCHAR(10), nullable=True)
-    State = Column(NVARCHAR(255), nullable=True)
-    Latitude = Column(DECIMAL(19,4), nullable=True)
-    Longitude = Column(DECIMAL(19,4), nullable=True)
-    Verified = Column(BIT, nullable=True)
-    LocationLink = Column(NTEXT, nullable=True)
-    Country = Column(NVARCHAR(255), nullable=True)
-    CountryCode = Column(NVARCHAR(10), nullable=True)
-    Timezone = Column(NVARCHAR(255), nullable=True)
-
-    metrics = relationship("OutscraperLocationMetric",
-                          primaryjoin="OutscraperLocation.Id == OutscraperLocationMetric.LocationId",
-                          back_populates="location")
-
-    latest_metric = relationship("OutscraperLocationMetric",
-                               primaryjoin="OutscraperLocation.MetricId == OutscraperLocationMetric.Id",
-                               uselist=False,
-                               foreign_keys=[MetricId])
-    
-    
-    @classmethod
-    def find_by_google_id(cls, session, google_id):
-        return session.query(cls).from_statement(
-            text("SELECT * FROM " + main_table + " WITH (NOLOCK) WHERE GoogleId = :google_id")
-        ).params(google_id=google_id).first()
-
-    def __repr__(self):
-        return f"<OutscraperLocation(Id={self.Id}, Name={self.Name})>"
-
-class OutscraperLocationMetric(Base):
-    __tablename__ = metric_table
-
-    Id = Column(UNIQUEIDENTIFIER, primary_key=True, default=uuid.uuid4)
-    LocationId = Column(UNIQUEIDENTIFIER, ForeignKey(f"{main_table}.Id"), nullable=True)
-    Rating = Column(DECIMAL(19,4), nullable = True)
-    Reviews = Column(INTEGER, nullable=True)
-    ReviewsPerScore1 = Column(INTEGER, nullable=True)
-    ReviewsPerScore2 = Column(INTEGER, nullable=True)
-    ReviewsPerScore3 = Column(INTEGER, nullable=True)
-    ReviewsPerScore4 = Column(INTEGER, nullable=True)
-    ReviewsPerScore5 = Column(INTEGER, nullable=True)
-    PhotosCount = Column(INTEGER, nullable=True)
-    CreateDate = Column(DATETIMEOFFSET(7), nullable=True, default = datetime.now().replace(tzinfo=timezone.utc))
-    Year = Column(INTEGER, nullable=True)
-    Month = Column(INTEGER, nullable=True)
-
-    location = relationship("OutscraperLocation",
-                          primaryjoin="OutscraperLocationMetric.LocationId == OutscraperLocation.Id",
-                          back_populates="metrics",
-                          foreign_keys=[LocationId])
-
-    referenced_by = relationship("OutscraperLocation",
-                               primaryjoin="OutscraperLocationMetric.Id == OutscraperLocation.MetricId",
-                               uselist=False,
-                               foreign_keys=[OutscraperLocation.MetricId],
-                               overlaps="location,metrics,latest_metric")
-
-    def __repr__(self):
-        return f"<OutscraperLocationMetric(Id={self.Id}, LocationId={self.LocationId}, Rating={self.Rating})>"
-    
-class OutscraperLocationTypes(Base):
-    __tablename__ = type_table
-
-    Id = Column(UNIQUEIDENTIFIER, primary_key=True, default=uuid.uuid4)
-    Name = Column(NVARCHAR(255), nullable=True)
\ No newline at end of file
+TargetModels = namedtuple('TargetModels', ['Base', 'OutscraperLocation', 'OutscraperLocationMetric',
+                                           'OutscraperLocationTypes'])
+
+
+# Table hints of the GoogleId lookups before an insert. Within one process, reads without locks are enough:
+# InFlightPlaces orders the batches holding the same place. Nodes sharing a database lock the GoogleIds they
+# read until commit instead, so a node looking up a place another node is inserting waits and then finds it.
+LOOKUP_HINTS = {False: 'WITH (NOLOCK)', True: 'WITH (UPDLOCK, HOLDLOCK)'}
+
+# Value columns of a metric row, in the order batch records and metric fingerprints hold them
+METRIC_COLUMNS = ['Rating', 'Reviews', 'ReviewsPerScore1', 'ReviewsPerScore2', 'ReviewsPerScore3',
+                  'ReviewsPerScore4', 'ReviewsPerScore5', 'PhotosCount']
+
+
+def build_models(db_config):
+    # Every target database names its tables differently, each gets its own declarative base
+    base = declarative_base()
+    main_table = db_config['main_table']
+    metric_table = db_config['metric_table']
+    type_table = db_config['type_table']
+
+    class OutscraperLocation(base):
+        __tablename__ = main_table
+
+        Id = Column(UNIQUEIDENTIFIER, primary_key=True, default=uuid.uuid4)
+        MetricId = Column(UNIQUEIDENTIFIER, ForeignKey(f"{metric_table}.Id"), nullable=True)
+        PlaceId = Column(NVARCHAR(255), nullable=True)
+        GoogleId = Column(NVARCHAR(255), nullable=True)
+        Name = Column(NVARCHAR(1000), nullable=True)
+        Type = Column(NVARCHAR(255), nullable=True)
+        Phone = Column(NVARCHAR(255), nullable=True)
+        FullAddress = Column(NVARCHAR(4000), nullable=True)
+        PostalCode = Column(NVARCHAR(10), nullable=True)
+        State = Column(NVARCHAR(255), nullable=True)
+        Latitude = Column(DECIMAL(19,4), nullable=True)
+        Longitude = Column(DECIMAL(19,4), nullable=True)
+        Verified = Column(BIT, nullable=True)
+        LocationLink = Column(NTEXT, nullable=True)
+        Country = Column(NVARCHAR(255), nullable=True)
+        CountryCode = Column(NVARCHAR(10), nullable=True)
+        Timezone = Column(NVARCHAR(255), nullable=True)
+
+        metrics = relationship("OutscraperLocationMetric",
+                              primaryjoin="OutscraperLocation.Id == OutscraperLocationMetric.LocationId",
+                              back_populates="location")
+
+        latest_metric = relationship("OutscraperLocationMetric",
+                                   primaryjoin="OutscraperLocation.MetricId == OutscraperLocationMetric.Id",
+                                   uselist=False,
+                                   foreign_keys=[MetricId])
+
+
+        @classmethod
+        def find_by_google_id(cls, session, google_id, locking=False):
+            table_hint = f" {LOOKUP_HINTS[locking]}" if session.get_bind().dialect.name == 'mssql' else ""
+            return session.query(cls).from_statement(
+                text("SELECT * FROM " + cls.__tablename__ + table_hint + " WHERE GoogleId = :google_id")
+            ).params(google_id=google_id).first()
+
+        def __repr__(self):
+            return f"<OutscraperLocation(Id={self.Id}, Name={self.Name})>"
+
+    class OutscraperLocationMetric(base):
+        __tablename__ = metric_table
+
+        Id = Column(UNIQUEIDENTIFIER, primary_key=True, default=uuid.uuid4)
+        LocationId = Column(UNIQUEIDENTIFIER, ForeignKey(f"{main_table}.Id"), nullable=True)
+        Rating = Column(DECIMAL(19,4), nullable = True)
+        Reviews = Column(INTEGER, nullable=True)
+        ReviewsPerScore1 = Column(INTEGER, nullable=True)
+        ReviewsPerScore2 = Column(INTEGER, nullable=True)
+        ReviewsPerScore3 = Column(INTEGER, nullable=True)
+        ReviewsPerScore4 = Column(INTEGER, nullable=True)
+        ReviewsPerScore5 = Column(INTEGER, nullable=True)
+        PhotosCount = Column(INTEGER, nullable=True)
+        CreateDate = Column(DATETIMEOFFSET(7), nullable=True, default = datetime.now().replace(tzinfo=timezone.utc))
+        Year = Column(INTEGER, nullable=True)
+        Month = Column(INTEGER, nullable=True)
+
+        location = relationship("OutscraperLocation",
+                              primaryjoin="OutscraperLocationMetric.LocationId == OutscraperLocation.Id",
+                              back_populates="metrics",
+                              foreign_keys=[LocationId])
+
+        referenced_by = relationship("OutscraperLocation",
+                                   primaryjoin="OutscraperLocationMetric.Id == OutscraperLocation.MetricId",
+                                   uselist=False,
+                                   foreign_keys=[OutscraperLocation.MetricId],
+                                   overlaps="location,metrics,latest_metric")
+
+        def __repr__(self):
+            return f"<OutscraperLocationMetric(Id={self.Id}, LocationId={self.LocationId}, Rating={self.Rating})>"
+
+    class OutscraperLocationTypes(base):
+        __tablename__ = type_table
+
+        Id = Column(UNIQUEIDENTIFIER, primary_key=True, default=uuid.uuid4)
+        Name = Column(NVARCHAR(255), nullable=True)
+
+    return TargetModels(base, OutscraperLocation, OutscraperLocationMetric, OutscraperLocationTypes)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_models(db_config=None):
+    db_config = db_config or DB_CONFIG
+    with _models_lock:
+        if db_config['main_table'] not in _models:
+            _models[db_config['main_table']] = build_models(db_config)
+        return _models[db_config['main_table']]
+
+
+# The models of DB_CONFIG, used unless a processor is given the models of another target
+Base, OutscraperLocation, OutscraperLocationMetric, OutscraperLocationTypes = get_models()
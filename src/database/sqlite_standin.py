@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.mssql import UNIQUEIDENTIFIER, NTEXT, BIT, DATETIMEOFFSET
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from .models import get_models
+
+# SQL Server column types used by the models have no SQLite rendering, map them to the closest affinity
+@compiles(UNIQUEIDENTIFIER, 'sqlite')
+def _compile_uniqueidentifier(element, compiler, **kw):
+    return "CHAR(32)"
+
+@compiles(NTEXT, 'sqlite')
+def _compile_ntext(element, compiler, **kw):
+    return "TEXT"
+
+@compiles(BIT, 'sqlite')
+def _compile_bit(element, compiler, **kw):
+    return "BOOLEAN"
+
+@compiles(DATETIMEOFFSET, 'sqlite')
+def _compile_datetimeoffset(element, compiler, **kw):
+    return "DATETIME"
+
+
+def _configure_connections(engine, path):
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        # Transactions are started explicitly below, so concurrent writers queue on the busy timeout
+        # instead of failing when a read lock is upgraded
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL" if path else "PRAGMA journal_mode=MEMORY")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def get_sqlite_engine(path=None, models=None):
+    models = models or get_models()
+    if path:
+        engine = create_engine(f"sqlite:///{path}", connect_args={'check_same_thread': False, 'timeout': 30})
+    else:
+        # A single shared connection so every session sees the same in-memory database
+        engine = create_engine("sqlite://", connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    _configure_connections(engine, path)
+
+    models.Base.metadata.create_all(engine)
+    # Lookup indexes the production tables have, without them every GoogleId lookup is a table scan
+    location_table = models.OutscraperLocation.__tablename__
+    type_table = models.OutscraperLocationTypes.__tablename__
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{location_table}_google_id '
+                                   f'ON "{location_table}" ("GoogleId")')
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{type_table}_name '
+                                   f'ON "{type_table}" ("Name")')
+    return engine
+
+
+def get_sqlite_session_factory(path=None, models=None):
+    return sessionmaker(bind=get_sqlite_engine(path, models))
+
+
+def get_async_sqlite_session_factory(path, models=None):
+    # aiosqlite stand-in for the async mode. The schema is created through a regular engine first, so the
+    # database has to be a file both engines can open.
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    get_sqlite_engine(path, models).dispose()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", connect_args={'timeout': 30})
+    _configure_connections(engine.sync_engine, path)
+    return sessionmaker(bind=engine.sync_engine)
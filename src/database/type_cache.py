@@ -0,0 +1,121 @@
+import logging
+import threading
+import uuid
+from .database import retry_on_deadlock
+from .models import get_models
+
+
+class LocationTypeCache:
+    def __init__(self, models=None):
+        self.type_model = (models or get_models()).OutscraperLocationTypes
+        self._types = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, session):
+        types = {type_obj.Name: type_obj.Id for type_obj in session.query(self.type_model).all()}
+        with self._lock:
+            self._types.update(types)
+            self.loaded = True
+        logging.info(f"Location type cache loaded with {len(types)} types.")
+
+    def _ensure_loaded(self, session_factory):
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            session = session_factory()
+            try:
+                self.load(session)
+            finally:
+                session.close()
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._types
+
+    def __len__(self):
+        with self._lock:
+            return len(self._types)
+
+    def ensure_types(self, names, session_factory):
+        self._ensure_loaded(session_factory)
+
+        types_added = 0
+        types_existing = 0
+        remaining = set(names)
+
+        while remaining:
+            to_create = []
+            to_wait = []
+            with self._lock:
+                for name in remaining:
+                    if name in self._types:
+                        types_existing += 1
+                    elif name in self._in_flight:
+                        to_wait.append((name, self._in_flight[name]))
+                    else:
+                        self._in_flight[name] = threading.Event()
+                        to_create.append(name)
+
+            if to_create:
+                try:
+                    types_added += self._create_types(to_create, session_factory)
+                finally:
+                    with self._lock:
+                        for name in to_create:
+                            self._in_flight.pop(name).set()
+
+            # Names being inserted by another worker are picked up from the cache once it finishes,
+            # or retried here if that worker failed
+            for _, event in to_wait:
+                event.wait()
+            remaining = {name for name, _ in to_wait}
+            with self._lock:
+                types_existing += len([name for name in remaining if name in self._types])
+                remaining = {name for name in remaining if name not in self._types}
+
+        return types_added, types_existing
+
+    @retry_on_deadlock
+    def _create_types(self, names, session_factory):
+        session = session_factory()
+        try:
+            # Another process may have inserted some of them since the cache was loaded
+            found = {type_obj.Name: type_obj.Id for type_obj in session.query(self.type_model).filter(
+                self.type_model.Name.in_(names)
+            ).all()}
+
+            created = {}
+            for name in sorted(names):
+                if name not in found:
+                    type_id = uuid.uuid4()
+                    session.add(self.type_model(Id=type_id, Name=name))
+                    created[name] = type_id
+
+            session.commit()
+
+            with self._lock:
+                self._types.update(found)
+                self._types.update(created)
+            return len(created)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+_type_cache = None
+_type_cache_lock = threading.Lock()
+
+
+def get_type_cache():
+    global _type_cache
+    with _type_cache_lock:
+        if _type_cache is None:
+            _type_cache = LocationTypeCache()
+        return _type_cache
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from sqlalchemy.util import await_only, greenlet_spawn
+
+
+class AsyncBatchRunner:
+    # Drop-in for the writer thread pool: submit() returns a concurrent future, but every batch runs as a
+    # coroutine on one event loop. The existing synchronous write code runs inside a greenlet, so each query
+    # and commit on an async engine suspends the batch instead of blocking a thread.
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._exclusive = asyncio.Lock()
+        self._tasks = set()
+        self._thread = threading.Thread(target=self._run_loop, name='batch-loop', daemon=True)
+        self._thread.start()
+        logging.info(f"Async batch runner started with {max_in_flight} batches in flight.")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, fn, *args):
+        return asyncio.run_coroutine_threadsafe(self._run(fn, *args), self._loop)
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    async def _run(self, fn, *args):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            async with self._semaphore:
+                return await greenlet_spawn(fn, *args)
+        finally:
+            self._tasks.discard(task)
+
+    @contextmanager
+    def exclusive(self):
+        # Thread locks held across a query would block the whole loop when a second batch waits for them,
+        # code holding one while it talks to the database runs here one batch at a time
+        await_only(self._exclusive.acquire())
+        try:
+            yield
+        finally:
+            self._exclusive.release()
+
+    def shutdown(self, wait=True, finalizer=None):
+        # finalizer runs on the loop once the batches are done, e.g. to close pooled connections created there
+        if not self._loop.is_running():
+            return
+        if wait:
+            asyncio.run_coroutine_threadsafe(self._drain(finalizer), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _drain(self, finalizer):
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if finalizer is not None:
+            try:
+                await greenlet_spawn(finalizer)
+            except Exception as e:
+                logging.error(f"Error shutting down the async batch runner: {e}")
@@ -0,0 +1,90 @@
+import fnmatch
+import logging
+import os
+import threading
+import time
+from ..configurations.config import BACKLOG_CONFIG
+from ..monitoring.stage_metrics import stage_metrics
+
+BACKLOG_POLICIES = ('oldest', 'smallest', 'priority', 'name')
+
+
+def _file_info(file_path):
+    try:
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime
+    except OSError:
+        return 0, 0.0
+
+
+def _priority(file_name, patterns):
+    # Index of the first matching pattern, files matching no pattern come last
+    for index, pattern in enumerate(patterns):
+        if fnmatch.fnmatch(file_name.lower(), pattern.lower()):
+            return index
+    return len(patterns)
+
+
+def order_backlog(file_paths, policy=None, priority_patterns=None):
+    policy = policy or BACKLOG_CONFIG['policy']
+    patterns = priority_patterns if priority_patterns is not None else BACKLOG_CONFIG['priority_patterns']
+    if policy not in BACKLOG_POLICIES:
+        raise ValueError(f"Unknown backlog policy: {policy}. Expected one of {BACKLOG_POLICIES}")
+
+    info = {file_path: _file_info(file_path) for file_path in file_paths}
+    if policy == 'smallest':
+        key = lambda file_path: (info[file_path][0], info[file_path][1])
+    elif policy == 'oldest':
+        key = lambda file_path: (info[file_path][1], file_path)
+    elif policy == 'priority':
+        # Ties between files of the same priority are broken by age
+        key = lambda file_path: (_priority(os.path.basename(file_path), patterns), info[file_path][1])
+    else:
+        key = lambda file_path: os.path.basename(file_path)
+    return sorted(file_paths, key=key)
+
+
+class BacklogProgress:
+    def __init__(self, file_paths):
+        self._sizes = {file_path: max(_file_info(file_path)[0], 1) for file_path in file_paths}
+        self.total_files = len(file_paths)
+        self.total_bytes = sum(self._sizes.values())
+        self.done_files = 0
+        self.done_bytes = 0
+        self.failed = 0
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._publish(None)
+
+    def file_skipped(self, file_path):
+        # Taken by another node, it no longer belongs to this backlog
+        with self._lock:
+            self.total_files -= 1
+            self.total_bytes -= self._sizes.pop(file_path, 0)
+            self._publish(None)
+
+    def file_done(self, file_path, succeeded):
+        with self._lock:
+            self.done_files += 1
+            self.done_bytes += self._sizes.get(file_path, 0)
+            self.failed += not succeeded
+            elapsed = time.time() - self.start_time
+            # Throughput so far in bytes, file sizes are the only measure known for files not yet parsed
+            eta = (self.total_bytes - self.done_bytes) / (self.done_bytes / elapsed) if self.done_bytes else None
+            self._publish(eta)
+            logging.info(f"Backlog: {self.done_files}/{self.total_files} files "
+                         f"({self.done_bytes / 1024 / 1024:.1f}/{self.total_bytes / 1024 / 1024:.1f} MB), "
+                         f"{self.failed} failed, elapsed {elapsed:.0f}s, ETA {_format_eta(eta)}")
+
+    def _publish(self, eta):
+        stage_metrics.set_gauge('backlog_files_remaining', self.total_files - self.done_files)
+        stage_metrics.set_gauge('backlog_bytes_remaining', self.total_bytes - self.done_bytes)
+        stage_metrics.set_gauge('backlog_eta_seconds', round(eta, 1) if eta is not None else -1)
+
+
+def _format_eta(eta):
+    if eta is None:
+        return 'unknown'
+    minutes, seconds = divmod(int(eta), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
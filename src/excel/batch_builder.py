@@ -0,0 +1,147 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from ..database.models import METRIC_COLUMNS
+
+# (model attribute, cleaned frame column) pairs, in the order they appear on the records
+LOCATION_TEXT_FIELDS = [
+    ('PlaceId', 'place_id'),
+    ('Name', 'name'),
+    ('Type', 'type'),
+    ('Phone', 'phone'),
+    ('FullAddress', 'full_address'),
+    ('PostalCode', 'postal_code'),
+    ('State', 'state'),
+    ('LocationLink', 'location_link'),
+    ('Country', 'country'),
+    ('CountryCode', 'country_code'),
+    ('Timezone', 'time_zone'),
+]
+LOCATION_FLOAT_FIELDS = [
+    ('Latitude', 'latitude'),
+    ('Longitude', 'longitude'),
+]
+# Metric fields follow the METRIC_COLUMNS order
+METRIC_FLOAT_FIELDS = [
+    ('Rating', 'rating'),
+]
+METRIC_INT_FIELDS = [
+    ('Reviews', 'reviews'),
+    ('ReviewsPerScore1', 'reviews_per_score_1'),
+    ('ReviewsPerScore2', 'reviews_per_score_2'),
+    ('ReviewsPerScore3', 'reviews_per_score_3'),
+    ('ReviewsPerScore4', 'reviews_per_score_4'),
+    ('ReviewsPerScore5', 'reviews_per_score_5'),
+    ('PhotosCount', 'photos_count'),
+]
+
+LOCATION_COLUMNS = ([name for name, _ in LOCATION_TEXT_FIELDS] + [name for name, _ in LOCATION_FLOAT_FIELDS] +
+                    ['Verified'])
+
+BatchRecord = namedtuple('BatchRecord', ['GoogleId', 'HasGoogleId'] + LOCATION_COLUMNS + METRIC_COLUMNS)
+
+NULL_GOOGLE_IDS = ['', 'nan', 'None']
+LOCATION_TEXT_COLUMNS = {col for _, col in LOCATION_TEXT_FIELDS}
+LOCATION_FLOAT_COLUMNS = {col for _, col in LOCATION_FLOAT_FIELDS}
+
+
+def _text_column(df, col):
+    if col not in df.columns:
+        return [''] * len(df)
+    values = df[col]
+    # Categoricals from clean_data_frame hold cleaned strings and list them without a conversion
+    if isinstance(values.dtype, pd.CategoricalDtype) and col != 'postal_code':
+        return values.tolist()
+    if pd.api.types.infer_dtype(values, skipna=False) != 'string':
+        values = values.astype(str)
+    if col == 'postal_code':
+        values = values.mask(values.str.lower().isin(['nan', 'none']), '')
+    return values.tolist()
+
+
+def _numeric_column(df, col, dtype):
+    if col not in df.columns:
+        return [dtype(0)] * len(df)
+    values = df[col]
+    # Already typed by clean_data_frame, coercion only matters when cleaning bailed out early
+    if values.dtype.kind != ('f' if dtype is float else 'i'):
+        values = pd.to_numeric(values, errors='coerce').fillna(0).astype(dtype)
+    return values.tolist()
+
+
+def build_batch_records(df):
+    if 'google_id' in df.columns:
+        google_ids = df['google_id']
+        has_google_id = (google_ids.notna() & ~google_ids.astype(str).str.strip().isin(NULL_GOOGLE_IDS)).tolist()
+        google_ids = google_ids.tolist()
+    else:
+        google_ids = [None] * len(df)
+        has_google_id = [False] * len(df)
+
+    if 'verified' in df.columns:
+        verified = df['verified'].fillna(False).astype(bool).tolist()
+    else:
+        verified = [False] * len(df)
+
+    columns = [google_ids, has_google_id]
+    columns += [_text_column(df, col) for _, col in LOCATION_TEXT_FIELDS]
+    columns += [_numeric_column(df, col, float) for _, col in LOCATION_FLOAT_FIELDS]
+    columns.append(verified)
+    columns += [_numeric_column(df, col, float) for _, col in METRIC_FLOAT_FIELDS]
+    columns += [_numeric_column(df, col, int) for _, col in METRIC_INT_FIELDS]
+
+    return list(map(BatchRecord._make, zip(*columns)))
+
+
+def _last_filled(source, slots, slot_codes, positions, codes, filled):
+    # Position of the last row with a value in each group; groups without one keep the place's last row
+    last = pd.Series(positions[filled]).groupby(codes[filled]).max()
+    found = last.reindex(slot_codes).to_numpy()
+    source = source.copy()
+    source[slots] = np.where(np.isnan(found), source[slots], found).astype(np.int64)
+    return source
+
+
+def coalesce_places(df):
+    # Folds rows sharing a google_id into the place's last row: location fields take the last non-empty value
+    # of the group, the metrics are the last row's, which is the latest observation in the export
+    if 'google_id' not in df.columns or df.empty:
+        return df, 0
+
+    google_ids = df['google_id'].astype(str).str.strip()
+    duplicated = (google_ids.duplicated(keep=False) & ~google_ids.isin(NULL_GOOGLE_IDS) &
+                  df['google_id'].notna()).to_numpy()
+    if not duplicated.any():
+        return df, 0
+
+    keep = ~duplicated | ~google_ids.duplicated(keep='last').to_numpy()
+    rows = np.flatnonzero(keep)
+    positions = np.flatnonzero(duplicated)
+    # Groups are keyed by integer codes, which group much faster than the GoogleId strings
+    codes, _ = pd.factorize(google_ids.to_numpy()[positions])
+    slots = np.flatnonzero(duplicated[rows])
+    slot_codes = codes[np.searchsorted(positions, rows[slots])]
+
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        source = rows
+        if col in LOCATION_TEXT_COLUMNS:
+            grouped = values.iloc[positions]
+            filled = grouped.notna().to_numpy() & (grouped.astype(str).str.strip().to_numpy() != '')
+            source = _last_filled(rows, slots, slot_codes, positions, codes, filled)
+        elif col in LOCATION_FLOAT_COLUMNS:
+            # 0.0 is what cleaning leaves for a missing coordinate
+            filled = values.iloc[positions].to_numpy() != 0.0
+            source = _last_filled(rows, slots, slot_codes, positions, codes, filled)
+        columns[col] = values.take(source).reset_index(drop=True)
+
+    return pd.DataFrame(columns), len(df) - len(rows)
+
+
+def location_params(record):
+    return {col: getattr(record, col) for col in LOCATION_COLUMNS}
+
+
+def metric_params(record):
+    return {col: getattr(record, col) for col in METRIC_COLUMNS}
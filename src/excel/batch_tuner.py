@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from ..configurations.config import AUTOTUNE_CONFIG
+from ..monitoring.stage_metrics import stage_metrics
+
+
+class BatchTuner:
+    GROWTH_FACTOR = 1.5
+    # A window must beat the best throughput by this share to count as an improvement
+    IMPROVEMENT = 0.05
+
+    def __init__(self, batch_size, workers, max_workers=None, min_batch_size=None, max_batch_size=None,
+                 target_latency=None, window=None, probe_windows=None):
+        self.min_batch_size = min_batch_size or AUTOTUNE_CONFIG['min_batch_size']
+        self.max_batch_size = max_batch_size or AUTOTUNE_CONFIG['max_batch_size']
+        self.batch_size = min(batch_size, self.max_batch_size)
+        self.workers = workers
+        # Writers are added up to this ceiling while throughput keeps improving
+        self.max_workers = max(max_workers or AUTOTUNE_CONFIG['max_workers'] or workers * 2, workers)
+        self.target_latency = target_latency or AUTOTUNE_CONFIG['target_latency']
+        self.window = window or AUTOTUNE_CONFIG['window']
+        self.probe_windows = probe_windows or AUTOTUNE_CONFIG['probe_windows']
+        self._lock = threading.Lock()
+
+        self._best = None
+        self._previous = None
+        self._last_move = None
+        self._settled_windows = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.perf_counter()
+        self._window_retries = stage_metrics.calls('deadlock_retry')
+        self._batches = 0
+        self._rows = 0
+        self._failed = 0
+        self._latency = 0.0
+
+    def record(self, rows, seconds, failed=False):
+        with self._lock:
+            self._batches += 1
+            self._rows += rows
+            self._latency += seconds
+            self._failed += failed
+            # Batches written with the previous settings are still in flight for a while, so the window
+            # spans several rounds of the current concurrency
+            if self._batches >= max(self.window, self.workers * 2):
+                self._adjust()
+                self._reset_window()
+
+    def _adjust(self):
+        elapsed = time.perf_counter() - self._window_start
+        throughput = self._rows / elapsed if elapsed else 0.0
+        latency = self._latency / self._batches
+        contention = self._failed + max(stage_metrics.calls('deadlock_retry') - self._window_retries, 0)
+        current = (self.batch_size, self.workers)
+
+        if contention or latency > self.target_latency:
+            # Back off: smaller batches hold locks for less time, fewer writers contend less
+            self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+            if contention:
+                self.workers = max(self.workers - 1, 1)
+            self._best, self._last_move = None, None
+            if (self.batch_size, self.workers) != current:
+                reason = f"{contention} deadlocks/failures" if contention else f"latency {latency:.2f}s"
+                self._log_change(current, f"backing off after {reason}", throughput, latency)
+        elif self._best is None or throughput > self._best * (1 + self.IMPROVEMENT):
+            self._best, self._previous, self._settled_windows = throughput, current, 0
+            self._grow(throughput, latency)
+        elif self._last_move is not None:
+            # The last step did not pay off, go back to the best known settings
+            self.batch_size, self.workers = self._previous
+            self._last_move = None
+            self._log_change(current, "reverting, no throughput gain", throughput, latency)
+        else:
+            self._settled_windows += 1
+            if self._settled_windows >= self.probe_windows:
+                # Conditions drift (table size, server load), probe again from time to time
+                self._best, self._settled_windows = None, 0
+
+    def _grow(self, throughput, latency):
+        current = (self.batch_size, self.workers)
+        # Alternate between the two knobs so each step changes one variable
+        if self._last_move != 'batch_size' and self.batch_size < self.max_batch_size:
+            self.batch_size = min(int(self.batch_size * self.GROWTH_FACTOR) + 1, self.max_batch_size)
+            self._last_move = 'batch_size'
+        elif self.workers < self.max_workers:
+            self.workers += 1
+            self._last_move = 'workers'
+        elif self.batch_size < self.max_batch_size:
+            self.batch_size = min(int(self.batch_size * self.GROWTH_FACTOR) + 1, self.max_batch_size)
+            self._last_move = 'batch_size'
+        else:
+            self._last_move = None
+            return
+        self._log_change(current, "growing", throughput, latency)
+
+    def _log_change(self, previous, reason, throughput, latency):
+        logging.info(f"Auto-tune {reason}: batch size {previous[0]} -> {self.batch_size}, workers {previous[1]} -> "
+                     f"{self.workers} ({throughput:.0f} rows/sec, {latency:.2f}s per batch)")
+
+    def settings(self):
+        with self._lock:
+            return {'batch_size': self.batch_size, 'workers': self.workers}
@@ -0,0 +1,229 @@
+import logging
+import os
+import threading
+import time
+import concurrent.futures
+from collections import defaultdict
+from .processor import ExcelProcessor
+from ..configurations.config import EXCEL_CONFIG, FANOUT_CONFIG, DB_CONFIGS
+from ..database.database import get_target_session_factory
+from ..database.models import get_models
+from ..database.type_cache import LocationTypeCache
+from ..database.location_index import LocationIndex
+from ..database.metric_fingerprints import MetricFingerprintCache
+from ..database.ingestion_ledger import IngestionLedger, hash_file
+from ..monitoring.file_leases import SKIPPED
+
+
+class BatchFeed:
+    # One parsed batch stream read by several targets at their own pace. The target that runs out of
+    # batches first pulls the next one from the parser, batches are dropped once every target has read them.
+    # With max_buffered set, a target that many batches ahead waits for the slowest one.
+    def __init__(self, batches, readers, max_buffered=None):
+        self._source = iter(batches)
+        self._source_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._buffer = []
+        self._offset = 0
+        self._positions = [0] * readers
+        # Readers still reading, a target that stopped or failed no longer holds batches back
+        self._active = set(range(readers))
+        self.max_buffered = max(max_buffered, 1) if max_buffered is not None else None
+        self._finished = False
+        self._error = None
+
+    def reader(self, index):
+        try:
+            while True:
+                batch = self._next(index)
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            self.close_reader(index)
+
+    def close_reader(self, index):
+        with self._lock:
+            self._active.discard(index)
+            self._trim()
+
+    def _next(self, index):
+        position = self._positions[index]
+        with self._lock:
+            if position - self._offset < len(self._buffer):
+                return self._take(index, position)
+
+        with self._source_lock:
+            with self._lock:
+                # Another reader may have parsed it while this one waited
+                if position - self._offset < len(self._buffer):
+                    return self._take(index, position)
+                if self._error is not None:
+                    raise self._error
+                if self._finished:
+                    return None
+                if self.max_buffered is not None:
+                    # The slower targets read from the buffer without the source lock, so they can catch up
+                    self._changed.wait_for(lambda: len(self._buffer) < self.max_buffered)
+            try:
+                batch = next(self._source, None)
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+                raise
+            with self._lock:
+                if batch is None:
+                    self._finished = True
+                    return None
+                self._buffer.append(batch)
+                return self._take(index, position)
+
+    def _take(self, index, position):
+        batch = self._buffer[position - self._offset]
+        self._positions[index] = position + 1
+        self._trim()
+        return batch
+
+    def _trim(self):
+        # Called with the lock held
+        positions = [self._positions[index] for index in self._active]
+        consumed = (min(positions) if positions else self._offset + len(self._buffer)) - self._offset
+        if consumed > 0:
+            del self._buffer[:consumed]
+            self._offset += consumed
+            self._changed.notify_all()
+
+
+def _target_ledger_path(target):
+    base = EXCEL_CONFIG['ledger_path'] or os.path.join(EXCEL_CONFIG['archive_folder'], 'ingestion_ledger.db')
+    root, extension = os.path.splitext(base)
+    return f"{root}_{target}{extension}"
+
+
+class FanOutProcessor(ExcelProcessor):
+    # Parses, cleans and validates each file once and writes it to several DB_CONFIGS targets at the same time.
+    # Every target is an ExcelProcessor with its own engine, models, caches, writer pool and ledger.
+    def __init__(self, targets=None, session_factories=None, location_index=False, ledger=False, **kwargs):
+        targets = targets or FANOUT_CONFIG['targets']
+        if not targets:
+            raise ValueError("Fan-out needs at least one target from DB_CONFIGS")
+        unknown = [target for target in targets if target not in DB_CONFIGS]
+        if unknown:
+            raise ValueError(f"Unknown fan-out targets: {unknown}. Expected names from {list(DB_CONFIGS)}")
+        if kwargs.get('parse_workers'):
+            logging.warning("Parse workers are not supported with fan-out, files are parsed in the writer process.")
+        kwargs['parse_workers'] = 0
+        session_factories = session_factories or {}
+        delta = kwargs.pop('delta', False)
+        autotune = kwargs.pop('autotune', False)
+        async_mode = kwargs.pop('async_mode', False)
+
+        # This processor only parses, validates and archives, the writes go through the targets
+        super().__init__(**kwargs)
+        self.targets = {}
+        for target in targets:
+            models = get_models(DB_CONFIGS[target])
+            self.targets[target] = ExcelProcessor(
+                batch_size=self.batch_size,
+                max_workers=self.max_workers,
+                write_mode=self.write_mode,
+                session_factory=session_factories.get(target) or get_target_session_factory(
+                    target, self.writer_budget, async_mode),
+                models=models,
+                type_cache=LocationTypeCache(models),
+                location_index=LocationIndex(models=models) if location_index else None,
+                ledger=IngestionLedger(_target_ledger_path(target)) if ledger else None,
+                delta=delta,
+                fingerprints=MetricFingerprintCache(models=models) if delta else None,
+                autotune=autotune,
+                coalesce_duplicates=False,
+                validate_rows=False,
+                writer_budget=self.writer_budget,
+                async_mode=async_mode,
+                archive_files=False,
+                leases=self.leases,
+                checkpoints=self.leases.checkpoints(target) if self.leases is not None else None,
+            )
+        # Rows are validated once for every target, so they have to fit the narrowest column of each
+        limits = [target.text_limits for target in self.targets.values()]
+        self.text_limits = {col: min(target_limits[col] for target_limits in limits if col in target_limits)
+                            for col in set().union(*limits)}
+        logging.info(f"Fan-out to {len(self.targets)} targets: {', '.join(self.targets)}")
+
+    def warm_up(self):
+        for target in self.targets.values():
+            target.warm_up()
+
+    def request_stop(self):
+        super().request_stop()
+        for target in self.targets.values():
+            target.request_stop()
+
+    def close(self):
+        super().close()
+        for target in self.targets.values():
+            target.close()
+            if target.ledger is not None:
+                target.ledger.close()
+
+    def process_file(self, file_path):
+        logging.info(f"Processing file: {file_path}")
+        file_path = self._lease_file(file_path)
+        if file_path is None:
+            return SKIPPED
+        started = time.perf_counter()
+        content_hash = None
+        if any(target.checkpoints is not None for target in self.targets.values()):
+            try:
+                content_hash = hash_file(file_path)
+            except OSError as e:
+                logging.warning(f"Could not hash {file_path} for the ingestion ledgers: {e}")
+
+        # Targets that already ingested the same bytes, e.g. before an earlier attempt failed on another
+        # target, are skipped
+        claimed = {name: target for name, target in self.targets.items() if target._claim_file(file_path, content_hash)}
+        if not claimed:
+            logging.info(f"Every target already ingested {file_path}")
+            self.move_processed_file(file_path)
+            return True
+
+        totals = defaultdict(int)
+        try:
+            batches, total_batches = self._parse_file(file_path, totals)
+        except Exception as e:
+            logging.error(f"Error processing file {file_path}: {e}")
+            for target in claimed.values():
+                target._release_file(file_path, False)
+            return False
+
+        # A streamed file is bounded like the batches in flight of a single target, so a slow target cannot make
+        # the parser read the whole file into memory. A loaded file is in memory already, the fast targets run ahead
+        feed = BatchFeed(batches, len(claimed), self.max_workers * 2 if self.streaming else None)
+
+        def write(index, target):
+            try:
+                return target._write_file(file_path, feed.reader(index), total_batches, defaultdict(int))
+            finally:
+                feed.close_reader(index)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(claimed), thread_name_prefix='fanout') as executor:
+            futures = {name: executor.submit(write, index, target)
+                       for index, (name, target) in enumerate(claimed.items())}
+            results = {name: future.result() for name, future in futures.items()}
+
+        if totals['rows_coalesced'] or totals['rows_quarantined']:
+            logging.info(f"Parsed {file_path} once for {len(claimed)} targets: {totals['rows_coalesced']} rows "
+                         f"coalesced, {totals['rows_quarantined']} rows quarantined.")
+        if SKIPPED in results.values() or (self.leases is not None and not self.leases.owns(file_path)):
+            # Another node reclaimed the file, it resumes every target from the shared checkpoints
+            return SKIPPED
+        failed = [name for name, succeeded in results.items() if not succeeded]
+        if failed:
+            # Targets that succeeded have recorded the file in their ledger and skip it on the next attempt
+            logging.error(f"File {file_path} failed on targets {failed}, it stays in the watch folder.")
+            return False
+
+        logging.info(f"File written to every target in {time.perf_counter() - started:.2f}s: {file_path}")
+        self.move_processed_file(file_path)
+        return True
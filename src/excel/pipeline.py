@@ -0,0 +1,374 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import concurrent.futures
+from collections import defaultdict
+from functools import partial
+from .readers import read_input_file, open_chunk_reader
+from .batch_builder import build_batch_records, coalesce_places
+from .validation import validate_frame, QuarantineFile
+from ..configurations.config import TARGET_COLUMNS
+from ..utils.helpers import clean_data_frame
+from ..monitoring.stage_metrics import stage_metrics
+from ..monitoring.file_leases import LeaseLost
+
+# Set in each parser process by the pool initializer
+_parse_queue = None
+_stop_parsing = None
+
+
+def _init_parser(parse_queue, stop_parsing):
+    global _parse_queue, _stop_parsing
+    _parse_queue = parse_queue
+    _stop_parsing = stop_parsing
+    # The main process owns shutdown, Ctrl+C must not kill parsers halfway through a file
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _split_batches(records, batch_size):
+    return [records[start_idx:start_idx + batch_size] for start_idx in range(0, len(records), batch_size)]
+
+
+def _prepare_records(df, coalesce, quarantine, limits):
+    folded = 0
+    if coalesce:
+        df, folded = coalesce_places(df)
+    rejected = 0
+    if quarantine is not None:
+        df, rejected_rows = validate_frame(df, limits)
+        quarantine.write(rejected_rows)
+        rejected = len(rejected_rows)
+    return build_batch_records(df), folded, rejected
+
+
+def parse_file(file_path, batch_size, chunk_size, streaming, coalesce=False, quarantine_folder=None, limits=None):
+    try:
+        total_rows = 0
+        rows_coalesced = 0
+        rows_quarantined = 0
+        # A file has a single parser, so the parser owns the quarantine file
+        quarantine = QuarantineFile(file_path, quarantine_folder) if quarantine_folder else None
+        # Stage timings of the parser process travel back with the done message
+        read_seconds = 0.0
+        clean_seconds = 0.0
+        reader = open_chunk_reader(file_path, chunk_size, TARGET_COLUMNS) if streaming else None
+        if reader is not None:
+            missing_columns = reader.missing_columns
+            with reader:
+                chunks = iter(reader)
+                while True:
+                    start_time = time.perf_counter()
+                    chunk = next(chunks, None)
+                    read_seconds += time.perf_counter() - start_time
+                    if chunk is None:
+                        break
+
+                    start_time = time.perf_counter()
+                    records, folded, rejected = _prepare_records(clean_data_frame(chunk, compact=True), coalesce,
+                                                                 quarantine, limits)
+                    rows_coalesced += folded
+                    rows_quarantined += rejected
+                    clean_seconds += time.perf_counter() - start_time
+                    total_rows += len(records)
+                    if _stop_parsing.is_set():
+                        _parse_queue.put(('stopped', file_path))
+                        return total_rows
+                    _parse_queue.put(('batches', file_path, _split_batches(records, batch_size)))
+        else:
+            start_time = time.perf_counter()
+            df = read_input_file(file_path, TARGET_COLUMNS)
+            read_seconds = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            missing_columns = [col for col in TARGET_COLUMNS if col not in df.columns]
+            records, rows_coalesced, rows_quarantined = _prepare_records(
+                clean_data_frame(df[[col for col in TARGET_COLUMNS if col in df.columns]], compact=True), coalesce,
+                quarantine, limits)
+            clean_seconds = time.perf_counter() - start_time
+            del df
+            total_rows = len(records)
+
+            # Hand over chunk_size rows at a time so the queue bound also bounds memory in the main process
+            rows_per_message = max(chunk_size // batch_size, 1) * batch_size
+            for start_idx in range(0, total_rows, rows_per_message):
+                if _stop_parsing.is_set():
+                    _parse_queue.put(('stopped', file_path))
+                    return total_rows
+                batches = _split_batches(records[start_idx:start_idx + rows_per_message], batch_size)
+                _parse_queue.put(('batches', file_path, batches))
+
+        timings = {'read': read_seconds, 'clean': clean_seconds}
+        _parse_queue.put(('done', file_path, total_rows, missing_columns, timings, rows_coalesced, rows_quarantined))
+        return total_rows
+    except Exception as e:
+        _parse_queue.put(('error', file_path, str(e)))
+        return 0
+
+
+class _FileState:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.done = concurrent.futures.Future()
+        self.parse_future = None
+        self.totals = defaultdict(int)
+        self.total_batches = 0
+        self.error_batches = 0
+        self.pending = 0
+        self.parsed = False
+        self.total_rows = 0
+        self.missing_columns = []
+        self.error = None
+        # Batches arrive in file order, so the running row count is the start row of the next batch
+        self.next_row = 0
+        self.content_hash = None
+        self.committed = []
+        # Set when the processor stops, batches of the file that arrive afterwards are dropped
+        self.stopping = False
+
+
+class ParsePipeline:
+    def __init__(self, processor, parse_workers, queue_size=None):
+        self.processor = processor
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size or parse_workers * 2
+        self._files = {}
+        self._lock = threading.Lock()
+        self._slots = processor.writer_budget * 2
+        self._in_flight = threading.BoundedSemaphore(self._slots)
+        self._stopping = threading.Event()
+        self._queue = None
+        self._stop_parsing = None
+        self._parsers = None
+        self._writers = None
+        self._dispatcher = None
+
+    def _start(self):
+        # spawn keeps the parsers clear of the engine, pool threads and locks held by this process
+        context = multiprocessing.get_context('spawn')
+        if self._queue is None:
+            self._queue = context.Queue(maxsize=self.queue_size)
+            self._stop_parsing = context.Event()
+            self._writers = self.processor._writer_pool()
+            self._dispatcher = threading.Thread(target=self._dispatch, name='parse-dispatcher', daemon=True)
+            self._dispatcher.start()
+            logging.info(f"Parse pipeline started with {self.parse_workers} parser processes and "
+                         f"{self.processor.writer_budget} writer threads.")
+        if self._parsers is None:
+            self._parsers = concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                                   mp_context=context,
+                                                                   initializer=_init_parser,
+                                                                   initargs=(self._queue, self._stop_parsing))
+
+    def submit(self, file_path):
+        if self.processor._stopping.is_set():
+            logging.info(f"Not starting {file_path}, the processor is stopping.")
+            self.processor._release_file(file_path, False)
+            done = concurrent.futures.Future()
+            done.set_result(False)
+            return done
+
+        with self._lock:
+            if file_path in self._files:
+                return self._files[file_path].done
+
+            self._start()
+            state = _FileState(file_path)
+            state.content_hash, state.committed = self.processor._resume_state(file_path)
+            self._files[file_path] = state
+            state.parse_future = self._parsers.submit(parse_file, file_path, self.processor.batch_size,
+                                                      self.processor.chunk_size, self.processor.streaming,
+                                                      self.processor.coalesce_duplicates,
+                                                      self.processor._quarantine_folder(file_path),
+                                                      self.processor.text_limits)
+            return state.done
+
+    def process_file(self, file_path):
+        return self.submit(file_path).result()
+
+    def process_files(self, file_paths):
+        futures = [self.submit(file_path) for file_path in file_paths]
+        return [future.result() for future in futures]
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            if self.processor._stopping.is_set():
+                self._stop_files()
+            try:
+                message = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                self._check_parsers()
+                continue
+
+            kind, file_path = message[0], message[1]
+            with self._lock:
+                state = self._files.get(file_path)
+            if state is None:
+                continue
+
+            if kind == 'batches':
+                if state.stopping:
+                    with self._lock:
+                        state.totals['stopped'] = 1
+                    continue
+                if state.totals['lease_lost']:
+                    # The rest of the file belongs to the node that reclaimed it
+                    continue
+                for batch in message[2]:
+                    if self._stopping.is_set():
+                        break
+                    slices = self.processor._pending_slices(state.next_row, batch, state.committed)
+                    state.next_row += len(batch)
+                    with self._lock:
+                        state.totals['rows_resumed'] += len(batch) - sum(len(rows) for _, rows in slices)
+                        if not slices:
+                            state.total_batches += 1
+
+                    for start_row, rows in slices:
+                        # Blocks while the writers are saturated, the parsers then block on the full queue
+                        self._in_flight.acquire()
+                        with self._lock:
+                            state.pending += 1
+                            state.total_batches += 1
+                        future = self._writers.submit(self.processor._process_checkpointed, state.content_hash,
+                                                      start_row, rows, state.file_path)
+                        future.add_done_callback(partial(self._batch_done, state))
+            elif kind == 'done':
+                state.total_rows, state.missing_columns = message[2], message[3]
+                for stage, seconds in message[4].items():
+                    stage_metrics.record(stage, seconds, state.total_rows)
+                with self._lock:
+                    state.totals['rows_coalesced'] += message[5]
+                    state.totals['rows_quarantined'] += message[6]
+                stage_metrics.increment('rows_coalesced', message[5])
+                stage_metrics.increment('rows_quarantined', message[6])
+                self._mark_parsed(state)
+            elif kind == 'stopped':
+                with self._lock:
+                    state.totals['stopped'] = 1
+                self._mark_parsed(state)
+            else:
+                state.error = message[2]
+                self._mark_parsed(state)
+
+    def _stop_files(self):
+        # Files not yet parsed are cancelled, parsers stop at their next chunk and batches still arriving are
+        # dropped. Batches already with the writers finish and stay checkpointed, so the files resume later.
+        self._stop_parsing.set()
+        cancelled = []
+        with self._lock:
+            for state in self._files.values():
+                if state.stopping:
+                    continue
+                state.stopping = True
+                if state.parse_future.cancel():
+                    state.totals['stopped'] = 1
+                    cancelled.append(state)
+        for state in cancelled:
+            self._mark_parsed(state)
+
+    def _check_parsers(self):
+        with self._lock:
+            crashed = [state for state in self._files.values()
+                       if not state.parsed and state.parse_future.done() and
+                       (state.parse_future.cancelled() or state.parse_future.exception())]
+            if crashed and self._parsers is not None:
+                # A dead parser process breaks the whole pool, the next submit starts a fresh one
+                self._parsers.shutdown(wait=False, cancel_futures=True)
+                self._parsers = None
+
+        for state in crashed:
+            reason = 'cancelled' if state.parse_future.cancelled() else state.parse_future.exception()
+            state.error = f"Parser process failed: {reason}"
+            self._mark_parsed(state)
+
+    def _batch_done(self, state, future):
+        try:
+            result = future.result()
+            with self._lock:
+                for key, value in result.items():
+                    if isinstance(value, int):
+                        state.totals[key] += value
+        except LeaseLost:
+            with self._lock:
+                state.totals['lease_lost'] = 1
+        except Exception as e:
+            with self._lock:
+                state.error_batches += 1
+            logging.error(f"Error processing batch of {state.file_path}: {e}")
+
+        try:
+            with self._lock:
+                state.pending -= 1
+                finished = state.parsed and state.pending == 0
+            if finished:
+                self._finish(state)
+        finally:
+            # Released last, so close() knows every callback has finished once it holds all slots
+            self._in_flight.release()
+
+    def _mark_parsed(self, state):
+        with self._lock:
+            state.parsed = True
+            finished = state.pending == 0
+        if finished:
+            self._finish(state)
+
+    def _finish(self, state):
+        with self._lock:
+            self._files.pop(state.file_path, None)
+
+        try:
+            if state.error is not None:
+                logging.error(f"Error processing file {state.file_path}: {state.error}")
+                self.processor._release_file(state.file_path, False, state.total_rows)
+                result = False
+            elif state.totals['lease_lost']:
+                result = self.processor._lose_file(state.file_path, state.total_rows)
+            elif state.totals['stopped']:
+                logging.info(f"Stopped processing {state.file_path}, the file stays in the watch folder and "
+                             f"resumes from its committed batches.")
+                self.processor._release_file(state.file_path, False)
+                result = False
+            else:
+                if state.missing_columns:
+                    logging.warning(f"Missing columns in input file: {state.missing_columns}")
+                logging.info(f"File parsed successfully: {state.file_path}, {state.total_rows} rows found.")
+                state.totals['rows'] = state.total_rows
+                result = self.processor._finish_file(state.file_path, state.totals, state.total_batches,
+                                                     state.error_batches)
+        except Exception as e:
+            logging.error(f"Error finishing file {state.file_path}: {e}")
+            result = False
+        state.done.set_result(result)
+
+    def close(self):
+        self._stopping.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        if self._parsers is not None:
+            self._parsers.shutdown(wait=False, cancel_futures=True)
+            # Parsers still running are blocked on the full queue, drain it so they can finish and exit
+            with self._lock:
+                parse_futures = [state.parse_future for state in self._files.values()]
+            while not all(future.done() for future in parse_futures):
+                try:
+                    self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+            self._parsers.shutdown()
+        if self._writers is not None:
+            # The writer pool belongs to the processor, wait for this pipeline's batches by taking every slot
+            for _ in range(self._slots):
+                self._in_flight.acquire()
+            for _ in range(self._slots):
+                self._in_flight.release()
+        if self._queue is not None:
+            self._queue.close()
+        with self._lock:
+            for state in self._files.values():
+                if not state.done.done():
+                    state.done.set_result(False)
+            self._files.clear()
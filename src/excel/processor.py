@@ -1,21 +1,113 @@
-import pandas as pd
+import asyncio
 import os
 import uuid
 import logging
+import time
 import concurrent.futures
+import threading
 from datetime import datetime, timezone
 from sqlalchemy.exc import SQLAlchemyError
-from ..database.database import get_session, execute_with_retry
-from ..database.models import OutscraperLocation, OutscraperLocationMetric
-from ..configurations.config import EXCEL_CONFIG, TARGET_COLUMNS
+from sqlalchemy.util import await_only
+from ..database.database import (get_session, get_async_session_factory, configure_pool, log_pool_stats,
+                                 is_deadlock, deadlock_backoff, backoff_sleep)
+from ..database.models import get_models
+from ..database.bulk_upsert import merge_batch
+from ..database.bulk_insert import core_write_batch
+from ..database.location_index import LocationIndex, InFlightPlaces, attach_location
+from ..database.type_cache import get_type_cache
+from ..database.ingestion_ledger import IngestionLedger, hash_file, uncommitted_ranges
+from ..database.metric_fingerprints import get_metric_fingerprints, plan_metric_writes, record_fingerprint
+from .readers import SUPPORTED_EXTENSIONS, read_input_file, open_chunk_reader
+from .pipeline import ParsePipeline
+from .batch_tuner import BatchTuner
+from .async_runner import AsyncBatchRunner
+from .backlog import order_backlog, BacklogProgress
+from .validation import validate_frame, text_limits, QuarantineFile
+from .batch_builder import build_batch_records, coalesce_places, location_params, metric_params, LOCATION_TEXT_FIELDS
+from ..configurations.config import EXCEL_CONFIG, BACKLOG_CONFIG, DEADLOCK_CONFIG, TARGET_COLUMNS
 from ..utils.helpers import ensure_directory_exists, clean_data_frame
+from ..monitoring.stage_metrics import stage_metrics
+from ..monitoring.file_leases import SKIPPED, LeaseLost
 from collections import defaultdict
+from contextlib import nullcontext
+
+# Without a batch count to report a percentage of, progress is logged at this interval
+PROGRESS_LOG_SECONDS = 10
+# PlaceId is only set when a location is created, the other text fields are refreshed when non-empty
+LOCATION_TEXT_UPDATE_COLUMNS = [name for name, _ in LOCATION_TEXT_FIELDS if name != 'PlaceId']
+# How often an async batch checks whether the places it waits for were released
+PLACE_CLAIM_POLL_SECONDS = 0.01
+
+
 
 class ExcelProcessor:
-    def __init__(self, batch_size=50, max_workers=4):
+    WRITE_MODES = ('orm', 'merge', 'core')
+
+    def __init__(self, batch_size=50, max_workers=4, write_mode='orm', session_factory=None, location_index=None,
+                 type_cache=None, streaming=False, chunk_size=5000, parse_workers=0, parse_queue_size=None,
+                 ledger=None, delta=False, fingerprints=None, autotune=False, coalesce_duplicates=None,
+                 writer_budget=None, async_mode=False, validate_rows=None, models=None, archive_files=True,
+                 leases=None, checkpoints=None):
+        if write_mode not in self.WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {write_mode}. Expected one of {self.WRITE_MODES}")
+
         self.batch_size = batch_size
         self.max_workers = max_workers
+        self.write_mode = write_mode
+        self.location_index = location_index
+        # Places written by a batch right now, shared by every file in flight
+        self.in_flight_places = InFlightPlaces()
+        self.type_cache = type_cache if type_cache is not None else get_type_cache()
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        # Rows repeating a google_id are folded into one record per place before batching
+        self.coalesce_duplicates = (EXCEL_CONFIG['coalesce_duplicates'] if coalesce_duplicates is None
+                                    else coalesce_duplicates)
+        # Rows the database would reject are written to a quarantine file instead of failing their batch
+        self.validate_rows = EXCEL_CONFIG['validate_rows'] if validate_rows is None else validate_rows
+        self.ledger = ledger
+        # Delta mode only writes a metric row when its values differ from the location's latest metric
+        self.delta = delta
+        self.fingerprints = (fingerprints if fingerprints is not None else get_metric_fingerprints()) if delta else None
+        self._content_hashes = {}
+        self._file_started = {}
+        # Auto-tuning starts from batch_size and max_workers and can add writers up to the writer budget
+        self.tuner = None
+        if autotune and parse_workers <= 0:
+            self.tuner = BatchTuner(batch_size, max_workers, max_workers=writer_budget)
+        # Writer threads shared by every file in flight, max_workers bounds a single file unless it is tuned
+        self.writer_budget = max(writer_budget or max_workers, max_workers,
+                                 self.tuner.max_workers if self.tuner is not None else 0)
+        self._writers = None
+        self._writers_lock = threading.Lock()
+        # Async mode runs the batches as coroutines on one event loop over an async driver, writer_budget caps
+        # the batches in flight instead of sizing a thread pool
+        self.async_mode = async_mode
+        if session_factory is None:
+            configure_pool(self.writer_budget)
+        self.session_factory = session_factory or (get_async_session_factory() if async_mode else get_session)
+        self._stopping = threading.Event()
+        # Tables of the target database, the models of DB_CONFIG unless the processor writes to another target
+        self.models = models or get_models()
+        # Rows are validated against the column lengths of the target's tables
+        self.text_limits = text_limits(self.models.OutscraperLocation, self.models.OutscraperLocationTypes)
+        # Fan-out targets leave archiving to the fan-out, which moves a file once every target is done
+        self.archive_files = archive_files
+        # With several nodes on one watch folder, a file is moved into this node's lease folder before processing
+        self.leases = leases
+        if leases is not None and location_index is not None:
+            # Other nodes insert places this node's index never sees
+            location_index.trust_absent = False
+        # Other nodes insert the same places, their lookups lock the GoogleIds they read until commit
+        self.locking_lookups = leases is not None
+        # Committed batch ranges: in the ledger of this node, or in the lease folder when a file can move to
+        # another node
+        self.checkpoints = checkpoints or (leases.checkpoints() if leases is not None else ledger)
+        # With parse workers, files are read and cleaned in separate processes and written by max_workers threads
+        self.parse_pipeline = ParsePipeline(self, parse_workers, parse_queue_size) if parse_workers > 0 else None
         self.setup_logging()
+        if autotune and self.parse_pipeline is not None:
+            logging.warning("Auto-tuning is not supported with parse workers, batches keep the configured size.")
 
     def setup_logging(self):
         from src.configurations.config import LOG_CONFIG
@@ -37,295 +129,634 @@ class ExcelProcessor:
         )
 
 
+    def warm_up(self):
+        if self.location_index is None and self.fingerprints is None:
+            return
+        if self.async_mode:
+            # Async sessions only run inside the batch loop
+            self._writer_pool().run(self._warm_up)
+        else:
+            self._warm_up()
+
+    def _warm_up(self):
+        session = self.session_factory()
+        try:
+            if self.location_index is not None:
+                self.location_index.warm_up(session)
+            if self.fingerprints is not None:
+                self.fingerprints.warm_up(session)
+        except Exception as e:
+            logging.error(f"Error warming up location caches: {e}")
+        finally:
+            session.close()
+
+    def _writer_pool(self):
+        with self._writers_lock:
+            if self._writers is None and self.async_mode:
+                self._writers = AsyncBatchRunner(self.writer_budget)
+            elif self._writers is None:
+                self._writers = concurrent.futures.ThreadPoolExecutor(max_workers=self.writer_budget,
+                                                                      thread_name_prefix='batch-writer')
+            return self._writers
+
+    def request_stop(self):
+        # Files in progress stop at the next batch and stay in the watch folder, committed batches are
+        # checkpointed and skipped when the file is picked up again
+        self._stopping.set()
+
+    def close(self):
+        if self.parse_pipeline is not None:
+            self.parse_pipeline.close()
+        with self._writers_lock:
+            if self._writers is not None and self.async_mode:
+                # Pooled connections belong to the batch loop and are closed on it
+                self._writers.shutdown(finalizer=self.session_factory.kw['bind'].dispose)
+                self._writers = None
+            elif self._writers is not None:
+                self._writers.shutdown()
+                self._writers = None
+
     def process_file(self, file_path):
+        logging.info(f"Processing file: {file_path}")
+        file_path = self._lease_file(file_path)
+        if file_path is None:
+            return SKIPPED
+        if not self._claim_file(file_path):
+            return True
+
+        if self.parse_pipeline is not None:
+            return self.parse_pipeline.process_file(file_path)
+
         try:
-            logging.info(f"Processing file: {file_path}")
-            df = pd.read_excel(file_path)
-
-            missing_columns = [col for col in TARGET_COLUMNS if col not in df.columns]
-            if missing_columns:
-                logging.warning(f"Missing columns in Excel: {missing_columns}")
-
-            df = df[[col for col in TARGET_COLUMNS if col in df.columns]]
-            df = clean_data_frame(df)
-
-            total_rows = len(df)
-            logging.info(f"File cleaned successfully: {file_path}, {total_rows} rows found.")
-
-            total_batches = (total_rows + self.batch_size - 1) // self.batch_size
-            locations_added = 0
-            locations_updated = 0
-            types_added = 0
-            types_updated = 0
-            metrics_added = 0
-            error_batches = 0
-
-            logging.info(f"Starting batch processing with {self.max_workers} worker threads: 0/{total_batches} (0%)")
-            batches = []
-            for batch_num in range(total_batches):
-                start_idx = batch_num * self.batch_size
-                end_idx = min(start_idx + self.batch_size, total_rows)
-                batches.append(df.iloc[start_idx:end_idx])
-
-            batch_results = []
-            completed = 0
-            last_logged_percentage = 0
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                future_to_batch = {executor.submit(self._process_batch, batch) : i for i, batch in enumerate(batches)}
-
-                for future in concurrent.futures.as_completed(future_to_batch):
-                    batch_num = future_to_batch[future]
-                    completed += 1
+            totals = defaultdict(int)
+            batches, total_batches = self._parse_file(file_path, totals)
+        except Exception as e:
+            logging.error(f"Error processing file {file_path}: {e}")
+            self._release_file(file_path, False)
+            return False
+        return self._write_file(file_path, batches, total_batches, totals)
 
-                    try:
-                        result = future.result()
-                        batch_results.append(result)
-
-                        locations_added += result.get('locations_added', 0)
-                        locations_updated += result.get('locations_updated', 0)
-                        metrics_added += result.get('metrics_added', 0)
-                        types_added += result.get('types_added', 0)
-                        types_updated += result.get('types_updated', 0)
-
-                        current_percentage = int(completed / total_batches * 100)
-                        if current_percentage - last_logged_percentage >= 10 or completed == total_batches:
-                            logging.info(f"Progress: {completed}/{total_batches} batches ({current_percentage}%)")
-                            last_logged_percentage = current_percentage
-                    except Exception as e:
-                        error_batches += 1
-                        logging.error(f"Error processing batch {batch_num + 1}/{total_batches}: {e}")
-            
-            if error_batches > 0:
-                logging.warning(f"{error_batches} out of {total_batches} batches failed.")
-
-            if error_batches < total_batches:
-                logging.info(f"File processed with success: {file_path}")
-                logging.info(f"Total records: {locations_added} locations added, " +
-                             f"{locations_updated} locations updated, {metrics_added} metrics added, " +
-                             f"{types_added} types added, {types_updated} types updated.")
-
-                self.move_processed_file(file_path)
-                return True
+    def _parse_file(self, file_path, totals):
+        reader = open_chunk_reader(file_path, self.chunk_size, TARGET_COLUMNS) if self.streaming else None
+        if reader is not None:
+            return self._stream_batches(reader, file_path, totals)
+        return self._load_batches(file_path, totals)
+
+    def _write_file(self, file_path, batches, total_batches, totals):
+        try:
+            workers = f"{self.max_workers} {'batch coroutines' if self.async_mode else 'worker threads'}"
+            if total_batches:
+                logging.info(f"Starting batch processing with {workers}: 0/{total_batches} (0%)")
             else:
-                logging.error(f"File processing completely failed: {file_path}")
+                logging.info(f"Starting batch processing with {workers}, batch count unknown")
+            totals, total_batches, error_batches = self._run_batches(batches, total_batches, file_path, totals)
+            if totals['stopped']:
+                logging.info(f"Stopped processing {file_path} after {totals['rows']} rows, the file stays in the "
+                             f"watch folder and resumes from its committed batches.")
+                self._release_file(file_path, False, totals['rows'])
                 return False
+            if totals['lease_lost']:
+                return self._lose_file(file_path, totals['rows'])
+            return self._finish_file(file_path, totals, total_batches, error_batches)
 
         except Exception as e:
             logging.error(f"Error processing file {file_path}: {e}")
+            self._release_file(file_path, False)
             return False
 
-    def _process_batch(self, batch_df):
-        session = get_session()
+    def _lease_file(self, file_path):
+        # None when another node owns the file
+        if self.leases is None:
+            return file_path
+        return self.leases.claim(file_path)
+
+    def _fence(self, file_path):
+        # Called right before a batch commits, raises LeaseLost once another node reclaimed the file
+        if self.leases is None or file_path is None:
+            return None
+        return lambda: self.leases.fence(file_path)
+
+    def _lose_file(self, file_path, row_count):
+        # The node that reclaimed the file resumes it from the shared checkpoints, this node leaves it alone
+        logging.warning(f"Lost the lease of {file_path} to another node after {row_count} rows, it resumes from "
+                        f"the committed batches.")
+        stage_metrics.increment('leases_lost')
+        self._release_file(file_path, False, row_count, count=False)
+        return SKIPPED
+
+    def _claim_file(self, file_path, content_hash=None):
+        self._file_started[file_path] = time.perf_counter()
+        if self.ledger is None and self.checkpoints is None:
+            return True
+
+        try:
+            content_hash = content_hash or hash_file(file_path)
+        except OSError as e:
+            logging.warning(f"Could not hash {file_path} for the ingestion ledger: {e}")
+            return True
+
+        if self.ledger is not None and not self.ledger.claim(content_hash):
+            logging.info(f"Skipping file with already ingested content: {file_path}")
+            archived_path = self.move_processed_file(file_path) if self.archive_files else None
+            self.ledger.record(file_path, content_hash, IngestionLedger.SKIPPED, archived_path=archived_path)
+            self._file_started.pop(file_path, None)
+            return False
+
+        self._content_hashes[file_path] = content_hash
+        return True
+
+    def _release_file(self, file_path, succeeded, row_count=None, archived_path=None, count=True):
+        self._file_started.pop(file_path, None)
+        if count:
+            stage_metrics.increment('files_succeeded' if succeeded else 'files_failed')
+        content_hash = self._content_hashes.pop(file_path, None)
+        if succeeded and content_hash is not None and self.checkpoints is not None \
+                and self.checkpoints is not self.ledger:
+            self.checkpoints.clear(content_hash)
+        if self.ledger is None or content_hash is None:
+            return
+
+        status = IngestionLedger.SUCCEEDED if succeeded else IngestionLedger.FAILED
+        try:
+            self.ledger.record(file_path, content_hash, status, row_count=row_count, archived_path=archived_path)
+        except Exception as e:
+            logging.error(f"Error recording {file_path} in the ingestion ledger: {e}")
+
+    def _resume_state(self, file_path):
+        content_hash = self._content_hashes.get(file_path)
+        if self.checkpoints is None or content_hash is None:
+            return None, []
+
+        committed = self.checkpoints.committed_ranges(content_hash)
+        if committed:
+            logging.info(f"Resuming {file_path}: {sum(end - start for start, end in committed)} rows were "
+                         f"committed by an earlier run and will be skipped.")
+        return content_hash, committed
+
+    def _pending_slices(self, start_row, batch, committed):
+        if not committed:
+            return [(start_row, batch)]
+        return [(start, batch[start - start_row:end - start_row])
+                for start, end in uncommitted_ranges(start_row, start_row + len(batch), committed)]
+
+    def _process_checkpointed(self, content_hash, start_row, batch, file_path=None):
+        results = self._process_batch(batch, self._fence(file_path))
+        if content_hash is not None:
+            try:
+                self.checkpoints.checkpoint(content_hash, start_row, start_row + len(batch))
+            except Exception as e:
+                logging.error(f"Error checkpointing rows {start_row}-{start_row + len(batch)}: {e}")
+        return results
+
+    def _finish_file(self, file_path, totals, total_batches, error_batches):
+        if error_batches > 0:
+            logging.warning(f"{error_batches} out of {total_batches} batches failed.")
+
+        if error_batches < total_batches:
+            logging.info(f"File processed with success: {file_path}")
+            logging.info(f"Total records: {totals['locations_added']} locations added, " +
+                         f"{totals['locations_updated']} locations updated, {totals['metrics_added']} metrics added, " +
+                         f"{totals['types_added']} types added, {totals['types_updated']} types updated.")
+            if self.tuner is not None:
+                logging.info(f"Auto-tuned settings after this file: {self.tuner.settings()}")
+            if totals['rows_coalesced']:
+                logging.info(f"Duplicate places: {totals['rows_coalesced']} rows were folded into the last row "
+                             f"of their google_id.")
+            if totals['rows_quarantined']:
+                logging.warning(f"Validation: {totals['rows_quarantined']} rows were rejected and written to the "
+                                f"quarantine folder with their reasons.")
+            if totals['rows_resumed']:
+                logging.info(f"Resumed file: {totals['rows_resumed']} rows committed by an earlier run were skipped.")
+            if self.fingerprints is not None:
+                logging.info(f"Delta mode: {totals['metrics_skipped']} unchanged metrics skipped, " +
+                             f"fingerprint stats: {self.fingerprints.stats()}")
+            if self.location_index is not None:
+                logging.info(f"Location index stats: {self.location_index.stats()}")
+            log_pool_stats()
+
+            started = self._file_started.get(file_path)
+            if started is not None:
+                elapsed = time.perf_counter() - started
+                stage_metrics.record('file', elapsed, totals['rows'])
+                stage_metrics.set_gauge('last_file_rows_per_second', totals['rows'] / elapsed if elapsed else 0.0)
+
+            if self.leases is not None and not self.leases.owns(file_path):
+                return self._lose_file(file_path, totals['rows'])
+            archived_path = None
+            if self.archive_files:
+                with stage_metrics.time('archive'):
+                    archived_path = self.move_processed_file(file_path)
+            self._release_file(file_path, True, totals['rows'], archived_path)
+            return True
+        else:
+            logging.error(f"File processing completely failed: {file_path}")
+            self._release_file(file_path, False, totals['rows'])
+            return False
+
+    def _sync_types(self, batch, results):
+        unique_types = {record.Type.strip() for record in batch}
+        unique_types = {type_name for type_name in unique_types if type_name.lower() not in ('nan', 'none', '')}
+
+        if unique_types:
+            # The type cache holds thread locks while it queries, async batches take turns
+            exclusive = self._writers.exclusive() if self.async_mode else nullcontext()
+            with exclusive, stage_metrics.time('types', len(batch)):
+                types_added, types_existing = self.type_cache.ensure_types(unique_types, self.session_factory)
+            results['types_added'] += types_added
+            results['types_updated'] += types_existing
+
+    def _coalesce(self, df, totals):
+        if not self.coalesce_duplicates:
+            return df
+        df, folded = coalesce_places(df)
+        totals['rows_coalesced'] += folded
+        stage_metrics.increment('rows_coalesced', folded)
+        return df
+
+    def _quarantine_folder(self, file_path):
+        if not self.validate_rows:
+            return None
+        if EXCEL_CONFIG['quarantine_folder']:
+            return EXCEL_CONFIG['quarantine_folder']
+        if EXCEL_CONFIG['archive_folder']:
+            return os.path.join(EXCEL_CONFIG['archive_folder'], 'quarantine')
+        # Without an archive folder the rejects are kept next to the input file
+        return os.path.join(os.path.dirname(os.path.abspath(file_path)), 'quarantine')
+
+    def _quarantine_file(self, file_path):
+        folder = self._quarantine_folder(file_path)
+        return QuarantineFile(file_path, folder) if folder else None
+
+    def _validate(self, df, totals, quarantine):
+        if quarantine is None:
+            return df
+        df, rejected = validate_frame(df, self.text_limits)
+        if not rejected.empty:
+            quarantine.write(rejected)
+            totals['rows_quarantined'] += len(rejected)
+            stage_metrics.increment('rows_quarantined', len(rejected))
+        return df
+
+    def _load_batches(self, file_path, totals):
+        start_time = time.perf_counter()
+        df = read_input_file(file_path, TARGET_COLUMNS)
+        stage_metrics.record('read', time.perf_counter() - start_time, len(df))
+
+        missing_columns = [col for col in TARGET_COLUMNS if col not in df.columns]
+        if missing_columns:
+            logging.warning(f"Missing columns in input file: {missing_columns}")
+
+        start_time = time.perf_counter()
+        df = df[[col for col in TARGET_COLUMNS if col in df.columns]]
+        df = clean_data_frame(df, compact=True)
+        cleaned_rows = len(df)
+        logging.info(f"File cleaned successfully: {file_path}, {cleaned_rows} rows found.")
+        df = self._coalesce(df, totals)
+        df = self._validate(df, totals, self._quarantine_file(file_path))
+        total_rows = len(df)
+
+        records = build_batch_records(df)
+        stage_metrics.record('clean', time.perf_counter() - start_time, cleaned_rows)
+        total_batches = (total_rows + self.batch_size - 1) // self.batch_size
+        batches = []
+        for batch_num in range(total_batches):
+            start_idx = batch_num * self.batch_size
+            end_idx = min(start_idx + self.batch_size, total_rows)
+            batches.append(records[start_idx:end_idx])
+
+        return batches, total_batches
+
+    def _stream_batches(self, reader, file_path, totals):
+        if reader.missing_columns:
+            logging.warning(f"Missing columns in input file: {reader.missing_columns}")
+
+        estimated_rows = reader.estimated_rows or 0
+        estimated_batches = (estimated_rows + self.batch_size - 1) // self.batch_size
+        if estimated_rows:
+            logging.info(f"Streaming file in chunks of {self.chunk_size} rows: {file_path}, ~{estimated_rows} rows.")
+        else:
+            logging.info(f"Streaming file in chunks of {self.chunk_size} rows: {file_path}, row count unknown.")
+
+        return self._iter_stream_batches(reader, file_path, totals), estimated_batches
+
+    def _iter_stream_batches(self, reader, file_path, totals):
+        total_rows = 0
+        quarantine = self._quarantine_file(file_path)
+        with reader:
+            chunks = iter(reader)
+            while True:
+                start_time = time.perf_counter()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                stage_metrics.record('read', time.perf_counter() - start_time, len(chunk))
+
+                start_time = time.perf_counter()
+                # Duplicates are folded within each chunk, repeats across chunks stay separate records
+                records = build_batch_records(self._validate(self._coalesce(clean_data_frame(chunk, compact=True), totals),
+                                                             totals, quarantine))
+                stage_metrics.record('clean', time.perf_counter() - start_time, len(chunk))
+                total_rows += len(records)
+                for start_idx in range(0, len(records), self.batch_size):
+                    yield records[start_idx:start_idx + self.batch_size]
+
+        logging.info(f"File streamed successfully: {file_path}, {total_rows} rows found.")
+
+    def _run_batches(self, batches, total_batches, file_path=None, totals=None):
+        content_hash, committed = self._resume_state(file_path)
+        totals = totals if totals is not None else defaultdict(int)
+        error_batches = 0
+        completed = 0
+        completed_rows = 0
+        total_rows = 0
+        last_logged_percentage = 0
+        started = last_logged_time = time.monotonic()
+        max_in_flight = self.max_workers * 2
+        if self.tuner is not None:
+            batches = self._tuned_batches(batches)
+
+        def log_progress():
+            nonlocal last_logged_percentage, last_logged_time
+            if self.tuner is not None:
+                # Tuned batches change size, so progress is counted in rows
+                expected, done, unit = total_batches * self.batch_size, completed_rows, 'rows'
+            else:
+                expected, done, unit = total_batches, completed, 'batches'
+            if done <= expected:
+                current_percentage = int(done / expected * 100)
+                if current_percentage - last_logged_percentage >= 10 or done == expected:
+                    logging.info(f"Progress: {done}/{expected} {unit} ({current_percentage}%)")
+                    last_logged_percentage = current_percentage
+                return
+
+            # Streamed files without a row estimate, or larger than estimated, have no total to compare with
+            now = time.monotonic()
+            if now - last_logged_time >= PROGRESS_LOG_SECONDS:
+                logging.info(f"Progress: {completed} batches, {completed_rows} rows in {now - started:.0f}s")
+                last_logged_time = now
+
+        def collect(future, batch_num, rows):
+            nonlocal completed, completed_rows, error_batches
+            completed += 1
+
+            try:
+                result = future.result()
+                for key, value in result.items():
+                    if isinstance(value, int):
+                        totals[key] += value
+                completed_rows += rows
+                log_progress()
+            except LeaseLost:
+                # The rest of the file belongs to the node that reclaimed it
+                totals['lease_lost'] = 1
+            except Exception as e:
+                error_batches += 1
+                logging.error(f"Error processing batch {batch_num + 1}/{max(total_batches, completed)}: {e}")
+
+        # Writers come from the processor-wide pool, files processed at the same time share its budget
+        executor = self._writer_pool()
+        pending = {}
+        try:
+            for batch_num, batch in enumerate(batches):
+                if self._stopping.is_set():
+                    totals['stopped'] = 1
+                    break
+                if totals['lease_lost']:
+                    break
+                start_row = total_rows
+                total_rows += len(batch)
+                slices = self._pending_slices(start_row, batch, committed)
+                totals['rows_resumed'] += len(batch) - sum(len(rows) for _, rows in slices)
+                if not slices:
+                    completed += 1
+                    completed_rows += len(batch)
+                    continue
+
+                for slice_start, rows in slices:
+                    # Bounded hand-off: the producer waits for a free slot instead of queueing every batch.
+                    # Tuned runs keep exactly the tuned number of batches in the writer pool.
+                    if self.tuner is not None:
+                        max_in_flight = self.tuner.workers
+                    while len(pending) >= max_in_flight:
+                        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            collect(future, *pending.pop(future))
+                    future = executor.submit(self._process_checkpointed, content_hash, slice_start, rows, file_path)
+                    pending[future] = (batch_num, len(rows))
+        finally:
+            # A failing producer still waits for the batches it already handed to the writers
+            for future in concurrent.futures.as_completed(pending):
+                collect(future, *pending[future])
+
+        if last_logged_percentage < 100:
+            # No total was reached: an estimate was missing or off, or the last batches failed
+            logging.info(f"Progress: {completed} batches, {completed_rows} rows in {time.monotonic() - started:.0f}s")
+        totals['rows'] = total_rows
+        return totals, completed, error_batches
+
+    def _tuned_batches(self, batches):
+        # Re-cut the incoming batches at the tuner's current size, which can change between two batches
+        buffer = []
+        for batch in batches:
+            buffer.extend(batch)
+            while len(buffer) >= self.tuner.batch_size:
+                batch_size = self.tuner.batch_size
+                yield buffer[:batch_size]
+                del buffer[:batch_size]
+        if buffer:
+            yield buffer
+
+    def _find_location(self, session, google_id):
+        if self.location_index is not None:
+            cached = self.location_index.lookup(google_id)
+            if cached is LocationIndex.ABSENT:
+                return None
+            if cached is not None:
+                return attach_location(session, cached[0], self.models.OutscraperLocation)
+
+        with session.no_autoflush:
+            location = self.models.OutscraperLocation.find_by_google_id(session, google_id, self.locking_lookups)
+
+        if location is not None and self.location_index is not None:
+            self.location_index.put(google_id, location.Id, location.MetricId)
+        return location
+
+    def _index_locations(self, entries):
+        if self.location_index is not None and entries:
+            self.location_index.put_many(entries)
+            entries.clear()
+
+    def _remember_fingerprints(self, fingerprints):
+        if self.fingerprints is not None and fingerprints:
+            self.fingerprints.put_many(fingerprints.items())
+            fingerprints.clear()
+
+    def _claim_places(self, batch):
+        google_ids = {record.GoogleId for record in batch if record.HasGoogleId}
+        if self.async_mode:
+            # Async batches share the loop thread, a batch waiting for its places suspends instead of blocking it
+            waited = False
+            while not self.in_flight_places.try_claim(google_ids):
+                waited = True
+                await_only(asyncio.sleep(PLACE_CLAIM_POLL_SECONDS))
+        else:
+            waited = self.in_flight_places.claim(google_ids)
+        if waited:
+            stage_metrics.increment('place_waits')
+        return google_ids
+
+    def _process_batch(self, batch, fence=None):
+        google_ids = self._claim_places(batch)
+        stage_metrics.add_gauge('batches_in_flight', 1)
+        start_time = time.perf_counter()
+        try:
+            results = self._write_with_replay(batch, fence)
+        except Exception:
+            stage_metrics.increment('batches_failed')
+            if self.tuner is not None:
+                self.tuner.record(len(batch), time.perf_counter() - start_time, failed=True)
+            raise
+        finally:
+            stage_metrics.add_gauge('batches_in_flight', -1)
+            # Released once the batch's locations are committed and indexed
+            self.in_flight_places.release(google_ids)
+
+        if self.tuner is not None:
+            self.tuner.record(len(batch), time.perf_counter() - start_time)
+
+        stage_metrics.increment('batches_written')
+        stage_metrics.increment('rows_written', len(batch))
+        return results
+
+    def _write_with_replay(self, batch, fence=None):
+        # Every mode writes a batch in one transaction and the deadlock victim's transaction is already rolled
+        # back by the server, so the whole batch is written again after a jittered backoff
+        max_replays = DEADLOCK_CONFIG['max_replays']
+        for attempt in range(max_replays + 1):
+            try:
+                return self._write_batch(batch, fence)
+            except Exception as e:
+                if not is_deadlock(e) or attempt == max_replays:
+                    raise
+                delay = deadlock_backoff(attempt)
+                stage_metrics.increment('batch_replays')
+                logging.warning(f"Deadlock writing a batch, replaying it {attempt + 1}/{max_replays} in "
+                                f"{delay:.2f}s: {e}")
+                backoff_sleep(delay)
+
+    def _write_batch(self, batch, fence=None):
+        if self.write_mode == 'merge':
+            return self._bulk_write_batch(batch, lambda session, entries, writes: merge_batch(
+                session, batch, entries, writes, self.models, self.locking_lookups), fence)
+        if self.write_mode == 'core':
+            return self._bulk_write_batch(batch, lambda session, entries, writes: core_write_batch(
+                session, batch, self.location_index, entries, writes, self.models, self.locking_lookups), fence)
+
+        session = self.session_factory()
         results = {
             'locations_added': 0,
             'locations_updated': 0,
             'metrics_added': 0,
+            'metrics_skipped': 0,
             'types_added': 0,
             'types_updated': 0
         }
 
+        pending_index_entries = []
+        pending_fingerprints = {}
+        lookup_seconds = 0.0
+        lookups = 0
+
         try:
-            unique_types = set()
-            for _, row in batch_df.iterrows():
-                type_value = str(row.get('type', '')).strip()
-                if type_value and type_value.lower() not in ('nan', 'none', ''):
-                    unique_types.add(type_value)
-
-            existing_types = {}
-            if unique_types:
-                from ..database.models import OutscraperLocationTypes
-                db_types = session.query(OutscraperLocationTypes).filter(
-                    OutscraperLocationTypes.Name.in_(unique_types)
-                ).all()
-
-                for type_obj in db_types:
-                    existing_types[type_obj.Name] = type_obj
-
-                for type_name in unique_types:
-                    if type_name not in existing_types:
-                        new_type = OutscraperLocationTypes(
-                            Id=uuid.uuid4(),
-                            Name=type_name
-                            )
-                        session.add(new_type)
-                        existing_types[type_name] = new_type
-                        results['types_added'] += 1
-                    else:
-                        results['types_updated'] += 1
-
-            for _, row in batch_df.iterrows():
-                try:
-                    google_id = row.get('google_id')
-                    existing_location = None
-
-                    if google_id and str(google_id).strip() not in ('', 'nan', 'None'):
-                        with session.no_autoflush:
-                            existing_location = OutscraperLocation.find_by_google_id(session, google_id)
-
-                    try:
-                        rating = float(row.get('rating', 0.0))
-                    except:
-                        rating = 0.0
-
-                    try:
-                        reviews = int(row.get('reviews', 0))
-                    except:
-                        reviews = 0
-
-                    try:
-                        reviews_per_score1 = int(row.get('reviews_per_score_1', 0))
-                        reviews_per_score2 = int(row.get('reviews_per_score_2', 0))
-                        reviews_per_score3 = int(row.get('reviews_per_score_3', 0))
-                        reviews_per_score4 = int(row.get('reviews_per_score_4', 0))
-                        reviews_per_score5 = int(row.get('reviews_per_score_5', 0))
-                    except:
-                        reviews_per_score1 = reviews_per_score2 = reviews_per_score3 = reviews_per_score4 = reviews_per_score5 = 0
-
-                    try:
-                        photos_count = int(row.get('photos_count', 0))
-                    except:
-                        photos_count = 0
-
-                    try:
-                        latitude = float(row.get('latitude', 0.0))
-                        longitude = float(row.get('longitude', 0.0))
-                    except:
-                        latitude = longitude = 0.0
-
-                    postal_code = str(row.get('postal_code', ''))
-                    if postal_code.lower() in ['nan', 'none']:
-                        postal_code = ''
-
-                    name = str(row.get('name', ''))
-                    type_value = str(row.get('type', ''))
-                    phone = str(row.get('phone', ''))
-                    full_address = str(row.get('full_address', ''))
-                    state = str(row.get('state', ''))
-                    location_link = str(row.get('location_link', ''))
-                    place_id = str(row.get('place_id', ''))
-                    verified = bool(row.get('verified', False))
-                    country = str(row.get('country', ''))
-                    country_code = str(row.get('country_code', ''))
-                    time_zone = str(row.get('time_zone', ''))
-
-                    metric_id = uuid.uuid4()
-                    current_date = datetime.now().replace(tzinfo=timezone.utc)
-                    metric = OutscraperLocationMetric(
-                        Id=metric_id,
-                        Rating=rating,
-                        Reviews=reviews,
-                        ReviewsPerScore1=reviews_per_score1,
-                        ReviewsPerScore2=reviews_per_score2,
-                        ReviewsPerScore3=reviews_per_score3,
-                        ReviewsPerScore4=reviews_per_score4,
-                        ReviewsPerScore5=reviews_per_score5,
-                        PhotosCount=photos_count,
-                        CreateDate=current_date,
-                        Year=current_date.year,
-                        Month=current_date.month
-                    )
-                    session.add(metric)
-                    results['metrics_added'] += 1
-
-                    if existing_location:
-                        existing_location.MetricId = metric_id
-
-                        if name.strip():
-                            existing_location.Name = name
-                        if type_value.strip():
-                            existing_location.Type = type_value
-                        if phone.strip():
-                            existing_location.Phone = phone
-                        if full_address.strip():
-                            existing_location.FullAddress = full_address
-                        if postal_code.strip():
-                            existing_location.PostalCode = postal_code
-                        if state.strip():
-                            existing_location.State = state
-
-                        if latitude != 0.0:
-                            existing_location.Latitude = latitude
-                        if longitude != 0.0:
-                            existing_location.Longitude = longitude
-
-                        existing_location.Verified = verified
-
-                        if location_link.strip():
-                            existing_location.LocationLink = location_link
-
-                        if country.strip():
-                            existing_location.Country = country
-
-                        if country_code.strip():
-                            existing_location.CountryCode = country_code
-                        
-                        if time_zone.strip():
-                            existing_location.Timezone = time_zone
-
-                        metric.LocationId = existing_location.Id
+            self._sync_types(batch, results)
+
+            loop_start = time.perf_counter()
+            for record in batch:
+                google_id = record.GoogleId
+                existing_location = None
+
+                if record.HasGoogleId:
+                    start_time = time.perf_counter()
+                    existing_location = self._find_location(session, google_id)
+                    lookup_seconds += time.perf_counter() - start_time
+                    lookups += 1
+
+                if self.fingerprints is not None and record.HasGoogleId:
+                    fingerprint = record_fingerprint(record)
+                    previous = pending_fingerprints.get(google_id)
+                    if previous is None:
+                        previous = self.fingerprints.get(google_id)
+                    pending_fingerprints[google_id] = fingerprint
+                    if existing_location and previous == fingerprint:
+                        self._update_location(existing_location, record)
                         results['locations_updated'] += 1
-                    else:
-                        location_id = uuid.uuid4()
-                        location = OutscraperLocation(
-                            Id=location_id,
-                            MetricId=metric_id,
-                            PlaceId=place_id,
-                            GoogleId=google_id,
-                            Name=name,
-                            Type=type_value,
-                            Phone=phone,
-                            FullAddress=full_address,
-                            PostalCode=postal_code,
-                            State=state,
-                            Latitude=latitude,
-                            Longitude=longitude,
-                            Verified=verified,
-                            LocationLink=location_link,
-                            Country = country,
-                            CountryCode = country_code,
-                            Timezone = time_zone
-                        )
-                        session.add(location)
-
-                        metric.LocationId = location_id
-                        results['locations_added'] += 1
-
-                except Exception as row_error:
-                    if not hasattr(self, '_error_counts'):
-                        self._error_counts = defaultdict(int)
-                    error_msg = str(row_error)
-                    self._error_counts[error_msg] += 1
-                    
-                    if self._error_counts[error_msg] <= 3:
-                        logging.error(f"Error processing row: {error_msg}")
-                    elif self._error_counts[error_msg] == 4:
-                        logging.error(f"Error processing row: {error_msg} (suppressing further identical errors)")
-                
-                    session.rollback()
-
-                if results['metrics_added'] % 50 == 0:
-                    try:
-                        session.commit()
-                        logging.debug(f"Intermediate commit successful after {results['metrics_added']} metrics added.")
-                    except SQLAlchemyError as commit_error:
-                        session.rollback()
-                        logging.error(f"Error during intermediate commit: {commit_error}")
+                        results['metrics_skipped'] += 1
+                        continue
+
+                metric_id = uuid.uuid4()
+                current_date = datetime.now().replace(tzinfo=timezone.utc)
+                metric = self.models.OutscraperLocationMetric(
+                    Id=metric_id,
+                    CreateDate=current_date,
+                    Year=current_date.year,
+                    Month=current_date.month,
+                    **metric_params(record)
+                )
+                session.add(metric)
+                results['metrics_added'] += 1
+
+                if existing_location:
+                    existing_location.MetricId = metric_id
+                    self._update_location(existing_location, record)
+
+                    metric.LocationId = existing_location.Id
+                    pending_index_entries.append((google_id, existing_location.Id, metric_id))
+                    results['locations_updated'] += 1
+                else:
+                    location_id = uuid.uuid4()
+                    location = self.models.OutscraperLocation(
+                        Id=location_id,
+                        MetricId=metric_id,
+                        GoogleId=google_id,
+                        **location_params(record)
+                    )
+                    session.add(location)
+
+                    metric.LocationId = location_id
+                    pending_index_entries.append((google_id, location_id, metric_id))
+                    results['locations_added'] += 1
+
+            # ORM inserts and updates are sent by the flushes, so "write" only covers building the objects
+            stage_metrics.record('lookup', lookup_seconds, lookups)
+            stage_metrics.record('write', time.perf_counter() - loop_start - lookup_seconds, len(batch))
 
             try:
-                # Commit changes with retry logic
-                execute_with_retry(session, lambda s: s.commit())
+                start_time = time.perf_counter()
+                session.flush()
+                stage_metrics.record('flush', time.perf_counter() - start_time, len(batch))
+                if fence is not None:
+                    fence()
+                start_time = time.perf_counter()
+                session.commit()
+                stage_metrics.record('commit', time.perf_counter() - start_time, len(batch))
+                self._index_locations(pending_index_entries)
+                self._remember_fingerprints(pending_fingerprints)
                 #logging.info(f"Final commit successful for batch with {results['metrics_added']} metrics.")
             except SQLAlchemyError as commit_error:
                 session.rollback()
-                logging.error(f"Error during final commit: {commit_error}")
+                if not is_deadlock(commit_error):
+                    logging.error(f"Error during final commit: {commit_error}")
                 raise
 
             return results
 
         except SQLAlchemyError as e:
             session.rollback()
-            logging.error(f"SQL error in batch processing: {e}")
+            if not is_deadlock(e):
+                logging.error(f"SQL error in batch processing: {e}")
+            raise
+        except LeaseLost:
+            session.rollback()
             raise
         except Exception as e:
             session.rollback()
@@ -334,6 +765,61 @@ class ExcelProcessor:
         finally:
             session.close()
 
+    def _bulk_write_batch(self, batch, write_function, fence=None):
+        session = self.session_factory()
+        results = {
+            'locations_added': 0,
+            'locations_updated': 0,
+            'metrics_added': 0,
+            'metrics_skipped': 0,
+            'types_added': 0,
+            'types_updated': 0
+        }
+
+        index_entries = [] if self.location_index is not None else None
+        metric_writes, fingerprints = None, None
+        if self.fingerprints is not None:
+            metric_writes, fingerprints = plan_metric_writes(batch, self.fingerprints)
+
+        try:
+            self._sync_types(batch, results)
+            results.update(write_function(session, index_entries, metric_writes))
+            if fence is not None:
+                fence()
+            with stage_metrics.time('commit', len(batch)):
+                session.commit()
+            self._index_locations(index_entries)
+            self._remember_fingerprints(fingerprints)
+            return results
+
+        except SQLAlchemyError as e:
+            session.rollback()
+            if not is_deadlock(e):
+                logging.error(f"SQL error in {self.write_mode} batch processing: {e}")
+            raise
+        except LeaseLost:
+            session.rollback()
+            raise
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Unexpected error in {self.write_mode} batch processing: {e}")
+            raise
+        finally:
+            session.close()
+
+    def _update_location(self, location, record):
+        for col in LOCATION_TEXT_UPDATE_COLUMNS:
+            value = getattr(record, col)
+            if value.strip():
+                setattr(location, col, value)
+
+        if record.Latitude != 0.0:
+            location.Latitude = record.Latitude
+        if record.Longitude != 0.0:
+            location.Longitude = record.Longitude
+
+        location.Verified = record.Verified
+
     def move_processed_file(self, file_path):
         try:
             file_name = os.path.basename(file_path)
@@ -353,37 +839,92 @@ class ExcelProcessor:
 
             os.rename(file_path, new_path)
             logging.info(f"File archived: {new_path}")
-            return True
+            return new_path
         except Exception as e:
             logging.error(f"Error moving processed file: {e}")
-            return False
+            return None
 
     def watch_folder(self):
         watch_folder = EXCEL_CONFIG['watch_folder']
         ensure_directory_exists(watch_folder)
 
-        excel_files = [f for f in os.listdir(watch_folder) if f.endswith(('.xlsx', '.xls')) and
+        excel_files = [f for f in os.listdir(watch_folder) if f.lower().endswith(SUPPORTED_EXTENSIONS) and
                        os.path.isfile(os.path.join(watch_folder, f))]
 
         if not excel_files:
-            logging.info("No Excel files found to process.")
+            logging.info("No input files found to process.")
             return 0
 
+        file_paths = order_backlog([os.path.join(watch_folder, file) for file in excel_files])
+        progress = BacklogProgress(file_paths)
+        logging.info(f"Draining backlog of {progress.total_files} files "
+                     f"({progress.total_bytes / 1024 / 1024:.1f} MB), {BACKLOG_CONFIG['policy']} first")
+
         files_processed = 0
         files_failed = 0
 
-        for file in excel_files:
-            file_path = os.path.join(watch_folder, file)
-            logging.info(f"Processing Excel file: {file_path}")
-
-            try:
-                if self.process_file(file_path):
+        if self.parse_pipeline is not None:
+            # Every file is handed to the parser processes up front in backlog order, writes interleave
+            # as their batches arrive
+            futures = {}
+            for file_path in file_paths:
+                if self._stopping.is_set():
+                    break
+                leased_path = self._lease_file(file_path)
+                if leased_path is None:
+                    progress.file_skipped(file_path)
+                elif self._claim_file(leased_path):
+                    futures[file_path] = self.parse_pipeline.submit(leased_path)
+                else:
+                    files_processed += 1
+                    progress.file_done(file_path, True)
+            logging.info(f"Processing {len(futures)} input files with {self.parse_pipeline.parse_workers} parser processes")
+
+            def file_done(file_path, future):
+                if not self._stopping.is_set():
+                    progress.file_done(file_path, future.result())
+
+            for file_path, future in futures.items():
+                future.add_done_callback(lambda future, file_path=file_path: file_done(file_path, future))
+            for future in futures.values():
+                succeeded = future.result()
+                # Files cut short by a stop stay in the watch folder and are not counted
+                if self._stopping.is_set() and not succeeded:
+                    continue
+                if succeeded:
                     files_processed += 1
                 else:
                     files_failed += 1
+
+            logging.info(f"Watch folder processing complete. Processed: {files_processed}, Failed: {files_failed}")
+            return files_processed
+
+        def process(file_path):
+            if self._stopping.is_set():
+                return None
+            logging.info(f"Processing Excel file: {file_path}")
+            try:
+                succeeded = self.process_file(file_path)
             except Exception as e:
-                files_failed += 1
+                succeeded = False
                 logging.error(f"Unhandled exception processing file {file_path}: {e}")
+            if succeeded == SKIPPED:
+                progress.file_skipped(file_path)
+                return None
+            if not self._stopping.is_set():
+                progress.file_done(file_path, succeeded)
+            return succeeded
+
+        # Files run side by side, their batches share the writer pool of writer_budget threads
+        file_workers = max(min(BACKLOG_CONFIG['file_workers'], len(file_paths)), 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=file_workers, thread_name_prefix='backlog') as executor:
+            for succeeded in executor.map(process, file_paths):
+                if succeeded is None:
+                    continue
+                if succeeded:
+                    files_processed += 1
+                else:
+                    files_failed += 1
 
         logging.info(f"Watch folder processing complete. Processed: {files_processed}, Failed: {files_failed}")
-        return files_processed
\ No newline at end of file
+        return files_processed
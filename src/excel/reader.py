@@ -35,5 +35,9 @@ class ExcelReader:
 
 
 if __name__ == '__main__':
+    import sys
+
+    # Sample files can be generated with: python -m benchmarks.generator sample.xlsx --rows 1000
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "../../excel_files/Outscraper.xlsx"
     excelReader = ExcelReader()
-    excelReader.read_selected_columns("../../excel_files/Outscraper.xlsx", TARGET_COLUMNS)
\ No newline at end of file
+    excelReader.read_selected_columns(file_path, TARGET_COLUMNS)
\ No newline at end of file
@@ -0,0 +1,183 @@
+import logging
+import pandas as pd
+from .streaming import ExcelChunkReader
+from ..utils.helpers import STRING_COLUMNS
+
+try:
+    import pyarrow
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+    pa_csv = None
+    pq = None
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+CSV_EXTENSIONS = ('.csv', '.csv.gz')
+PARQUET_EXTENSIONS = ('.parquet',)
+SUPPORTED_EXTENSIONS = EXCEL_EXTENSIONS + CSV_EXTENSIONS + PARQUET_EXTENSIONS
+
+# Text columns are read verbatim so values like the "NA" country code or zero-padded postal codes survive
+TEXT_COLUMNS = STRING_COLUMNS + ['postal_code']
+BOOLEAN_STRINGS = {'true': True, 'false': False}
+
+
+def is_supported_file(file_path):
+    return file_path.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def get_file_format(file_path):
+    lower_path = file_path.lower()
+    if lower_path.endswith(EXCEL_EXTENSIONS):
+        return 'excel'
+    if lower_path.endswith(CSV_EXTENSIONS):
+        return 'csv'
+    if lower_path.endswith(PARQUET_EXTENSIONS):
+        return 'parquet'
+    raise ValueError(f"Unsupported input file: {file_path}")
+
+
+def normalize_text_frame(df):
+    # Excel keeps TRUE/FALSE cells as booleans, text formats spell them out
+    if 'verified' in df.columns and df['verified'].dtype.kind not in 'biuf':
+        verified = df['verified']
+        mapped = verified.astype(str).str.strip().str.lower().map(BOOLEAN_STRINGS)
+        df['verified'] = verified.astype(object).where(mapped.isna(), mapped)
+    return df
+
+
+def _select_columns(header, columns):
+    if columns is None:
+        columns = list(header)
+    return [col for col in columns if col in header], [col for col in columns if col not in header]
+
+
+def _csv_options(header, columns):
+    selected, _ = _select_columns(header, columns)
+    return {
+        'usecols': selected,
+        'dtype': {col: str for col in TEXT_COLUMNS if col in selected},
+        'keep_default_na': False,
+        'na_values': [''],
+    }
+
+
+def read_excel_file(file_path, columns=None):
+    # Same text handling as the CSV and streaming readers, so every format yields the same cleaned frame
+    return normalize_text_frame(pd.read_excel(file_path, dtype={col: str for col in TEXT_COLUMNS},
+                                              keep_default_na=False, na_values=['']))
+
+
+def _read_csv_pyarrow(file_path, options):
+    # pandas' pyarrow engine infers numbers before applying dtype, which drops the leading zeros of an
+    # all-numeric postal code column. Declaring the text columns as strings up front keeps them verbatim.
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=options['usecols'],
+        column_types={col: pyarrow.string() for col in options['dtype']},
+        null_values=[''],
+        strings_can_be_null=True,
+    )
+    table = pa_csv.read_csv(file_path, convert_options=convert_options)
+    return table.to_pandas()
+
+
+def read_csv_file(file_path, columns=None):
+    header = list(pd.read_csv(file_path, nrows=0).columns)
+    options = _csv_options(header, columns)
+    if pyarrow is not None:
+        try:
+            # pyarrow parses with multiple threads and is several times faster than the C engine
+            return normalize_text_frame(_read_csv_pyarrow(file_path, options))
+        except Exception as e:
+            logging.warning(f"pyarrow CSV reader failed for {file_path}, falling back to the default engine: {e}")
+    return normalize_text_frame(pd.read_csv(file_path, **options))
+
+
+def read_parquet_file(file_path, columns=None):
+    if pq is not None:
+        header = pq.read_schema(file_path).names
+        selected, _ = _select_columns(header, columns)
+        return normalize_text_frame(pd.read_parquet(file_path, columns=selected))
+    return normalize_text_frame(pd.read_parquet(file_path))
+
+
+class CsvChunkReader:
+    def __init__(self, file_path, chunk_size=5000, columns=None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.header = list(pd.read_csv(file_path, nrows=0).columns)
+        self.columns, self.missing_columns = _select_columns(self.header, columns)
+        self._reader = pd.read_csv(file_path, chunksize=chunk_size, **_csv_options(self.header, columns))
+
+    @property
+    def estimated_rows(self):
+        return None
+
+    def __iter__(self):
+        for chunk in self._reader:
+            yield normalize_text_frame(chunk[self.columns].reset_index(drop=True))
+
+    def close(self):
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class ParquetChunkReader:
+    def __init__(self, file_path, chunk_size=5000, columns=None):
+        if pq is None:
+            raise ImportError("pyarrow is required to stream parquet files")
+
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self._file = pq.ParquetFile(file_path)
+        self.header = self._file.schema_arrow.names
+        self.columns, self.missing_columns = _select_columns(self.header, columns)
+
+    @property
+    def estimated_rows(self):
+        return self._file.metadata.num_rows
+
+    def __iter__(self):
+        for record_batch in self._file.iter_batches(batch_size=self.chunk_size, columns=self.columns):
+            yield normalize_text_frame(record_batch.to_pandas())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+READERS = {
+    'excel': read_excel_file,
+    'csv': read_csv_file,
+    'parquet': read_parquet_file,
+}
+
+CHUNK_READERS = {
+    'excel': ExcelChunkReader,
+    'csv': CsvChunkReader,
+    'parquet': ParquetChunkReader,
+}
+
+
+def read_input_file(file_path, columns=None):
+    return READERS[get_file_format(file_path)](file_path, columns)
+
+
+def open_chunk_reader(file_path, chunk_size=5000, columns=None):
+    file_format = get_file_format(file_path)
+    # openpyxl cannot read legacy .xls workbooks, those are always loaded in full
+    if file_format == 'excel' and not file_path.lower().endswith('.xlsx'):
+        return None
+    return CHUNK_READERS[file_format](file_path, chunk_size, columns)
@@ -0,0 +1,54 @@
+import logging
+import pandas as pd
+from openpyxl import load_workbook
+
+
+class ExcelChunkReader:
+    def __init__(self, file_path, chunk_size=5000, columns=None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.workbook = load_workbook(file_path, read_only=True, data_only=True)
+        self.sheet = self.workbook.worksheets[0]
+        self._rows = self.sheet.iter_rows(values_only=True)
+
+        header = next(self._rows, None) or ()
+        self.header = [str(value) if value is not None else f"Unnamed: {i}" for i, value in enumerate(header)]
+
+        if columns is None:
+            columns = self.header
+        self.columns = [col for col in columns if col in self.header]
+        self.missing_columns = [col for col in columns if col not in self.header]
+        self._positions = [self.header.index(col) for col in self.columns]
+
+    @property
+    def estimated_rows(self):
+        # Taken from the sheet dimension, which some writers leave out or get wrong
+        max_row = self.sheet.max_row
+        return max(max_row - 1, 0) if max_row else None
+
+    def __iter__(self):
+        chunk = []
+        for row in self._rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append([row[position] if position < len(row) else None for position in self._positions])
+            if len(chunk) >= self.chunk_size:
+                yield pd.DataFrame(chunk, columns=self.columns)
+                chunk = []
+
+        if chunk:
+            yield pd.DataFrame(chunk, columns=self.columns)
+
+    def close(self):
+        try:
+            self.workbook.close()
+        except Exception as e:
+            logging.warning(f"Error closing workbook {self.file_path}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
@@ -0,0 +1,91 @@
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from .batch_builder import LOCATION_TEXT_FIELDS, METRIC_INT_FIELDS
+from ..database.models import OutscraperLocation, OutscraperLocationTypes
+from ..utils.helpers import ensure_directory_exists
+
+INT32_MAX = int(np.iinfo(np.int32).max)
+
+
+def text_limits(location_model=OutscraperLocation, type_model=OutscraperLocationTypes):
+    # Column lengths come from the models of the target, NTEXT columns have none
+    limits = {'google_id': location_model.GoogleId.type.length}
+    for attribute, col in LOCATION_TEXT_FIELDS:
+        length = getattr(location_model.__table__.c[attribute].type, 'length', None)
+        if length:
+            limits[col] = length
+    # Types are also written to the type table
+    limits['type'] = min(limits['type'], type_model.Name.type.length)
+    return limits
+
+
+TEXT_LIMITS = text_limits()
+VALUE_RANGES = {
+    'latitude': (-90.0, 90.0),
+    'longitude': (-180.0, 180.0),
+    'rating': (0.0, 5.0),
+}
+# INTEGER metric columns
+COUNT_COLUMNS = [col for _, col in METRIC_INT_FIELDS]
+
+
+def _text_lengths(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Measured once per category
+        lengths = values.cat.categories.astype(str).str.len().to_numpy()
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, lengths[codes], 0)
+    return values.astype(str).str.len().fillna(0).to_numpy(dtype=np.int64)
+
+
+def _checks(df, limits):
+    for col, limit in limits.items():
+        if col in df.columns:
+            yield _text_lengths(df[col]) > limit, f"{col} longer than {limit} characters"
+
+    for col, (low, high) in VALUE_RANGES.items():
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+            # NaN and infinity fail the range check as well
+            yield ~((values >= low) & (values <= high)), f"{col} not a number between {low:g} and {high:g}"
+
+    for col in COUNT_COLUMNS:
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+            yield ~((values >= 0) & (values <= INT32_MAX)), f"{col} not a count between 0 and {INT32_MAX}"
+
+
+def validate_frame(df, limits=None):
+    # Splits a cleaned frame into the rows the database accepts and the rejected rows with their reasons.
+    # limits are the text lengths of the target, those of DB_CONFIG by default
+    reasons = np.full(len(df), '', dtype=object)
+    invalid = np.zeros(len(df), dtype=bool)
+    for failed, message in _checks(df, TEXT_LIMITS if limits is None else limits):
+        if failed.any():
+            reasons[failed] = reasons[failed] + f"{message}; "
+            invalid |= failed
+
+    if not invalid.any():
+        return df, df.iloc[:0]
+
+    rejected = df[invalid].copy()
+    rejected.insert(0, 'reason', [reason[:-2] for reason in reasons[invalid]])
+    return df[~invalid].reset_index(drop=True), rejected
+
+
+class QuarantineFile:
+    # One CSV per processing attempt of a file, written only when a row is rejected
+    def __init__(self, file_path, folder):
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        self.folder = folder
+        self.path = os.path.join(folder, f"{timestamp}_{os.path.basename(file_path)}.csv")
+        self.rows = 0
+
+    def write(self, rejected):
+        if rejected.empty:
+            return
+        ensure_directory_exists(self.folder)
+        rejected.to_csv(self.path, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        self.rows += len(rejected)
@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from ..configurations.config import LEASE_CONFIG
+from ..database.ingestion_ledger import merge_ranges
+from .stage_metrics import stage_metrics
+from ..utils.helpers import ensure_directory_exists
+
+HEARTBEAT_FILE = 'heartbeat'
+CHECKPOINT_FOLDER = 'checkpoints'
+# Result of process_file for a file another node claimed first, it is neither a success nor a failure here
+SKIPPED = 'skipped'
+
+
+class LeaseLost(Exception):
+    # Another node reclaimed the file while this node was writing it
+    pass
+
+
+def _free_path(folder, file_name):
+    # rename() replaces an existing file on POSIX, a name already taken gets a counter
+    path = os.path.join(folder, file_name)
+    root, extension = os.path.splitext(file_name)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{root}_{counter}{extension}")
+        counter += 1
+    return path
+
+
+class SharedCheckpoints:
+    # Committed row ranges of the files in progress, kept in the lease folder every node sees, one JSON file per
+    # content hash and target. The node that reclaims a file resumes from the ranges its last owner committed.
+    # Has the checkpoint methods of the ingestion ledger, whose database is local to a node.
+    def __init__(self, folder, owner, target=None):
+        self.folder = folder
+        self.owner = owner
+        self.target = target
+        self._lock = threading.Lock()
+
+    def _path(self, content_hash):
+        name = f"{content_hash}_{self.target}" if self.target else content_hash
+        return os.path.join(self.folder, f"{name}.json")
+
+    def _read(self, content_hash):
+        try:
+            with open(self._path(content_hash), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'owner': None, 'ranges': []}
+
+    def checkpoint(self, content_hash, start_row, end_row):
+        # Only the owner of a file writes its checkpoints, the lock orders this node's writer threads
+        with self._lock:
+            state = self._read(content_hash)
+            state['owner'] = self.owner
+            state['ranges'] = merge_ranges([tuple(r) for r in state['ranges']] + [(start_row, end_row)])
+            ensure_directory_exists(self.folder)
+            path = self._path(content_hash)
+            temp_path = f"{path}.{self.owner}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(temp_path, path)
+
+    def committed_ranges(self, content_hash):
+        with self._lock:
+            state = self._read(content_hash)
+        if state['ranges'] and state['owner'] != self.owner:
+            logging.info(f"Checkpoints of {content_hash[:12]} were written by node {state['owner']}.")
+        return merge_ranges([tuple(r) for r in state['ranges']])
+
+    def clear(self, content_hash):
+        with self._lock:
+            try:
+                os.remove(self._path(content_hash))
+            except FileNotFoundError:
+                pass
+
+
+class FileLeases:
+    # Lets several nodes share one watch folder. A node claims a file by renaming it into its own lease folder,
+    # a rename only one node can win. While the node runs it bumps a counter in its heartbeat file. Other nodes
+    # time the counter on their own clocks, and when it stops changing for longer than the timeout they move
+    # the node's files back to the watch folder, where the next free node claims them.
+    def __init__(self, watch_folder, node_id=None, lease_folder=None, heartbeat_interval=None, timeout=None):
+        self.watch_folder = watch_folder
+        self.node_id = node_id or LEASE_CONFIG['node_id'] or f"{socket.gethostname()}-{os.getpid()}"
+        self.root = lease_folder or LEASE_CONFIG['folder'] or os.path.join(watch_folder, '.leases')
+        self.folder = os.path.join(self.root, self.node_id)
+        self.heartbeat_interval = heartbeat_interval or LEASE_CONFIG['heartbeat_interval']
+        self.timeout = timeout or LEASE_CONFIG['timeout']
+        self._beats = 0
+        # Last heartbeat seen per other node and the local time it was first seen
+        self._observed = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        ensure_directory_exists(self.folder)
+        # Files left by an earlier run with the same node id go back to the watch folder
+        self._return_files(self.folder)
+        self._beat()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name='lease-heartbeat', daemon=True)
+        self._thread.start()
+        logging.info(f"File leases of node {self.node_id} in {self.root}, heartbeat every "
+                     f"{self.heartbeat_interval}s, reclaimed after {self.timeout}s.")
+        return self
+
+    def claim(self, file_path):
+        # The leased path of the file, or None when another node claimed it first
+        if os.path.dirname(os.path.abspath(file_path)) == os.path.abspath(self.folder):
+            return file_path
+        try:
+            leased_path = _free_path(self.folder, os.path.basename(file_path))
+            os.rename(file_path, leased_path)
+        except FileNotFoundError:
+            logging.info(f"File claimed by another node: {file_path}")
+            return None
+        except OSError as e:
+            logging.warning(f"Could not claim {file_path}: {e}")
+            return None
+        stage_metrics.increment('files_leased')
+        return leased_path
+
+    def owns(self, leased_path):
+        # False once another node reclaimed the file: it has left this node's lease folder
+        return (os.path.dirname(os.path.abspath(leased_path)) == os.path.abspath(self.folder) and
+                os.path.exists(leased_path))
+
+    def fence(self, leased_path):
+        # Checked right before every commit and before archiving, so a node that stalled past the timeout
+        # does not keep writing a file that another node now resumes
+        if not self.owns(leased_path):
+            raise LeaseLost(f"Lease of {leased_path} was lost to another node")
+
+    def checkpoints(self, target=None):
+        return SharedCheckpoints(os.path.join(self.root, CHECKPOINT_FOLDER), self.node_id, target)
+
+    def _return_file(self, path):
+        try:
+            os.rename(path, _free_path(self.watch_folder, os.path.basename(path)))
+            return True
+        except FileNotFoundError:
+            # Another node reclaimed it first
+            return False
+
+    def _return_files(self, folder):
+        returned = 0
+        for file_name in os.listdir(folder):
+            path = os.path.join(folder, file_name)
+            if not file_name.startswith(HEARTBEAT_FILE) and os.path.isfile(path) and self._return_file(path):
+                returned += 1
+        return returned
+
+    def _beat(self):
+        self._beats += 1
+        heartbeat_path = os.path.join(self.folder, HEARTBEAT_FILE)
+        temp_path = f"{heartbeat_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(str(self._beats))
+        os.replace(temp_path, heartbeat_path)
+
+    def _read_beat(self, folder):
+        try:
+            with open(os.path.join(folder, HEARTBEAT_FILE), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _heartbeat_loop(self):
+        while not self._stopping.wait(self.heartbeat_interval):
+            try:
+                ensure_directory_exists(self.folder)
+                self._beat()
+                self.reclaim_expired()
+            except Exception as e:
+                logging.error(f"Error renewing file leases: {e}")
+
+    def reclaim_expired(self, now=None):
+        now = now if now is not None else time.monotonic()
+        reclaimed = 0
+        try:
+            nodes = [node for node in os.listdir(self.root) if node not in (self.node_id, CHECKPOINT_FOLDER)]
+        except FileNotFoundError:
+            return 0
+
+        for node in nodes:
+            folder = os.path.join(self.root, node)
+            if not os.path.isdir(folder):
+                continue
+            beat = self._read_beat(folder)
+            seen = self._observed.get(node)
+            if seen is None or seen[0] != beat:
+                self._observed[node] = (beat, now)
+                continue
+            if now - seen[1] < self.timeout:
+                continue
+
+            returned = self._return_files(folder)
+            if returned:
+                reclaimed += returned
+                logging.warning(f"Node {node} sent no heartbeat for {now - seen[1]:.0f}s, "
+                                f"{returned} of its files were returned to the watch folder.")
+            self._remove_folder(folder)
+            self._observed.pop(node, None)
+
+        if reclaimed:
+            stage_metrics.increment('leases_reclaimed', reclaimed)
+        return reclaimed
+
+    def _remove_folder(self, folder):
+        try:
+            os.remove(os.path.join(folder, HEARTBEAT_FILE))
+        except OSError:
+            pass
+        try:
+            os.rmdir(folder)
+        except OSError:
+            # The node is back or left a file behind, its folder is looked at again later
+            pass
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        # Files this node did not finish can be claimed by the other nodes right away
+        returned = self._return_files(self.folder) if os.path.isdir(self.folder) else 0
+        if returned:
+            logging.info(f"Returned {returned} unfinished files to the watch folder.")
+        self._remove_folder(self.folder)
@@ -1,63 +1,218 @@
 import logging
 import os
+import queue
+import threading
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from ..excel.readers import is_supported_file
+from .file_leases import SKIPPED
+from ..configurations.config import WATCHER_CONFIG
+
+
+class _PendingFile:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.first_seen = time.time()
+        self.signature = None
+        self.stable_checks = 0
+        self.attempts = 0
+
 
 class ExcelFileHandler(FileSystemEventHandler):
-    def __init__(self, process_function):
+    def __init__(self, process_function, file_workers=None, stability_interval=None, stability_checks=None,
+                 retry_delay=None, max_retries=None):
         self.process_function = process_function
-        self.processing_files = set()
+        self.file_workers = file_workers or WATCHER_CONFIG['file_workers']
+        self.stability_interval = stability_interval or WATCHER_CONFIG['stability_interval']
+        self.stability_checks = stability_checks or WATCHER_CONFIG['stability_checks']
+        self.retry_delay = retry_delay or WATCHER_CONFIG['retry_delay']
+        self.max_retries = max_retries if max_retries is not None else WATCHER_CONFIG['max_retries']
+
+        self.work_queue = queue.Queue()
+        self.processing_files = {}
+        self._timers = set()
+        self._lock = threading.Lock()
+        self._stopping = False
+
+        self.events = 0
+        self.started = 0
+        self.succeeded = 0
+        self.failed = 0
+        # Files another node claimed first
+        self.skipped = 0
+        self.retries = 0
+        self.abandoned = 0
+        self.in_progress = 0
+        self.total_start_latency = 0.0
+        self.max_start_latency = 0.0
+
+        self._workers = []
+        for worker_num in range(self.file_workers):
+            worker = threading.Thread(target=self._work, name=f"file-worker-{worker_num + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
 
     def on_created(self, event):
         if not event.is_directory and self.is_excel_file(event.src_path):
-            self._process_file(event.src_path)
+            self.enqueue(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory and self.is_excel_file(event.src_path):
+            self.enqueue(event.src_path)
 
     def on_moved(self, event):
         if not event.is_directory and self.is_excel_file(event.dest_path):
-            self._process_file(event.dest_path)
+            self.enqueue(event.dest_path)
 
     def is_excel_file(self, file_path):
-        return file_path.endswith(('.xlsx', '.xls'))
+        return is_supported_file(file_path)
 
-    def _process_file(self, file_path):
-        if file_path in self.processing_files:
-            return
+    def enqueue(self, file_path):
+        # The observer thread only records the event, everything else happens on the file workers
+        with self._lock:
+            self.events += 1
+            if self._stopping or file_path in self.processing_files:
+                return
+            pending = _PendingFile(file_path)
+            self.processing_files[file_path] = pending
+        self.work_queue.put(pending)
 
-        time.sleep(1)
+    def _schedule(self, pending, delay):
+        def requeue():
+            with self._lock:
+                self._timers.discard(timer)
+                if self._stopping:
+                    return
+            self.work_queue.put(pending)
 
-        try:
-            if not os.path.exists(file_path):
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        with self._lock:
+            if self._stopping:
                 return
+            self._timers.add(timer)
+        timer.start()
+
+    def _forget(self, pending):
+        with self._lock:
+            self.processing_files.pop(pending.file_path, None)
 
+    def _work(self):
+        while True:
+            pending = self.work_queue.get()
+            if pending is None:
+                break
+            if self._stopping:
+                self._forget(pending)
+                continue
             try:
-                with open(file_path, 'rb') as _:
-                    pass
-            except (IOError, PermissionError):
-                logging.warning(f"File {file_path} is locked. Will try again later.")
+                self._process_file(pending)
+            except Exception as e:
+                logging.error(f"Error in file processing flow: {e}")
+                self._forget(pending)
+
+    def _process_file(self, pending):
+        file_path = pending.file_path
+        if not os.path.exists(file_path):
+            self._forget(pending)
+            return
+
+        # A file is complete once its size and mtime stop changing between checks
+        stat = os.stat(file_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature != pending.signature:
+            pending.signature = signature
+            pending.stable_checks = 0
+            self._schedule(pending, self.stability_interval)
+            return
+
+        pending.stable_checks += 1
+        if pending.stable_checks < self.stability_checks:
+            self._schedule(pending, self.stability_interval)
+            return
+
+        try:
+            with open(file_path, 'rb') as _:
+                pass
+        except (IOError, PermissionError):
+            pending.attempts += 1
+            if pending.attempts > self.max_retries:
+                logging.error(f"File {file_path} is still locked after {self.max_retries} retries. Giving up.")
+                with self._lock:
+                    self.abandoned += 1
+                self._forget(pending)
                 return
 
-            self.processing_files.add(file_path)
-            logging.info(f"New Excel File detected: {file_path}")
+            logging.warning(f"File {file_path} is locked. Retrying in {self.retry_delay}s " +
+                            f"(attempt {pending.attempts}/{self.max_retries}).")
+            with self._lock:
+                self.retries += 1
+            pending.signature = None
+            self._schedule(pending, self.retry_delay)
+            return
 
-            try:
-                self.process_function(file_path)
-            except Exception as e:
-                logging.error(f"Error processing file {file_path}: {e}")
-            finally:
-                self.processing_files.remove(file_path)
+        start_latency = time.time() - pending.first_seen
+        with self._lock:
+            self.started += 1
+            self.in_progress += 1
+            self.total_start_latency += start_latency
+            self.max_start_latency = max(self.max_start_latency, start_latency)
+        logging.info(f"New Excel File detected: {file_path}, processing started after {start_latency:.2f}s")
+
+        result = False
+        try:
+            result = self.process_function(file_path)
         except Exception as e:
-            logging.error(f"Error in file processing flow: {e}")
-            if file_path in self.processing_files:
-                self.processing_files.remove(file_path)
+            logging.error(f"Error processing file {file_path}: {e}")
+        finally:
+            with self._lock:
+                self.in_progress -= 1
+                if result == SKIPPED:
+                    self.skipped += 1
+                elif result is not False:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+            self._forget(pending)
+            logging.info(f"File watcher stats: {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self.work_queue.qsize(),
+                'scheduled': len(self._timers),
+                'in_progress': self.in_progress,
+                'events': self.events,
+                'started': self.started,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'retries': self.retries,
+                'abandoned': self.abandoned,
+                'avg_start_latency': round(self.total_start_latency / self.started, 3) if self.started else 0.0,
+                'max_start_latency': round(self.max_start_latency, 3),
+            }
 
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            timers = list(self._timers)
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+        for _ in self._workers:
+            self.work_queue.put(None)
+        for worker in self._workers:
+            worker.join()
 
-def start_file_monitoring(watch_folder, process_function):
-    event_handler = ExcelFileHandler(process_function)
+
+def start_file_monitoring(watch_folder, process_function, file_workers=None):
+    event_handler = ExcelFileHandler(process_function, file_workers=file_workers)
     observer = Observer()
     observer.schedule(event_handler, watch_folder, recursive=False)
     observer.start()
-    
-    logging.info(f"Watching folder {watch_folder} for new Excel files.")
-    
-    return observer
\ No newline at end of file
+
+    logging.info(f"Watching folder {watch_folder} for new Excel files with {event_handler.file_workers} file workers.")
+
+    return observer, event_handler
@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ..configurations.config import METRICS_CONFIG
+from .stage_metrics import stage_metrics, DURATION_BUCKETS
+
+PREFIX = 'locationmetric'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HELP = {
+    'stage_duration_seconds': "Time spent per call of a processing stage.",
+    'stage_rows_total': "Rows handled by a processing stage.",
+    'stage_rows_per_second': "Rows per second of busy time in a processing stage, the throughput of one worker.",
+    'batches_written_total': "Batches committed to the database.",
+    'batches_failed_total': "Batches that failed and were rolled back.",
+    'rows_written_total': "Rows committed to the database.",
+    'rows_coalesced_total': "Input rows folded into an earlier row with the same google_id.",
+    'rows_quarantined_total': "Input rows rejected by validation and written to a quarantine file.",
+    'place_waits_total': "Batches that waited for a batch of another file writing the same places.",
+    'batch_replays_total': "Batches written again after being chosen as deadlock victim.",
+    'deadlock_retries_total': "Type creations retried after being chosen as deadlock victim.",
+    'files_succeeded_total': "Files processed and archived.",
+    'files_failed_total': "Files that failed completely.",
+    'files_leased_total': "Files this node claimed from a shared watch folder.",
+    'leases_reclaimed_total': "Files returned to the watch folder after their node stopped sending heartbeats.",
+    'leases_lost_total': "Files this node stopped writing because another node reclaimed them.",
+    'batches_in_flight': "Batches currently being written.",
+    'backlog_files_remaining': "Startup backlog files not processed yet.",
+    'backlog_bytes_remaining': "Size of the startup backlog files not processed yet.",
+    'backlog_eta_seconds': "Estimated seconds to drain the startup backlog, -1 until the first file is done.",
+    'last_file_rows_per_second': "Rows per second of the last processed file, from claim to last commit.",
+}
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _header(lines, name, metric_type):
+    if name in HELP:
+        lines.append(f"# HELP {PREFIX}_{name} {HELP[name]}")
+    lines.append(f"# TYPE {PREFIX}_{name} {metric_type}")
+
+
+def render_metrics(metrics=None):
+    stages, counters, gauges = (metrics or stage_metrics).collect()
+    lines = []
+
+    if stages:
+        _header(lines, 'stage_duration_seconds', 'histogram')
+        for stage, entry in sorted(stages.items()):
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, entry['buckets']):
+                cumulative += count
+                lines.append(f'{PREFIX}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["calls"]}')
+            lines.append(f'{PREFIX}_stage_duration_seconds_sum{{stage="{stage}"}} {_format_value(entry["seconds"])}')
+            lines.append(f'{PREFIX}_stage_duration_seconds_count{{stage="{stage}"}} {entry["calls"]}')
+
+        _header(lines, 'stage_rows_total', 'counter')
+        for stage, entry in sorted(stages.items()):
+            lines.append(f'{PREFIX}_stage_rows_total{{stage="{stage}"}} {entry["rows"]}')
+
+        _header(lines, 'stage_rows_per_second', 'gauge')
+        for stage, entry in sorted(stages.items()):
+            rows_per_second = entry['rows'] / entry['seconds'] if entry['seconds'] else 0.0
+            lines.append(f'{PREFIX}_stage_rows_per_second{{stage="{stage}"}} {_format_value(rows_per_second)}')
+
+    for name, value in sorted(counters.items()):
+        _header(lines, f"{name}_total", 'counter')
+        lines.append(f"{PREFIX}_{name}_total {_format_value(value)}")
+
+    for name, value in sorted(gauges.items()):
+        _header(lines, name, 'gauge')
+        lines.append(f"{PREFIX}_{name} {_format_value(value)}")
+
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the application log
+        pass
+
+
+def write_textfile(path):
+    # node_exporter's textfile collector may read at any moment, so the file is replaced atomically
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(render_metrics())
+    os.replace(temp_path, path)
+
+
+class MetricsExporter:
+    def __init__(self, port=None, host=None, textfile_path=None, textfile_interval=None):
+        self.port = METRICS_CONFIG['port'] if port is None else port
+        self.host = host or METRICS_CONFIG['host']
+        self.textfile_path = textfile_path or METRICS_CONFIG['textfile_path']
+        self.textfile_interval = textfile_interval or METRICS_CONFIG['textfile_interval']
+        self._server = None
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.port:
+            self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+            self._server.daemon_threads = True
+            self._start_thread(self._server.serve_forever, 'metrics-http')
+            logging.info(f"Prometheus metrics served on http://{self.host}:{self.port}/metrics")
+
+        if self.textfile_path:
+            self._start_thread(self._write_textfile_loop, 'metrics-textfile')
+            logging.info(f"Prometheus metrics written to {self.textfile_path} every {self.textfile_interval}s")
+        return self
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _write_textfile_loop(self):
+        while not self._stopping.wait(self.textfile_interval):
+            try:
+                write_textfile(self.textfile_path)
+            except OSError as e:
+                logging.error(f"Error writing metrics textfile {self.textfile_path}: {e}")
+
+    def stop(self):
+        self._stopping.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self.textfile_path:
+            # Leave the final counters behind for the last scrape
+            try:
+                write_textfile(self.textfile_path)
+            except OSError as e:
+                logging.error(f"Error writing metrics textfile {self.textfile_path}: {e}")
+
+
+def start_metrics_exporter():
+    if not METRICS_CONFIG['port'] and not METRICS_CONFIG['textfile_path']:
+        return None
+    return MetricsExporter().start()
@@ -0,0 +1,90 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = ('read', 'clean', 'types', 'lookup', 'write', 'flush', 'commit', 'deadlock_retry', 'archive', 'file')
+
+# Upper bounds in seconds, one observation per recorded call (a chunk, a batch or a whole file)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class StageMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._gauges = {}
+        # Optional callable returning the current RSS in bytes, sampled when a stage ends
+        self.rss_probe = None
+
+    def record(self, stage, seconds, rows=0):
+        rss = self.rss_probe() if self.rss_probe is not None else None
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = {'calls': 0, 'rows': 0, 'seconds': 0.0, 'peak_rss': 0,
+                                               'buckets': [0] * len(DURATION_BUCKETS)}
+            entry['calls'] += 1
+            entry['rows'] += rows
+            entry['seconds'] += seconds
+            # Buckets are stored non-cumulative, the exporter sums them up
+            bucket = bisect.bisect_left(DURATION_BUCKETS, seconds)
+            if bucket < len(DURATION_BUCKETS):
+                entry['buckets'][bucket] += 1
+            if rss is not None:
+                entry['peak_rss'] = max(entry['peak_rss'], rss)
+
+    @contextmanager
+    def time(self, stage, rows=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, rows)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def add_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + value
+
+    def calls(self, stage):
+        with self._lock:
+            entry = self._stages.get(stage)
+            return entry['calls'] if entry is not None else 0
+
+    def snapshot(self):
+        with self._lock:
+            # Seconds are summed over all worker threads, so rows/sec is the throughput of one busy worker
+            return {
+                stage: {
+                    'calls': entry['calls'],
+                    'rows': entry['rows'],
+                    'seconds': round(entry['seconds'], 4),
+                    'rows_per_sec': round(entry['rows'] / entry['seconds'], 1) if entry['seconds'] else 0.0,
+                    'peak_rss_mb': round(entry['peak_rss'] / 1024 / 1024, 1),
+                }
+                for stage, entry in self._stages.items()
+            }
+
+    def collect(self):
+        # Raw copy for the exporter: stages with their histogram buckets, counters and gauges
+        with self._lock:
+            stages = {stage: dict(entry, buckets=list(entry['buckets'])) for stage, entry in self._stages.items()}
+            return stages, dict(self._counters), dict(self._gauges)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            # Gauges describe the current state and are kept, batches may still be in flight
+            self._counters.clear()
+
+
+stage_metrics = StageMetrics()
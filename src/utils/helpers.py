@@ -1,7 +1,14 @@
 import os
+import logging
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 def ensure_directory_exists(directory_path):
     if not os.path.exists(directory_path):
         os.makedirs(directory_path)
@@ -10,53 +17,99 @@ def get_timestamp():
     return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 
-def clean_data_frame(df, target_columns=None):
-    try:
-        string_columns = ['name', 'type', 'phone', 'full_address', 'state',
-                          'location_link', 'place_id', 'google_id', 'country', 'country_code', 'time_zone']
-        for col in string_columns:
-            if col in df.columns:
-                df[col] = df[col].fillna('')
-                df[col] = df[col].astype(str)
-                df[col] = df[col].replace(r'\.0$', '', regex=True)
-                df[col] = df[col].replace({'nan': '', 'None': '', 'NaN': ''})
+STRING_COLUMNS = ['name', 'type', 'phone', 'full_address', 'state',
+                  'location_link', 'place_id', 'google_id', 'country', 'country_code', 'time_zone']
+FLOAT_COLUMNS = ['latitude', 'longitude', 'rating']
+INT_COLUMNS = ['reviews', 'reviews_per_score_1', 'reviews_per_score_2',
+               'reviews_per_score_3', 'reviews_per_score_4',
+               'reviews_per_score_5', 'photos_count', 'cid']
+# Review counts fit small integer types, cid needs all 64 bits
+COMPACT_INT_COLUMNS = ['reviews', 'reviews_per_score_1', 'reviews_per_score_2',
+                       'reviews_per_score_3', 'reviews_per_score_4',
+                       'reviews_per_score_5', 'photos_count']
+NULL_STRINGS = ['nan', 'None', 'NaN']
+# Text columns with at most this share of distinct values become categoricals (type, state, country, time_zone)
+CATEGORY_MAX_SHARE = 0.5
+
+INT64_MIN = np.iinfo(np.int64).min
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def _clean_string_column(series, compact=False, max_length=None):
+    values = series.fillna('').astype(str)
+
+    # Text columns repeat heavily (types, states, countries), so the string work runs once per distinct value
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=values.dtype)
+    uniques = uniques.str.replace(r'\.0$', '', regex=True)
+    uniques = uniques.mask(uniques.isin(NULL_STRINGS), '')
+    if max_length is not None:
+        uniques = uniques.str[:max_length]
+
+    if compact and len(uniques) <= len(values) * CATEGORY_MAX_SHARE:
+        # Cleaning can map several raw values to the same string, categories must be unique
+        category_codes, categories = pd.factorize(uniques)
+        return pd.Series(pd.Categorical.from_codes(category_codes[codes], categories), index=series.index,
+                         name=series.name)
+
+    cleaned = uniques.take(codes)
+    cleaned.index = series.index
+    cleaned.name = series.name
+    if compact and pyarrow is not None:
+        # Arrow keeps the characters in one buffer instead of a Python object per row
+        cleaned = cleaned.astype(pd.StringDtype('pyarrow'))
+    return cleaned
 
 
-        float_columns = ['latitude', 'longitude', 'rating']
-        for col in float_columns:
+def _clean_float_column(series):
+    return pd.to_numeric(series, errors='coerce').fillna(0.0).astype(float)
+
+
+def _clean_int_column(series, compact=False):
+    values = pd.to_numeric(series, errors='coerce').fillna(0)
+    if values.dtype.kind == 'f':
+        in_range = (values >= INT64_MIN) & (values <= INT64_MAX)
+    elif values.dtype.kind == 'u':
+        in_range = values <= INT64_MAX
+    else:
+        in_range = None
+
+    if in_range is not None:
+        out_of_range = int((~in_range).sum())
+        if out_of_range:
+            # Values outside int64 cannot be stored, they are written as 0 like any other unparseable value
+            logging.warning(f"{out_of_range} {series.name} values outside the int64 range were set to 0")
+        values = values.where(in_range, 0)
+    values = values.astype(int)
+    if compact and series.name in COMPACT_INT_COLUMNS:
+        # Smallest signed type holding every value, negative counts from dirty exports stay as they are
+        values = pd.to_numeric(values, downcast='integer')
+    return values
+
+
+def clean_data_frame(df, target_columns=None, compact=False):
+    try:
+        for col in STRING_COLUMNS:
             if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                df[col] = df[col].fillna(0.0)
-                df[col] = df[col].apply(
-                    lambda x: 0.0 if not isinstance(x, (int, float)) or pd.isna(x) else float(x))
-                df[col] = df[col].astype(float)
+                df[col] = _clean_string_column(df[col], compact)
 
+        for col in FLOAT_COLUMNS:
+            if col in df.columns:
+                df[col] = _clean_float_column(df[col])
 
-        int_columns = ['reviews', 'reviews_per_score_1', 'reviews_per_score_2',
-                       'reviews_per_score_3', 'reviews_per_score_4',
-                       'reviews_per_score_5', 'photos_count', 'cid']
-        for col in int_columns:
+        for col in INT_COLUMNS:
             if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                df[col] = df[col].fillna(0)
-                df[col] = df[col].apply(lambda x: 0 if not isinstance(x, (int, float)) or pd.isna(x) else int(x))
-                df[col] = df[col].astype(int)
+                df[col] = _clean_int_column(df[col], compact)
 
         if 'verified' in df.columns:
-            df['verified'] = pd.to_numeric(df['verified'], errors='coerce')
-            df['verified'] = df['verified'].fillna(0)
-            df['verified'] = df['verified'].apply(lambda x: bool(x) if isinstance(x, (int, float)) else False)
+            df['verified'] = pd.to_numeric(df['verified'], errors='coerce').fillna(0).astype(bool)
 
         if 'postal_code' in df.columns:
-            df['postal_code'] = df['postal_code'].fillna('')
-            df['postal_code'] = df['postal_code'].astype(str)
-            df['postal_code'] = df['postal_code'].replace(r'\.0$', '', regex=True)
-            df['postal_code'] = df['postal_code'].replace({'nan': '', 'None': '', 'NaN': ''})
-            df['postal_code'] = df['postal_code'].str[:25]
+            df['postal_code'] = _clean_string_column(df['postal_code'], compact, max_length=25)
 
         return df
 
     except Exception as e:
         import logging
         logging.error(f"Error cleaning data frame: {e}")
-        return df
\ No newline at end of file
+        return df
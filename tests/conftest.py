@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.configurations.config import EXCEL_CONFIG, TARGET_COLUMNS
+
+LOCATION_COLUMNS = ['GoogleId', 'PlaceId', 'Name', 'Type', 'Phone', 'FullAddress', 'PostalCode', 'State',
+                    'Latitude', 'Longitude', 'Verified', 'LocationLink', 'Country', 'CountryCode', 'Timezone']
+METRIC_COLUMNS = ['Rating', 'Reviews', 'ReviewsPerScore1', 'ReviewsPerScore2', 'ReviewsPerScore3',
+                  'ReviewsPerScore4', 'ReviewsPerScore5', 'PhotosCount']
+
+
+def make_export(rows, places, seed=0, blank_share=0.1):
+    # Rows of an Outscraper export with blank text and coordinates left by partial scrapes. Every run of
+    # `places` rows holds each place once, so with a batch size dividing `places` a place repeats across
+    # batches but never inside one
+    rng = np.random.default_rng(seed)
+    place = np.concatenate([rng.permutation(places) for _ in range(-(-rows // places))])[:rows]
+    blank = rng.random(rows) < blank_share
+    data = {
+        'name': [f"Place {p}" if not b else '' for p, b in zip(place, blank)],
+        'type': [f"Type {p % 7}" for p in place],
+        'phone': [f"+1 555-{p:04d}" if not b else '' for p, b in zip(place, blank)],
+        'full_address': [f"{p} Main St, Run {seed}" for p in place],
+        'postal_code': [f"{10000 + p}" for p in place],
+        'state': [f"State {p % 5}" for p in place],
+        'latitude': np.where(blank, 0.0, np.round(rng.uniform(-90, 90, size=rows), 4)),
+        'longitude': np.where(blank, 0.0, np.round(rng.uniform(-180, 180, size=rows), 4)),
+        'rating': np.round(rng.uniform(1, 5, size=rows), 1),
+        'reviews': rng.integers(0, 5000, size=rows),
+        'photos_count': rng.integers(0, 900, size=rows),
+        'verified': rng.integers(0, 2, size=rows).astype(bool),
+        'location_link': [f"https://maps.google.com/?cid={p}" for p in place],
+        'place_id': [f"ChIJ{p:010d}" for p in place],
+        'google_id': [f"0x{p:x}:0x{p * 7:x}" for p in place],
+        'cid': place.astype(np.int64) * 1000003,
+        'country': ['United States'] * rows,
+        'country_code': ['US'] * rows,
+        'time_zone': ['America/New_York'] * rows,
+    }
+    for score in range(1, 6):
+        data[f'reviews_per_score_{score}'] = rng.integers(0, 1000, size=rows)
+    return pd.DataFrame(data)[[col for col in TARGET_COLUMNS if col in data]]
+
+
+def _rounded(row):
+    return tuple(round(float(value), 4) if isinstance(value, float) else value for value in row)
+
+
+def table_snapshot(session):
+    # Locations with their latest metric, and every metric by the GoogleId of its location; Ids are random per run
+    from src.database.models import OutscraperLocation, OutscraperLocationMetric
+
+    locations = sorted(
+        _rounded([getattr(location, col) for col in LOCATION_COLUMNS] +
+                 [getattr(location.latest_metric, col) for col in METRIC_COLUMNS])
+        for location in session.query(OutscraperLocation))
+    metrics = sorted(
+        _rounded([google_id] + list(values))
+        for google_id, *values in session.query(OutscraperLocation.GoogleId,
+                                                *[getattr(OutscraperLocationMetric, col) for col in METRIC_COLUMNS])
+        .join(OutscraperLocationMetric, OutscraperLocationMetric.LocationId == OutscraperLocation.Id))
+    return locations, metrics
+
+
+@pytest.fixture
+def archive_folder(tmp_path, monkeypatch):
+    folder = tmp_path / 'archive'
+    monkeypatch.setitem(EXCEL_CONFIG, 'archive_folder', str(folder))
+    return folder
@@ -0,0 +1,44 @@
+import logging
+import numpy as np
+import pandas as pd
+from benchmarks.clean_data_frame import legacy_clean_data_frame, make_dirty_frame
+from src.utils.helpers import clean_data_frame
+
+
+def test_matches_legacy_output():
+    frame = make_dirty_frame(5000, seed=3)
+    pd.testing.assert_frame_equal(clean_data_frame(frame.copy()), legacy_clean_data_frame(frame.copy()))
+
+
+def test_golden_output():
+    df = pd.DataFrame({
+        'name': ['Cafe', None, 'nan', 12.0],
+        'postal_code': [12345.0, 'None', None, 'A' * 30],
+        'rating': ['4.5', 'n/a', None, 3],
+        'reviews': ['12', '3.7', 'n/a', None],
+        'verified': [1, 0, 'yes', None],
+    })
+    expected = pd.DataFrame({
+        'name': ['Cafe', '', '', '12'],
+        'postal_code': ['12345', '', '', 'A' * 25],
+        'rating': [4.5, 0.0, 0.0, 3.0],
+        'reviews': [12, 3, 0, 0],
+        'verified': [True, False, False, False],
+    })
+    pd.testing.assert_frame_equal(clean_data_frame(df), expected)
+
+
+def test_counts_outside_int64_are_zeroed_and_logged(caplog):
+    df = pd.DataFrame({'reviews': [5.0, 1e20, -1e20, np.nan]})
+    with caplog.at_level(logging.WARNING):
+        cleaned = clean_data_frame(df)
+    assert cleaned['reviews'].tolist() == [5, 0, 0, 0]
+    assert "2 reviews values outside the int64 range were set to 0" in caplog.text
+
+
+def test_compact_holds_the_same_values():
+    frame = make_dirty_frame(5000, seed=4)
+    plain = clean_data_frame(frame.copy())
+    compact = clean_data_frame(frame.copy(), compact=True)
+    assert compact.memory_usage(deep=True).sum() < plain.memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(compact.astype(plain.dtypes.to_dict()), plain)
@@ -0,0 +1,35 @@
+import pandas as pd
+from src.excel.batch_builder import coalesce_places
+from src.utils.helpers import clean_data_frame
+
+
+def test_coalesce_keeps_last_non_empty_value():
+    df = clean_data_frame(pd.DataFrame({
+        'google_id': ['a', 'b', 'a', '', 'a'],
+        'name': ['First', 'Other', 'Second', 'No id', ''],
+        'phone': ['111', '222', '', '', ''],
+        'latitude': [1.5, 2.0, 3.5, 4.0, 0.0],
+        'rating': [1.0, 2.0, 3.0, 4.0, 5.0],
+        'reviews': [10, 20, 30, 40, 50],
+    }))
+
+    coalesced, folded = coalesce_places(df)
+
+    assert folded == 2
+    # Each place sits where its last row was, rows without a google_id are kept as they are
+    assert coalesced['google_id'].tolist() == ['b', '', 'a']
+    place = coalesced.iloc[2]
+    assert place['name'] == 'Second'
+    assert place['phone'] == '111'
+    assert place['latitude'] == 3.5
+    # Metrics are the last row's, even where they are zero or empty
+    assert place['rating'] == 5.0
+    assert place['reviews'] == 50
+    assert coalesced.iloc[1]['name'] == 'No id'
+
+
+def test_coalesce_without_duplicates_returns_frame_unchanged():
+    df = clean_data_frame(pd.DataFrame({'google_id': ['a', 'b'], 'name': ['A', 'B']}))
+    coalesced, folded = coalesce_places(df)
+    assert folded == 0
+    assert coalesced is df
@@ -0,0 +1,44 @@
+import pytest
+from conftest import make_export
+from src.database.metric_fingerprints import MetricFingerprintCache
+from src.database.models import OutscraperLocation, OutscraperLocationMetric
+from src.database.sqlite_standin import get_sqlite_session_factory
+from src.excel.processor import ExcelProcessor
+
+CHANGED = 10
+
+
+def _processor(write_mode, session_factory):
+    processor = ExcelProcessor(batch_size=50, max_workers=1, write_mode=write_mode, session_factory=session_factory,
+                               delta=True, fingerprints=MetricFingerprintCache(), coalesce_duplicates=False)
+    processor.warm_up()
+    return processor
+
+
+@pytest.mark.parametrize('write_mode', ['orm', 'merge', 'core'])
+def test_unchanged_metrics_are_skipped(tmp_path, archive_folder, write_mode):
+    session_factory = get_sqlite_session_factory(str(tmp_path / 'locations.db'))
+    first = make_export(200, 100, seed=1)
+    first.to_csv(tmp_path / 'first.csv', index=False)
+    assert _processor(write_mode, session_factory).process_file(str(tmp_path / 'first.csv'))
+
+    # The latest metrics of every place again, a few with a new rating and all with a new name
+    second = first.drop_duplicates('google_id', keep='last').reset_index(drop=True)
+    second.loc[:CHANGED - 1, 'rating'] = 0.5
+    second['name'] = 'Renamed ' + second['google_id']
+    second.to_csv(tmp_path / 'second.csv', index=False)
+    # A new process warms its fingerprints from the database
+    assert _processor(write_mode, session_factory).process_file(str(tmp_path / 'second.csv'))
+
+    session = session_factory()
+    try:
+        assert session.query(OutscraperLocationMetric).count() == 200 + CHANGED
+        locations = session.query(OutscraperLocation).all()
+        assert len(locations) == 100
+        # Location fields are still updated when the metric is skipped
+        assert all(location.Name == f"Renamed {location.GoogleId}" for location in locations)
+        changed = set(second['google_id'][:CHANGED])
+        for location in locations:
+            assert (float(location.latest_metric.Rating) == 0.5) == (location.GoogleId in changed)
+    finally:
+        session.close()
@@ -0,0 +1,64 @@
+import threading
+import time
+import pytest
+from conftest import make_export
+from src.configurations.config import DB_CONFIGS
+from src.database.models import get_models
+from src.database.sqlite_standin import get_sqlite_session_factory
+from src.excel.fanout import FanOutProcessor
+
+ROWS = 400
+BATCH_SIZE = 25
+SLOW_BATCH_SECONDS = 0.03
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_slow_target_does_not_hold_back_fast_target(tmp_path, archive_folder, streaming):
+    make_export(ROWS, 100).to_csv(tmp_path / 'export.csv', index=False)
+    session_factories = {target: get_sqlite_session_factory(str(tmp_path / f"{target}.db"),
+                                                            get_models(DB_CONFIGS[target]))
+                         for target in ('primary', 'secondary')}
+    processor = FanOutProcessor(targets=['primary', 'secondary'], session_factories=session_factories,
+                                batch_size=BATCH_SIZE, max_workers=1, write_mode='core', streaming=streaming,
+                                chunk_size=100, coalesce_duplicates=False)
+    slow = processor.targets['secondary']
+    slow_batches = []
+    slow_batches_when_fast_done = []
+    lock = threading.Lock()
+
+    write_batch = slow._write_batch
+
+    def slow_write_batch(batch, *args):
+        time.sleep(SLOW_BATCH_SECONDS)
+        results = write_batch(batch, *args)
+        with lock:
+            slow_batches.append(len(batch))
+        return results
+
+    slow._write_batch = slow_write_batch
+    fast = processor.targets['primary']
+    write_file = fast._write_file
+
+    def fast_write_file(*args):
+        succeeded = write_file(*args)
+        with lock:
+            slow_batches_when_fast_done.append(len(slow_batches))
+        return succeeded
+
+    fast._write_file = fast_write_file
+    try:
+        assert processor.process_file(str(tmp_path / 'export.csv'))
+    finally:
+        processor.close()
+
+    assert len(slow_batches) == ROWS // BATCH_SIZE
+    if not streaming:
+        # A loaded file is not bounded, the fast target is done long before the slow one
+        assert slow_batches_when_fast_done[0] < ROWS // BATCH_SIZE // 2
+    for target, session_factory in session_factories.items():
+        session = session_factory()
+        try:
+            assert session.query(get_models(DB_CONFIGS[target]).OutscraperLocationMetric).count() == ROWS
+        finally:
+            session.close()
+    assert not (tmp_path / 'export.csv').exists()
@@ -0,0 +1,189 @@
+import glob
+import multiprocessing
+import os
+import time
+import pytest
+from benchmarks.generator import generate_outscraper_frame, write_input_file
+
+FILES = 6
+PLACES = 200
+HEARTBEAT_INTERVAL = 0.2
+TIMEOUT = 1.5
+
+
+def _input_files(watch_folder):
+    # Files in the watch folder or still leased by a node, glob would skip the hidden lease folder
+    return [os.path.join(folder, name) for folder, _, names in os.walk(watch_folder)
+            for name in names if name.endswith('.csv')]
+
+
+def _run_node(root, node_id, write_mode, results):
+    from src.configurations.config import EXCEL_CONFIG
+    from src.database.location_index import LocationIndex
+    from src.database.sqlite_standin import get_sqlite_session_factory
+    from src.database.type_cache import LocationTypeCache
+    from src.excel.processor import ExcelProcessor
+    from src.monitoring.file_leases import FileLeases
+
+    watch_folder = os.path.join(root, 'watch')
+    EXCEL_CONFIG['watch_folder'] = watch_folder
+    EXCEL_CONFIG['archive_folder'] = os.path.join(root, 'archive')
+    leases = FileLeases(watch_folder, node_id=node_id, heartbeat_interval=HEARTBEAT_INTERVAL, timeout=TIMEOUT).start()
+    session_factory = get_sqlite_session_factory(os.path.join(root, 'locations.db'))
+    processor = ExcelProcessor(write_mode=write_mode, batch_size=50, max_workers=2, session_factory=session_factory,
+                               type_cache=LocationTypeCache(), location_index=LocationIndex(), leases=leases)
+    processor.warm_up()
+
+    processed = 0
+    deadline = time.monotonic() + 60
+    # Runs until every file is archived, including the ones reclaimed from the crashed node
+    while _input_files(watch_folder) and time.monotonic() < deadline:
+        processed += processor.watch_folder()
+        time.sleep(0.1)
+    processor.close()
+    leases.stop()
+    results.put((node_id, processed))
+
+
+def _crash_node(root):
+    from src.monitoring.file_leases import FileLeases
+
+    watch_folder = os.path.join(root, 'watch')
+    leases = FileLeases(watch_folder, node_id='crashed', heartbeat_interval=HEARTBEAT_INTERVAL, timeout=TIMEOUT).start()
+    leases.claim(sorted(glob.glob(os.path.join(watch_folder, '*.csv')))[0])
+    # Exits without stop(), the claimed file stays in its lease folder until another node reclaims it
+    os._exit(0)
+
+
+@pytest.mark.parametrize('write_mode', ['orm', 'core'])
+def test_nodes_share_watch_folder(tmp_path, write_mode):
+    from src.database.models import OutscraperLocation, OutscraperLocationMetric
+    from src.database.sqlite_standin import get_sqlite_session_factory
+
+    root = str(tmp_path)
+    watch_folder = os.path.join(root, 'watch')
+    os.makedirs(watch_folder)
+    # Every file holds the same places, so nodes keep finding places another node inserted after they warmed up
+    places = generate_outscraper_frame(PLACES, duplicate_share=0.0, dirty_share=0.0, seed=7)
+    file_names = []
+    for i in range(FILES):
+        file_names.append(f"export_{i}.csv")
+        write_input_file(places.sample(frac=1, random_state=i), os.path.join(watch_folder, file_names[-1]))
+    # Creates the schema before the nodes start
+    session_factory = get_sqlite_session_factory(os.path.join(root, 'locations.db'))
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    crashed = context.Process(target=_crash_node, args=(root,))
+    crashed.start()
+    crashed.join()
+    nodes = [context.Process(target=_run_node, args=(root, f"node{i}", write_mode, results)) for i in range(3)]
+    for node in nodes:
+        node.start()
+    processed = dict(results.get(timeout=120) for _ in nodes)
+    for node in nodes:
+        node.join()
+
+    assert all(node.exitcode == 0 for node in nodes)
+    assert _input_files(watch_folder) == []
+    # Archived as <timestamp>_<name>, every file exactly once
+    archived = sorted(os.path.basename(path).split('_', 1)[1]
+                      for path in glob.glob(os.path.join(root, 'archive', '*.csv')))
+    assert archived == sorted(file_names)
+    # Files another node processed are not counted by this one
+    assert sum(processed.values()) == FILES
+
+    session = session_factory()
+    try:
+        assert session.query(OutscraperLocation).count() == PLACES
+        assert session.query(OutscraperLocationMetric).count() == PLACES * FILES
+    finally:
+        session.close()
+
+
+def _stalled_node_loses_file(tmp_path, write_mode, reclaim_after_batches):
+    # Node A writes part of the file and stalls past the timeout, node B reclaims the file and finishes it
+    from conftest import make_export
+    from src.database.sqlite_standin import get_sqlite_session_factory
+    from src.excel.processor import ExcelProcessor
+    from src.monitoring.file_leases import FileLeases, SKIPPED
+
+    watch_folder = tmp_path / 'watch'
+    watch_folder.mkdir()
+    make_export(400, 100).to_csv(watch_folder / 'export.csv', index=False)
+    session_factory = get_sqlite_session_factory(str(tmp_path / 'locations.db'))
+    # Heartbeats are driven by the test, reclaim_expired is called with its own clock
+    stalled = FileLeases(str(watch_folder), node_id='stalled', heartbeat_interval=3600, timeout=1).start()
+    rescuer = FileLeases(str(watch_folder), node_id='rescuer', heartbeat_interval=3600, timeout=1).start()
+    rescuer.reclaim_expired(now=0)
+
+    def processor(leases):
+        return ExcelProcessor(write_mode=write_mode, batch_size=50, max_workers=1, session_factory=session_factory,
+                              leases=leases, coalesce_duplicates=False)
+
+    first = processor(stalled)
+    write_batch = first._write_batch
+    written = []
+
+    def write_then_stall(*args):
+        if len(written) == reclaim_after_batches:
+            rescuer.reclaim_expired(now=10)
+        results = write_batch(*args)
+        written.append(results)
+        return results
+
+    first._write_batch = write_then_stall
+    try:
+        assert first.process_file(str(watch_folder / 'export.csv')) == SKIPPED
+    finally:
+        first.close()
+    assert len(written) == reclaim_after_batches
+    assert (watch_folder / 'export.csv').exists()
+
+    second = processor(rescuer)
+    rescued = []
+    write_batch_second = second._write_batch
+    second._write_batch = lambda *args: rescued.append(args[0]) or write_batch_second(*args)
+    try:
+        assert second.process_file(str(watch_folder / 'export.csv')) is True
+    finally:
+        second.close()
+        stalled.stop()
+        rescuer.stop()
+    return session_factory, rescued
+
+
+@pytest.mark.parametrize('write_mode', ['orm', 'core', 'merge'])
+def test_reclaimed_file_resumes_from_shared_checkpoints(tmp_path, archive_folder, write_mode):
+    from src.database.models import OutscraperLocationMetric
+
+    session_factory, rescued = _stalled_node_loses_file(tmp_path, write_mode, reclaim_after_batches=3)
+    # The stalled node's batch after the reclaim was fenced off and rolled back, the rescuer wrote the rest once
+    assert sum(len(batch) for batch in rescued) == 400 - 3 * 50
+    session = session_factory()
+    try:
+        assert session.query(OutscraperLocationMetric).count() == 400
+    finally:
+        session.close()
+    assert len(list(archive_folder.glob('*export.csv'))) == 1
+    # Checkpoints of a finished file are removed
+    assert not list((tmp_path / 'watch' / '.leases' / 'checkpoints').glob('*.json'))
+
+
+def test_fence_after_reclaim(tmp_path):
+    from src.monitoring.file_leases import FileLeases, LeaseLost
+
+    (tmp_path / 'export.csv').write_text('google_id\n')
+    stalled = FileLeases(str(tmp_path), node_id='stalled', heartbeat_interval=3600, timeout=1).start()
+    rescuer = FileLeases(str(tmp_path), node_id='rescuer', heartbeat_interval=3600, timeout=1).start()
+    try:
+        leased_path = stalled.claim(str(tmp_path / 'export.csv'))
+        stalled.fence(leased_path)
+        rescuer.reclaim_expired(now=0)
+        assert rescuer.reclaim_expired(now=10) == 1
+        assert not stalled.owns(leased_path)
+        with pytest.raises(LeaseLost):
+            stalled.fence(leased_path)
+    finally:
+        stalled.stop()
+        rescuer.stop()
@@ -0,0 +1,47 @@
+import os
+import shutil
+from conftest import make_export
+from src.database.ingestion_ledger import IngestionLedger, hash_file
+from src.database.models import OutscraperLocationMetric
+from src.database.sqlite_standin import get_sqlite_session_factory
+from src.excel.processor import ExcelProcessor
+
+
+def _metric_count(session_factory):
+    session = session_factory()
+    try:
+        return session.query(OutscraperLocationMetric).count()
+    finally:
+        session.close()
+
+
+def test_same_content_is_ingested_once(tmp_path, archive_folder):
+    session_factory = get_sqlite_session_factory(str(tmp_path / 'locations.db'))
+    ledger_path = str(tmp_path / 'ledger.db')
+    first = str(tmp_path / 'export.csv')
+    make_export(200, 100).to_csv(first, index=False)
+    # The same bytes delivered again under another name
+    second = str(tmp_path / 'export_resent.csv')
+    shutil.copy(first, second)
+    content_hash = hash_file(first)
+
+    ledger = IngestionLedger(ledger_path)
+    processor = ExcelProcessor(write_mode='core', session_factory=session_factory, ledger=ledger,
+                               coalesce_duplicates=False)
+    assert processor.process_file(first)
+    ledger.close()
+    assert _metric_count(session_factory) == 200
+
+    # A restarted process reads the hashes back from the ledger file
+    ledger = IngestionLedger(ledger_path)
+    processor = ExcelProcessor(write_mode='core', session_factory=session_factory, ledger=ledger,
+                               coalesce_duplicates=False)
+    assert processor.process_file(second)
+    statuses = [row['Status'] for row in ledger.files_for_hash(content_hash)]
+    ledger.close()
+
+    assert _metric_count(session_factory) == 200
+    assert statuses == [IngestionLedger.SUCCEEDED, IngestionLedger.SKIPPED]
+    # The duplicate is archived like a processed file
+    assert not os.path.exists(second)
+    assert len(os.listdir(archive_folder)) == 2
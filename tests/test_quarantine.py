@@ -0,0 +1,49 @@
+import pandas as pd
+from conftest import make_export
+from src.configurations.config import EXCEL_CONFIG
+from src.database.models import OutscraperLocation, OutscraperLocationMetric
+from src.database.sqlite_standin import get_sqlite_session_factory
+from src.excel.processor import ExcelProcessor
+
+
+def test_rejected_rows_are_quarantined(tmp_path, archive_folder, monkeypatch):
+    monkeypatch.setitem(EXCEL_CONFIG, 'quarantine_folder', None)
+    export = make_export(100, 100, seed=5)
+    export.loc[3, 'rating'] = 7.5
+    export.loc[10, 'latitude'] = 120.0
+    export.loc[20, 'name'] = 'x' * 1500
+    export.loc[30, 'postal_code'] = '1' * 20
+    export.to_csv(tmp_path / 'export.csv', index=False)
+
+    session_factory = get_sqlite_session_factory(str(tmp_path / 'locations.db'))
+    processor = ExcelProcessor(batch_size=25, max_workers=2, write_mode='core', session_factory=session_factory,
+                               coalesce_duplicates=False, validate_rows=True)
+    assert processor.process_file(str(tmp_path / 'export.csv'))
+
+    quarantined = list((archive_folder / 'quarantine').glob('*_export.csv.csv'))
+    assert len(quarantined) == 1
+    rejected = pd.read_csv(quarantined[0], dtype=str)
+    assert rejected['google_id'].tolist() == export.loc[[3, 10, 20, 30], 'google_id'].tolist()
+    assert rejected['reason'].tolist() == [
+        'rating not a number between 0 and 5',
+        'latitude not a number between -90 and 90',
+        'name longer than 1000 characters',
+        'postal_code longer than 10 characters',
+    ]
+
+    session = session_factory()
+    try:
+        # The valid rows of the file are written normally
+        assert session.query(OutscraperLocation).count() == 96
+        assert session.query(OutscraperLocationMetric).count() == 96
+    finally:
+        session.close()
+
+
+def test_quarantine_folder_without_archive_folder(tmp_path, monkeypatch):
+    monkeypatch.setitem(EXCEL_CONFIG, 'quarantine_folder', None)
+    monkeypatch.setitem(EXCEL_CONFIG, 'archive_folder', None)
+    processor = ExcelProcessor(session_factory=get_sqlite_session_factory(str(tmp_path / 'locations.db')),
+                               validate_rows=True)
+    assert processor._quarantine_folder(str(tmp_path / 'watch' / 'export.xlsx')) == str(
+        tmp_path / 'watch' / 'quarantine')
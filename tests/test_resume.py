@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import pytest
+from conftest import make_export
+from src.database.ingestion_ledger import IngestionLedger, hash_file
+from src.database.models import OutscraperLocation, OutscraperLocationMetric
+from src.database.sqlite_standin import get_sqlite_session_factory, get_async_sqlite_session_factory
+from src.excel.processor import ExcelProcessor
+
+ROWS = 400
+CRASH_AFTER_BATCHES = 3
+
+
+def _crash_midway(root):
+    from src.configurations.config import EXCEL_CONFIG
+
+    EXCEL_CONFIG['archive_folder'] = os.path.join(root, 'archive')
+    ledger = IngestionLedger(os.path.join(root, 'ledger.db'))
+    checkpoint = ledger.checkpoint
+    checkpoints = []
+
+    def checkpoint_then_crash(*args):
+        checkpoint(*args)
+        checkpoints.append(args)
+        if len(checkpoints) == CRASH_AFTER_BATCHES:
+            os._exit(0)
+
+    ledger.checkpoint = checkpoint_then_crash
+    processor = ExcelProcessor(batch_size=50, max_workers=1, write_mode='core', ledger=ledger,
+                               session_factory=get_sqlite_session_factory(os.path.join(root, 'locations.db')),
+                               coalesce_duplicates=False)
+    processor.process_file(os.path.join(root, 'export.csv'))
+
+
+def test_resume_after_crash(tmp_path, archive_folder):
+    root = str(tmp_path)
+    make_export(ROWS, 100).to_csv(tmp_path / 'export.csv', index=False)
+    session_factory = get_sqlite_session_factory(str(tmp_path / 'locations.db'))
+
+    crashed = multiprocessing.get_context('spawn').Process(target=_crash_midway, args=(root,))
+    crashed.start()
+    crashed.join()
+    assert (tmp_path / 'export.csv').exists()
+
+    content_hash = hash_file(str(tmp_path / 'export.csv'))
+    ledger = IngestionLedger(str(tmp_path / 'ledger.db'))
+    assert ledger.committed_ranges(content_hash) == [(0, 150)]
+    # Resumed with another batch size, the checkpoints are row numbers of the cleaned file
+    processor = ExcelProcessor(batch_size=30, max_workers=2, write_mode='core', ledger=ledger,
+                               session_factory=session_factory, coalesce_duplicates=False)
+    assert processor.process_file(str(tmp_path / 'export.csv'))
+    assert ledger.committed_ranges(content_hash) == []
+    ledger.close()
+
+    session = session_factory()
+    try:
+        # Every row written exactly once across both runs
+        assert session.query(OutscraperLocationMetric).count() == ROWS
+    finally:
+        session.close()
+
+
+
+@pytest.mark.parametrize('async_mode', [False, True])
+def test_resume_after_request_stop(tmp_path, archive_folder, async_mode):
+    make_export(ROWS, 100).to_csv(tmp_path / 'export.csv', index=False)
+    path = str(tmp_path / 'locations.db')
+    session_factory = get_async_sqlite_session_factory(path) if async_mode else get_sqlite_session_factory(path)
+    ledger = IngestionLedger(str(tmp_path / 'ledger.db'))
+    processor = ExcelProcessor(batch_size=50, max_workers=1, write_mode='core', ledger=ledger,
+                               session_factory=session_factory, coalesce_duplicates=False, async_mode=async_mode)
+    checkpoint = ledger.checkpoint
+
+    def checkpoint_then_stop(*args):
+        checkpoint(*args)
+        processor.request_stop()
+
+    ledger.checkpoint = checkpoint_then_stop
+    # The batches already in flight finish and are checkpointed, the file stays in the watch folder
+    assert not processor.process_file(str(tmp_path / 'export.csv'))
+    processor.close()
+    assert (tmp_path / 'export.csv').exists()
+    content_hash = hash_file(str(tmp_path / 'export.csv'))
+    committed = ledger.committed_ranges(content_hash)
+    assert committed and committed[0][0] == 0 and committed[-1][1] < ROWS
+
+    ledger.checkpoint = checkpoint
+    processor = ExcelProcessor(batch_size=50, max_workers=2, write_mode='core', ledger=ledger,
+                               session_factory=get_sqlite_session_factory(path), coalesce_duplicates=False)
+    assert processor.process_file(str(tmp_path / 'export.csv'))
+    assert ledger.committed_ranges(content_hash) == []
+    ledger.close()
+
+    session = get_sqlite_session_factory(path)()
+    try:
+        assert session.query(OutscraperLocationMetric).count() == ROWS
+        assert session.query(OutscraperLocation).count() == 100
+    finally:
+        session.close()
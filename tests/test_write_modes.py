@@ -0,0 +1,36 @@
+import pytest
+from conftest import make_export, table_snapshot
+from src.database.sqlite_standin import get_sqlite_session_factory
+from src.excel.processor import ExcelProcessor
+
+
+def _ingest(tmp_path, write_mode, exports, coalesce):
+    session_factory = get_sqlite_session_factory(str(tmp_path / f"{write_mode}.db"))
+    # One writer, so the row order decides which values a location ends up with in every mode
+    processor = ExcelProcessor(batch_size=50, max_workers=1, write_mode=write_mode, session_factory=session_factory,
+                               coalesce_duplicates=coalesce)
+    for i, export in enumerate(exports):
+        path = tmp_path / f"{write_mode}_export_{i}.xlsx"
+        export.to_excel(path, index=False)
+        assert processor.process_file(str(path))
+
+    session = session_factory()
+    try:
+        return table_snapshot(session)
+    finally:
+        session.close()
+
+
+@pytest.mark.parametrize('coalesce', [True, False])
+@pytest.mark.parametrize('write_mode', ['merge', 'core'])
+def test_write_mode_matches_orm(tmp_path, archive_folder, write_mode, coalesce):
+    # The second export updates places of the first, both repeat places across batches
+    exports = [make_export(400, 100, seed=1), make_export(300, 150, seed=2)]
+    expected_locations, expected_metrics = _ingest(tmp_path, 'orm', exports, coalesce)
+    locations, metrics = _ingest(tmp_path, write_mode, exports, coalesce)
+
+    assert len(expected_locations) == 150
+    # Coalescing leaves one metric per place and file
+    assert len(expected_metrics) == (100 + 150 if coalesce else 700)
+    assert locations == expected_locations
+    assert metrics == expected_metrics